@@ -0,0 +1,244 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from collections import deque
+from dataclasses import astuple, dataclass
+from datetime import datetime, timedelta
+
+from sqlite_worker import SQLiteWorker
+
+FILTER_RE = re.compile(r"(админ|перс|с|по)=(\S+)", re.IGNORECASE)
+DATE_RE = re.compile(r"^(\d{1,2})\.(\d{1,2})\.(\d{4})$")
+# passwords typed into "⌨️ Выполнить команду" must not end up in the audit file
+SECRET_COMMAND_RE = re.compile(
+    r"^(\s*\.?account\s+(?:create\s+\S+|set\s+password\s+\S+|password))\s.*$", re.IGNORECASE | re.DOTALL
+)
+
+COLUMNS = "created_at, actor_id, action, realm, target, command, result, duration"
+
+
+@dataclass
+class AuditRecord:
+    created_at: float
+    actor_id: int
+    action: str
+    realm: str | None
+    target: str | None
+    command: str
+    result: str
+    duration: float
+    id: int | None = None
+
+
+@dataclass(frozen=True)
+class AuditFilters:
+    actor_id: int | None = None
+    target: str | None = None
+    since: float | None = None
+    until: float | None = None
+
+
+def redact_command(command: str) -> str:
+    return SECRET_COMMAND_RE.sub(r"\1 ***", command)
+
+
+def parse_audit_date(text: str) -> datetime | None:
+    match = DATE_RE.match(text)
+    if not match:
+        return None
+    day, month, year = match.groups()
+    try:
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def parse_audit_filters(text: str) -> AuditFilters | None:
+    """Parse "админ=123456 перс=Arthas с=01.05.2024 по=31.05.2024"; "-" means no filters, None means invalid input."""
+    text = text.strip()
+    if text in ("", "-"):
+        return AuditFilters()
+    if FILTER_RE.sub("", text).strip():
+        return None
+    values = {}
+    for field, value in FILTER_RE.findall(text):
+        field = field.lower()
+        if field == "админ":
+            if not value.isdigit():
+                return None
+            values["actor_id"] = int(value)
+        elif field == "перс":
+            values["target"] = value
+        else:
+            day = parse_audit_date(value)
+            if day is None:
+                return None
+            if field == "с":
+                values["since"] = day.timestamp()
+            else:
+                values["until"] = (day + timedelta(days=1)).timestamp()  # the whole day is included
+    return AuditFilters(**values)
+
+
+class AuditLog(SQLiteWorker):
+    """Admin actions recorded in a local SQLite file, written in batches.
+
+    `record()` only appends to an in-memory buffer, so a handler does no disk I/O for its
+    audit entry. A background task writes the buffer in one transaction per `batch_size`
+    records, every `flush_interval` seconds or as soon as a full batch is waiting. While the
+    file cannot be written at most `max_buffer` records are kept; older ones are dropped and
+    counted. `stop()` writes whatever is still buffered.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_buffer: int = 10000,
+        result_length: int = 1000,
+    ):
+        super().__init__(path, "audit")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.result_length = result_length
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self._dropped_reported = 0
+        self._buffer: deque[AuditRecord] = deque()
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def _setup(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS audit_log ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "created_at REAL NOT NULL, "
+            "actor_id INTEGER NOT NULL, "
+            "action TEXT NOT NULL, "
+            "realm TEXT, "
+            "target TEXT COLLATE NOCASE, "
+            "command TEXT NOT NULL, "
+            "result TEXT NOT NULL, "
+            "duration REAL NOT NULL)"
+        )
+        # one index per filter of the admin view; each ends with created_at for the newest-first order
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_log (actor_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_target ON audit_log (target, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_audit_time ON audit_log (created_at)")
+
+    def record(
+        self,
+        actor_id: int,
+        action: str,
+        command: str,
+        result: str,
+        duration: float,
+        target: str | None = None,
+        realm: str | None = None,
+    ):
+        self._buffer.append(AuditRecord(
+            created_at=time.time(),
+            actor_id=actor_id,
+            action=action,
+            realm=realm,
+            target=target,
+            command=redact_command(command),
+            result=result[:self.result_length],
+            duration=duration,
+        ))
+        self._trim()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _trim(self):
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            for _ in range(overflow):
+                self._buffer.popleft()
+            self.dropped += overflow
+
+    def _insert(self, batch: list[AuditRecord]):
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                f"INSERT INTO audit_log ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [astuple(record)[:-1] for record in batch],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self) -> int:
+        """Write the buffered records; returns how many were written."""
+        written = 0
+        async with self._lock:
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                try:
+                    await self._run_sql(self._insert, batch)
+                except Exception as e:
+                    logging.error(f"Audit: failed to write {len(batch)} records: {e}")
+                    self._buffer.extendleft(reversed(batch))
+                    self._trim()
+                    break
+                written += len(batch)
+                self.written += len(batch)
+                self.batches += 1
+        if self.dropped > self._dropped_reported:
+            # reported once per flush rather than per record, a full buffer means a burst of them
+            logging.warning(f"Audit: buffer full, dropped {self.dropped - self._dropped_reported} oldest records")
+            self._dropped_reported = self.dropped
+        return written
+
+    def _query(self, filters: AuditFilters, limit: int) -> list[AuditRecord]:
+        conditions, params = [], []
+        if filters.actor_id is not None:
+            conditions.append("actor_id = ?")
+            params.append(filters.actor_id)
+        if filters.target:
+            conditions.append("target = ?")
+            params.append(filters.target)
+        if filters.since is not None:
+            conditions.append("created_at >= ?")
+            params.append(filters.since)
+        if filters.until is not None:
+            conditions.append("created_at < ?")
+            params.append(filters.until)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        rows = self._connect().execute(
+            f"SELECT {COLUMNS}, id FROM audit_log {where}ORDER BY created_at DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [AuditRecord(*row) for row in rows]
+
+    async def query(self, filters: AuditFilters, limit: int = 20) -> list[AuditRecord]:
+        """Newest records matching the filters, including ones still in the buffer."""
+        await self.flush()
+        return await self._run_sql(self._query, filters, limit)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def stop(self):
+        await self._stop_task()
+        written = await self.flush()
+        if written:
+            logging.info(f"Audit: wrote {written} buffered records on shutdown")
+        await self._close()
@@ -0,0 +1,1029 @@
+"""Benchmarks for the bot; run `python3 bench.py --help` for the available suites."""
+import argparse
+import asyncio
+import functools
+import html
+import itertools
+import os
+import random
+import re
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import timeit
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+import soap_codec
+
+SAMPLE_COMMAND = 'send items Arthas "Compensation" "Sorry for the downtime & lag <3" 49623:1 17:20'
+PLAIN_COMMAND = "server info"
+SAMPLE_INFO = (
+    "AzerothCore rev. 1234567 2024-01-01 (Unix, RelWithDebInfo, Static)\r\n"
+    "Connected players: 1532. Characters in world: 1611.\r\n"
+    "Connection peak: 2011.\r\n"
+    "Server uptime: 3 Day(s) 4 Hour(s) 12 Minute(s) 7 Second(s)\r\n"
+    "Update time diff: 41ms, average: 38ms.\r\n"
+)
+SAMPLE_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" '
+    'xmlns:SOAP-ENC="http://schemas.xmlsoap.org/soap/encoding/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    'xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:ns1="urn:AC">'
+    "<SOAP-ENV:Body><ns1:executeCommandResponse><result>"
+    + SAMPLE_INFO.replace("\r", "&#xD;")
+    + "</result></ns1:executeCommandResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>"
+).encode("utf-8")
+
+
+# --- previous implementation, kept as the baseline for comparison ---
+def legacy_build_payload(command: str) -> str:
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+    <soap:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+                   xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+                   xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+      <soap:Body>
+        <executeCommand xmlns="urn:AC">
+          <command>{command}</command>
+        </executeCommand>
+      </soap:Body>
+    </soap:Envelope>""".encode("utf-8")
+
+
+def legacy_parse_response(content: bytes) -> str:
+    root = ET.fromstring(content)
+    result_element = root.find('.//result')
+    return result_element.text.strip() if result_element.text else ""
+
+
+def legacy_parse_server_info(result: str) -> dict:
+    players = re.search(r"Connected players:\s*(\d+)", result)
+    characters = re.search(r"Characters in world:\s*(\d+)", result)
+    uptime = re.search(r"Server uptime:\s*(.+?)\r", result)
+    return {
+        "players": players.group(1) if players else None,
+        "characters": characters.group(1) if characters else None,
+        "uptime": uptime.group(1) if uptime else None,
+    }
+
+
+def report(name: str, func, number: int):
+    best = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{name:<32} {best / number * 1e6:8.2f} µs/op")
+
+
+def bench_codec(args):
+    assert soap_codec.parse_server_info(SAMPLE_INFO) == legacy_parse_server_info(SAMPLE_INFO)
+    assert soap_codec.decode_response(SAMPLE_RESPONSE).result == legacy_parse_response(SAMPLE_RESPONSE)
+
+    n = args.number
+    report("envelope: legacy f-string", lambda: legacy_build_payload(SAMPLE_COMMAND), n)
+    # the legacy builder sends "&" and "<" unescaped; this is what it costs once it escapes
+    report("envelope: legacy + escape()", lambda: legacy_build_payload(escape(SAMPLE_COMMAND)), n)
+    report("envelope: codec template (escaped)", lambda: soap_codec.build_envelope(SAMPLE_COMMAND), n)
+    report("envelope: legacy, plain command", lambda: legacy_build_payload(PLAIN_COMMAND), n)
+    report("envelope: legacy+escape, plain", lambda: legacy_build_payload(escape(PLAIN_COMMAND)), n)
+    report("envelope: codec, plain command", lambda: soap_codec.build_envelope(PLAIN_COMMAND), n)
+    report("response: legacy ET.fromstring", lambda: legacy_parse_response(SAMPLE_RESPONSE), n)
+    report("response: codec byte scanner", lambda: soap_codec.decode_response(SAMPLE_RESPONSE), n)
+    report("server info: legacy 3 regexes", lambda: legacy_parse_server_info(SAMPLE_INFO), n)
+    report("server info: codec precompiled", lambda: soap_codec.parse_server_info(SAMPLE_INFO), n)
+
+
+
+# --- dispatch: reply-keyboard buttons, a filter per button vs one dict lookup ---
+MAIN_BUTTONS = ["🛎 Услуги", "📜 Мои персонажи", "👥 Онлайн игроки", "📥 Регистрация", "🔐 Смена пароля", "🛠️ Админ панель"]
+ADMIN_BUTTONS = [
+    "⌨️ Выполнить команду", "✉️ Отправить письмо", "💰 Отправить золото", "🎁 Отправить предмет", "⛔ Забанить",
+    "🔓 Разбанить", "🔄 Рестарт сервера", "🌐 Игроки онлайн", "📦 Массовая отправка", "📣 Объявление",
+    "📊 Объявления", "▶️ Продолжить рассылку",
+]
+GM_ROWS = [["🔐 Смена пароля"], ["👥 Онлайн игроки"], ["📜 Мои персонажи"], ["🛎 Услуги", "🛠️ Админ панель"]]
+
+
+def build_dispatch_routers(state_handlers: int):
+    """Routers with the same handlers: per-button F.text filters and an if-chain as before, then button
+    menus with bare State filters, then button menus with StateFilter."""
+    from aiogram import F, Router
+    from aiogram.filters import StateFilter
+    from aiogram.fsm.state import State, StatesGroup
+
+    from buttons import ButtonMenu
+
+    async def noop(message):
+        pass
+
+    async def admin_chain(message):
+        action = message.text.strip()
+        for text in ADMIN_BUTTONS:
+            if action == text:
+                return
+
+    groups = [type(f"Bench{i}", (StatesGroup,), {"step": State()}) for i in range(state_handlers)]
+    steps = [group.step for group in groups]
+    admin = type("AdminPanelState", (StatesGroup,), {"choice": State()}).choice
+
+    legacy = Router()
+    for text in MAIN_BUTTONS:
+        legacy.message.register(noop, F.text == text)
+    for step in steps:
+        legacy.message.register(noop, step)
+    legacy.message.register(admin_chain, admin)
+
+    routers = [legacy]
+    for wrap in (lambda state: state, StateFilter):
+        router = Router()
+        main_menu, admin_menu = ButtonMenu(), ButtonMenu()
+        main_menu.register(router)
+        for text in MAIN_BUTTONS:
+            main_menu.button(text)(noop)
+        for step in steps:
+            router.message.register(noop, wrap(step))
+        admin_menu.register(router, wrap(admin))
+        for text in ADMIN_BUTTONS:
+            admin_menu.button(text)(noop)
+        router.message.register(noop, wrap(admin))
+        routers.append(router)
+    return routers, steps[-1].state, admin.state
+
+
+def bench_dispatch(args):
+    from aiogram.types import Chat, KeyboardButton, Message, ReplyKeyboardMarkup
+
+    from buttons import reply_keyboard
+
+    routers, last_step, admin_choice = build_dispatch_routers(args.state_handlers)
+
+    def message(text: str) -> Message:
+        return Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"), text=text)
+
+    cases = [
+        ("last main menu button", message(MAIN_BUTTONS[-1]), None),
+        ("last admin panel button", message(ADMIN_BUTTONS[-1]), admin_choice),
+        ("text in the last FSM step", message("Arthas"), last_step),
+        ("text matching nothing", message("привет"), None),
+    ]
+
+    async def per_update(router, event, raw_state) -> float:
+        best = float("inf")
+        for _ in range(5):
+            start = time.perf_counter()
+            for _ in range(args.number):
+                await router.message.trigger(event, raw_state=raw_state)
+            best = min(best, time.perf_counter() - start)
+        return best / args.number * 1e6
+
+    async def run():
+        # a bare State (or F.text) is a sync filter, which aiogram runs in the default thread pool
+        print(f"{'µs per update':<28} {'F.text+State':>12} {'menu+State':>11} {'menu+StateFilter':>17}")
+        for name, event, raw_state in cases:
+            costs = [await per_update(router, event, raw_state) for router in routers]
+            print(f"{name:<28} {costs[0]:12.2f} {costs[1]:11.2f} {costs[2]:17.2f}")
+
+    asyncio.run(run())
+
+    def build_per_message():
+        return ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=text) for text in row] for row in GM_ROWS], resize_keyboard=True
+        )
+
+    prebuilt = reply_keyboard(GM_ROWS)
+    report("keyboard: built per message", build_per_message, args.number)
+    report("keyboard: prebuilt", lambda: prebuilt, args.number)
+
+# --- load test: router handlers against local SOAP and database stand-ins ---
+class SQLitePool:
+    """SQLite stand-in for db.MySQLPool: same async interface, MySQL placeholders, optional latency.
+
+    The characters database is attached under its MySQL name, so the cross-database
+    JOIN queries in main.py run unchanged.
+    """
+
+    def __init__(
+        self,
+        auth_path: str,
+        characters_path: str,
+        characters_name: str,
+        size: int = 5,
+        latency: float = 0.0,
+        connect_latency: float = 0.0,
+    ):
+        self.auth_path = auth_path
+        self.characters_path = characters_path
+        self.characters_name = characters_name
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.name = "sqlite"
+        self.size = size
+        self.in_use = 0
+        self.pending = 0
+        self.errors = 0
+        self.opened = 0
+        self._local = threading.local()
+        self._warm_lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="sqlite-bench")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.connect_latency:
+                time.sleep(self.connect_latency)
+            conn = sqlite3.connect(self.auth_path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute(f"ATTACH DATABASE ? AS `{self.characters_name}`", (self.characters_path,))
+            self._local.conn = conn
+            self.opened += 1
+        return conn
+
+    def _call(self, func, *args):
+        if self.latency:
+            time.sleep(self.latency)
+        self.in_use += 1
+        cursor = _SQLiteCursor(self._connection().cursor())
+        try:
+            return func(cursor, *args)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_use -= 1
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(self._executor, self._call, func, *args)
+        finally:
+            self.pending -= 1
+
+    def _open(self, barrier: threading.Barrier):
+        self._connection()
+        # hold the thread until every warm-up task has one, so each lands on its own thread
+        barrier.wait(timeout=10)
+
+    async def warm(self, connections: int) -> int:
+        # the bench shares one pool between auth and characters, so the checks warm it one at a time
+        async with self._warm_lock:
+            count = min(connections, self.size) - self.opened
+            if count <= 0:
+                return 0
+            barrier = threading.Barrier(count)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(loop.run_in_executor(self._executor, self._open, barrier) for _ in range(count)))
+            return count
+
+    async def fetchone(self, query: str, params: tuple = ()):
+        def _fetchone(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        return await self.run(_fetchone)
+
+    async def fetchall(self, query: str, params: tuple = ()) -> list:
+        def _fetchall(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        return await self.run(_fetchall)
+
+    async def execute(self, query: str, params: tuple = ()) -> int:
+        def _execute(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount
+        return await self.run(_execute)
+
+    def connect(self) -> "_SQLiteConnection":
+        conn = sqlite3.connect(self.auth_path, check_same_thread=False)
+        conn.execute(f"ATTACH DATABASE ? AS `{self.characters_name}`", (self.characters_path,))
+        return _SQLiteConnection(conn)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _SQLiteConnection:
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def cursor(self) -> "_SQLiteCursor":
+        return _SQLiteCursor(self._conn.cursor())
+
+    def close(self):
+        self._conn.close()
+
+
+class _SQLiteCursor:
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, params: tuple = ()):
+        return self._cursor.execute(query.replace("%s", "?"), params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+def seed_databases(auth_path: str, characters_path: str, accounts: int, characters_per_account: int = 2):
+    """Accounts user1..userN bound to telegram ids 100001..; account 1 is a GM."""
+    auth = sqlite3.connect(auth_path)
+    auth.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "CREATE TABLE account (id INTEGER PRIMARY KEY, username TEXT UNIQUE COLLATE NOCASE, email TEXT, "
+        "last_login TEXT, joindate TEXT DEFAULT '2023-06-01 12:00:00', online INTEGER DEFAULT 0, "
+        "expansion INTEGER DEFAULT 2);"
+        "CREATE INDEX account_email ON account (email);"
+        "CREATE TABLE account_access (id INTEGER, gmlevel INTEGER);"
+        "CREATE TABLE telegram_binding (telegram_id INTEGER PRIMARY KEY, account_id INTEGER NOT NULL UNIQUE);"
+    )
+    auth.executemany(
+        "INSERT INTO account (id, username, email, last_login) VALUES (?, ?, ?, ?)",
+        ((i, f"user{i}", str(100000 + i), f"2024-01-01 00:{i % 60:02d}:00") for i in range(1, accounts + 1)),
+    )
+    auth.execute("INSERT INTO telegram_binding (telegram_id, account_id) SELECT CAST(email AS INTEGER), id FROM account")
+    auth.execute("INSERT INTO account_access (id, gmlevel) VALUES (1, 3)")
+    auth.commit()
+    auth.close()
+
+    characters = sqlite3.connect(characters_path)
+    characters.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "CREATE TABLE characters (guid INTEGER PRIMARY KEY, account INTEGER, name TEXT UNIQUE, "
+        "level INTEGER, class INTEGER, zone INTEGER, online INTEGER, race INTEGER DEFAULT 1, "
+        "gender INTEGER DEFAULT 0, money INTEGER DEFAULT 0, totaltime INTEGER DEFAULT 0, logout_time INTEGER DEFAULT 0);"
+        "CREATE INDEX characters_account ON characters (account);"
+        "CREATE INDEX idx_online ON characters (online, guid);"
+    )
+    rng = random.Random(1)
+    characters.executemany(
+        "INSERT INTO characters (account, name, level, class, zone, online) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (i, f"Char{i}x{j}", rng.randint(1, 80), rng.choice((1, 2, 3, 4, 5, 6, 7, 8, 9, 11)),
+             rng.choice((1519, 1637, 3703, 4395)), int(rng.random() < 0.3))
+            for i in range(1, accounts + 1)
+            for j in range(characters_per_account)
+        ),
+    )
+    characters.commit()
+    characters.close()
+
+
+class FakeWorldServer:
+    """Local SOAP endpoint answering like an AzerothCore worldserver, with latency and error injection."""
+
+    def __init__(
+        self, db: SQLitePool, latency: float = 0.02, jitter: float = 0.01, error_rate: float = 0.0, hang: bool = False
+    ):
+        self.db = db
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang = hang
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(2)
+        self._runner: web.AppRunner | None = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.read()
+        match = re.search(rb"<command>(.*?)</command>", body, re.S)
+        command = html.unescape(match.group(1).decode("utf-8")) if match else ""
+        if self.hang:
+            # a frozen worldserver: accepts the connection and never answers
+            await asyncio.sleep(3600)
+        await asyncio.sleep(max(0.0, self._rng.gauss(self.latency, self.jitter)))
+        if self._rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, reason="Internal Server Error")
+        try:
+            result = await self._execute(command)
+        except ValueError as e:
+            # a command the worldserver refuses comes back as a SOAP fault with HTTP 500
+            return web.Response(status=500, body=self._fault(str(e)), content_type="text/xml")
+        return web.Response(body=self._envelope(result), content_type="text/xml")
+
+    async def _execute(self, command: str) -> str:
+        words = command.split()
+        if command == "server info":
+            return SAMPLE_INFO
+        if words[:2] == ["account", "create"] and len(words) >= 4:
+            if not await self.db.execute("INSERT OR IGNORE INTO account (username) VALUES (%s)", (words[2],)):
+                raise ValueError("Account with this name already exist!")
+            return f"Account created: {words[2]}"
+        if words[:3] == ["account", "set", "password"]:
+            return "The password was changed"
+        return f"Command executed: {command}"
+
+    @staticmethod
+    def _envelope(result: str) -> bytes:
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="urn:AC">'
+            "<SOAP-ENV:Body><ns1:executeCommandResponse><result>"
+            + escape(result).replace("\r", "&#xD;")
+            + "</result></ns1:executeCommandResponse></SOAP-ENV:Body></SOAP-ENV:Envelope>"
+        ).encode("utf-8")
+
+    @staticmethod
+    def _fault(message: str) -> bytes:
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/">'
+            "<SOAP-ENV:Body><SOAP-ENV:Fault><faultcode>SOAP-ENV:Client</faultcode><faultstring>"
+            + escape(message)
+            + "</faultstring></SOAP-ENV:Fault></SOAP-ENV:Body></SOAP-ENV:Envelope>"
+        ).encode("utf-8")
+
+    async def start(self, host: str = "127.0.0.1") -> str:
+        app = web.Application()
+        app.router.add_post("/", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/"
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+def make_telegram_session():
+    """Bot session that answers every API call locally instead of calling Telegram."""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import GetMe, SendMessage
+    from aiogram.types import Chat, Message, User
+
+    class LocalSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self._ids = itertools.count(1)
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if isinstance(method, SendMessage):
+                return Message(
+                    message_id=next(self._ids),
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=method.text,
+                ).as_(bot)
+            if isinstance(method, GetMe):
+                return User(id=1, is_bot=True, first_name="bench", username="bench_bot")
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return LocalSession()
+
+
+LOAD_FLOWS = {
+    "start": lambda user: ["/start"],
+    "register": lambda user: ["📥 Регистрация", f"bench{user}", "secret123"],
+    "services": lambda user: ["🛎 Услуги", f"Char{user}x0", "🔁 Смена пола"],
+    "characters": lambda user: ["📜 Мои персонажи"],
+    "online": lambda user: ["👥 Онлайн игроки"],
+}
+
+
+def percentiles(samples: list[float]) -> tuple[float, float, float]:
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+async def start_local_bot(args, workdir: str):
+    """main.py wired to SQLite, fake worldservers and a local Telegram session."""
+    # main.py reads its configuration at import time
+    os.environ.update({
+        "TOKEN": "123456:BENCH",
+        "SOAP_USER": "bench",
+        "SOAP_PASS": "bench",
+        "SOAP_URL": "http://127.0.0.1:1/",
+        "SOAP_TIMEOUT": str(args.soap_timeout),
+        "BREAKER_FAILURE_THRESHOLD": str(args.breaker_threshold),
+        "SOAP_QUEUE_PATH": os.path.join(workdir, "soap_queue.sqlite3"),
+        "LOG_PATH": os.path.join(workdir, "bot.log"),
+        "METRICS_PORT": "0",
+        "RATE_LIMIT_USER_RATE": "1000000",
+        "RATE_LIMIT_USER_BURST": "1000000",
+        "RATE_LIMIT_SOAP_RATE": "1000000",
+        "RATE_LIMIT_SOAP_BURST": "1000000",
+        "RATE_LIMIT_MYSQL_RATE": "1000000",
+        "RATE_LIMIT_MYSQL_BURST": "1000000",
+    })
+    if args.realms > 1:
+        os.environ["REALMS"] = ",".join(str(i) for i in range(1, args.realms + 1))
+        for i in range(1, args.realms + 1):
+            os.environ[f"REALM_{i}_NAME"] = f"Realm {i}"
+    import main as bot_main
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+
+    auth_path = os.path.join(workdir, "auth.sqlite3")
+    characters_path = os.path.join(workdir, "characters.sqlite3")
+    seed_databases(auth_path, characters_path, args.accounts)
+    db = SQLitePool(
+        auth_path, characters_path, bot_main.DB_CHARACTERS_DATABASE, args.db_pool, args.db_latency, args.db_connect_latency
+    )
+    bot_main.auth_db = bot_main.registration.pool = db
+    # every realm reads the same seeded characters but talks to its own worldserver
+    servers = []
+    for realm in bot_main.REALMS:
+        realm.characters_db = db
+        server = FakeWorldServer(db, args.soap_latency, args.soap_jitter, args.soap_error_rate, args.soap_hang)
+        realm.soap.url = await server.start()
+        servers.append(server)
+
+    session = make_telegram_session()
+    bot = Bot(token=os.environ["TOKEN"], session=session)
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(bot_main.router)
+    return bot_main, db, servers, session, bot, dp
+
+
+async def stop_local_bot(bot_main, db: SQLitePool, servers: list[FakeWorldServer], dp):
+    for realm in bot_main.REALMS:
+        await realm.soap.close()
+    await dp.storage.close()
+    for server in servers:
+        await server.stop()
+    db.close()
+
+
+def flow_update(update_id: int, telegram_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": {"id": telegram_id, "is_bot": False, "first_name": "bench"},
+            "text": text,
+        },
+    }
+
+
+def flow_user(args, flow: str, user: int) -> tuple[int, list[str]]:
+    """Telegram id and messages of one flow run.
+
+    Registration uses fresh telegram ids, everything else a seeded account; every flow
+    gets its own users so concurrent flows never share one FSM state.
+    """
+    slot = args.flows.index(flow) * args.users + user
+    telegram_id = 900000 + slot if flow == "register" else 100000 + (slot % args.accounts) + 1
+    texts = LOAD_FLOWS[flow](telegram_id - 100000 if flow != "register" else slot)
+    if flow == "services" and args.realms > 1:
+        texts.insert(1, f"Realm {slot % args.realms + 1}")
+    return telegram_id, texts
+
+
+async def run_load(args, workdir: str):
+    from aiogram.types import Update
+
+    bot_main, db, servers, session, bot, dp = await start_local_bot(args, workdir)
+    log_listener = bot_main.start_logging() if args.log else None
+    if args.warmup:
+        bot_main.add_startup_checks(bot)
+        await bot_main.readiness.run()
+        primed = await bot_main.prime_account_cache(bot_main.ACCOUNT_CACHE_PRIME)
+        print(f"startup checks passed: {bot_main.readiness.ready}, ready after {bot_main.readiness.ready_after:.3f}s, "
+              f"{primed} accounts primed")
+    bot_main.soap_queue.start(bot)
+
+    ids = itertools.count(1)
+    gate = asyncio.Semaphore(args.concurrency)
+    update_latencies: list[float] = []
+    flow_latencies: dict[str, list[float]] = {flow: [] for flow in args.flows}
+
+    async def run_flow(flow: str, user: int):
+        telegram_id, texts = flow_user(args, flow, user)
+        async with gate:
+            flow_start = time.perf_counter()
+            for text in texts:
+                update = Update.model_validate(flow_update(next(ids), telegram_id, text), context={"bot": bot})
+                start = time.perf_counter()
+                await dp.feed_update(bot, update)
+                update_latencies.append(time.perf_counter() - start)
+            flow_latencies[flow].append(time.perf_counter() - flow_start)
+
+    tasks = [(flow, user) for user in range(args.users) for flow in args.flows]
+    random.Random(3).shuffle(tasks)
+    started = time.perf_counter()
+    await asyncio.gather(*(run_flow(flow, user) for flow, user in tasks))
+    elapsed = time.perf_counter() - started
+
+    queue_started = time.perf_counter()
+    while await bot_main.soap_queue._run_sql(
+        lambda: bot_main.soap_queue._connect().execute(
+            "SELECT COUNT(*) FROM soap_jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()[0]
+    ):
+        await asyncio.sleep(0.05)
+    queue_elapsed = time.perf_counter() - queue_started
+
+    print(f"{len(update_latencies)} updates in {elapsed:.2f}s: {len(update_latencies) / elapsed:.0f} updates/sec")
+    print(f"{'flow':<12} {'runs':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    first_wave = update_latencies[:args.concurrency]
+    for flow, samples in [("(update)", update_latencies), ("(first)", first_wave), *flow_latencies.items()]:
+        p50, p95, p99 = percentiles(samples)
+        print(f"{flow:<12} {len(samples):>6} {p50 * 1000:9.2f} {p95 * 1000:9.2f} {p99 * 1000:9.2f}")
+    print(
+        f"SOAP queue drained {queue_elapsed:.2f}s after the last update; "
+        f"worldservers saw {sum(server.requests for server in servers)} requests "
+        f"({sum(server.errors for server in servers)} injected errors); "
+        f"{session.calls} Telegram API calls; throttling {bot_main.throttling.stats()}; "
+        f"coalescing {bot_main.single_flight.stats()}; "
+        f"circuits {[(breaker.name, breaker.state, breaker.rejected) for breaker in bot_main.breakers]}"
+    )
+
+    await bot_main.soap_queue.stop()
+    if "register" in args.flows:
+        bound = (await db.fetchone(
+            "SELECT COUNT(*) FROM account WHERE username LIKE 'bench%' "
+            "AND (email <> '' OR id IN (SELECT account_id FROM telegram_binding))"
+        ))[0]
+        print(f"registrations bound to telegram: {bound} in {bot_main.registration.batches} UPDATE batches")
+    await stop_local_bot(bot_main, db, servers, dp)
+    if log_listener is not None:
+        log_listener.stop()
+
+
+def bench_load(args):
+    unknown = set(args.flows) - LOAD_FLOWS.keys()
+    if unknown:
+        raise SystemExit(f"unknown flows: {', '.join(sorted(unknown))}; available: {', '.join(LOAD_FLOWS)}")
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        asyncio.run(run_load(args, workdir))
+
+
+# --- webhook: the same flows posted over HTTP to the aiohttp webhook app ---
+async def run_webhook_bench(args, workdir: str):
+    import aiohttp
+    from webhook import build_webhook_app
+
+    os.environ["WEBHOOK_SECRET"] = "bench-secret"
+    bot_main, db, servers, session, bot, dp = await start_local_bot(args, workdir)
+    path = bot_main.WEBHOOK_PATH
+    runner = web.AppRunner(build_webhook_app(dp, bot, path, bot_main.WEBHOOK_SECRET), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{path}"
+    bot_main.soap_queue.start(bot)
+
+    # the app answers Telegram at once and handles the update in the background,
+    # so a flow sends its next message only after the previous one was handled
+    handled: dict[int, asyncio.Event] = {}
+
+    async def mark_handled(handler, update, data):
+        try:
+            return await handler(update, data)
+        finally:
+            handled[update.update_id].set()
+
+    dp.update.outer_middleware(mark_handled)
+
+    ids = itertools.count(1)
+    gate = asyncio.Semaphore(args.concurrency)
+    accept_latencies: list[float] = []
+    update_latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    headers = {"X-Telegram-Bot-Api-Secret-Token": bot_main.WEBHOOK_SECRET}
+    client = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency))
+
+    async def post(update: dict, secret_headers: dict) -> int:
+        handled[update["update_id"]] = done = asyncio.Event()
+        start = time.perf_counter()
+        async with client.post(url, json=update, headers=secret_headers) as response:
+            await response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+        if response.status == 200:
+            accept_latencies.append(time.perf_counter() - start)
+            await done.wait()
+            update_latencies.append(time.perf_counter() - start)
+        return response.status
+
+    async def run_flow(flow: str, user: int):
+        telegram_id, texts = flow_user(args, flow, user)
+        async with gate:
+            for text in texts:
+                await post(flow_update(next(ids), telegram_id, text), headers)
+
+    try:
+        rejected = await post(flow_update(next(ids), 100001, "/start"), {})
+        statuses.clear()
+        tasks = [(flow, user) for user in range(args.users) for flow in args.flows]
+        random.Random(3).shuffle(tasks)
+        started = time.perf_counter()
+        await asyncio.gather(*(run_flow(flow, user) for flow, user in tasks))
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.close()
+        await bot_main.soap_queue.stop()
+        await runner.cleanup()
+        await stop_local_bot(bot_main, db, servers, dp)
+
+    print(f"{len(update_latencies)} updates POSTed to {path} and handled in {elapsed:.2f}s: "
+          f"{len(update_latencies) / elapsed:.0f} updates/sec")
+    print(f"{'latency':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, samples in [("(accepted)", accept_latencies), ("(handled)", update_latencies)]:
+        p50, p95, p99 = percentiles(samples)
+        print(f"{name:<12} {p50 * 1000:9.2f} {p95 * 1000:9.2f} {p99 * 1000:9.2f}")
+    print(f"HTTP statuses {statuses}; without the secret header: {rejected}; {session.calls} Telegram API calls")
+
+
+def bench_webhook(args):
+    unknown = set(args.flows) - LOAD_FLOWS.keys()
+    if unknown:
+        raise SystemExit(f"unknown flows: {', '.join(sorted(unknown))}; available: {', '.join(LOAD_FLOWS)}")
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        asyncio.run(run_webhook_bench(args, workdir))
+
+
+# --- export: streamed report files against a large seeded characters table ---
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> list[float]:
+    """How late a ticker wakes up while something else runs; what every handler waits on top of its own work."""
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def run_export(args, workdir: str):
+    import gzip
+    import csv
+    import io
+    import tracemalloc
+
+    from export import CHARACTERS_EXPORT_QUERY, Export, ExportService
+
+    auth_path = os.path.join(workdir, "auth.sqlite3")
+    characters_path = os.path.join(workdir, "characters.sqlite3")
+    seed_databases(auth_path, characters_path, args.accounts)
+    db = SQLitePool(auth_path, characters_path, "acore_characters")
+    query = CHARACTERS_EXPORT_QUERY.replace("FROM characters", "FROM acore_characters.characters")
+
+    async def fetchall_on_loop() -> tuple[int, int]:
+        # the ad-hoc way: whole result in memory, then formatted and compressed in one go
+        rows = await db.fetchall(query, (1,))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["guid", "account", "name", "race", "class", "gender", "level", "money", "totaltime",
+                         "online", "logout_time"])
+        writer.writerows(rows)
+        data = gzip.compress(buffer.getvalue().encode("utf-8"), compresslevel=6)
+        return len(rows), len(data)
+
+    async def streamed(export_format: str) -> tuple[int, int]:
+        service = ExportService(workdir, chunk_size=args.chunk_size, progress_interval=0.5)
+
+        async def on_progress(export: Export):
+            pass
+
+        export = await service.run(Export("characters", export_format, query, (1,)), db.connect, on_progress)
+        os.remove(export.path)
+        service.close()
+        return export.rows, export.size
+
+    variants = [("fetchall, CSV on the loop", fetchall_on_loop)]
+    variants += [(f"streamed {fmt.upper()}", functools.partial(streamed, fmt)) for fmt in ("csv", "json")]
+    print(f"{args.accounts * 2} characters")
+    print(f"{'variant':<26} {'seconds':>8} {'rows/s':>9} {'file MB':>8} {'peak MB':>8} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for name, func in variants:
+        tracemalloc.start()
+        stop = asyncio.Event()
+        probe = asyncio.create_task(measure_loop_lag(stop))
+        started = time.perf_counter()
+        rows, size = await func()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        lags = await probe
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _, _, p99 = percentiles(lags)
+        print(
+            f"{name:<26} {elapsed:8.2f} {rows / elapsed:9.0f} {size / 1e6:8.1f} {peak / 1e6:8.1f} "
+            f"{p99 * 1000:11.2f} {max(lags) * 1000:11.2f}"
+        )
+    db.close()
+
+
+def bench_export(args):
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        asyncio.run(run_export(args, workdir))
+
+
+# --- soap: a slow worldserver command must not hold up the fast ones ---
+async def run_soap(args):
+    from soap import SoapClient
+
+    async def handle(request: web.Request) -> web.Response:
+        match = re.search(rb"<command>(.*?)</command>", await request.read(), re.S)
+        command = html.unescape(match.group(1).decode("utf-8")) if match else ""
+        await asyncio.sleep(args.slow if command == "slow" else args.latency)
+        return web.Response(body=FakeWorldServer._envelope(f"Command executed: {command}"), content_type="text/xml")
+
+    app = web.Application()
+    app.router.add_post("/", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    client = SoapClient(
+        f"http://127.0.0.1:{port}/", "bench", "bench",
+        pool_size=args.pool, max_concurrency=args.concurrency, timeout=args.slow + 5,
+    )
+
+    async def timed(command: str) -> tuple[float, str]:
+        start = time.perf_counter()
+        result = await client.call(command)
+        return time.perf_counter() - start, result
+
+    try:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(measure_loop_lag(stop))
+        slow = asyncio.create_task(timed("slow"))
+        while client.in_flight == 0:
+            await asyncio.sleep(0)  # the slow call holds its connection before the fast ones start
+        started = time.perf_counter()
+        fast = await asyncio.gather(*(timed(f"fast {i}") for i in range(args.fast)))
+        elapsed = time.perf_counter() - started
+        slow_pending = not slow.done()
+        slow_duration, slow_result = await slow
+        stop.set()
+        lags = await probe
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+    durations = [duration for duration, _ in fast]
+    failed = [result for _, result in fast if result.startswith("❌")]
+    p50, p95, p99 = percentiles(durations)
+    print(f"slow command: {slow_duration:.2f}s ({slow_result})")
+    print(f"{args.fast} fast commands in {elapsed:.2f}s, {args.fast / elapsed:.0f} calls/s, {len(failed)} failed")
+    print(f"fast latency ms: p50 {p50 * 1000:.1f}  p95 {p95 * 1000:.1f}  p99 {p99 * 1000:.1f}  max {max(durations) * 1000:.1f}")
+    print(f"loop lag max ms: {max(lags) * 1000:.2f}")
+    if failed or not slow_pending:
+        raise SystemExit("head-of-line blocking: the fast commands waited for the slow one")
+    print("no head-of-line blocking: all fast commands finished while the slow one was pending")
+
+
+def bench_soap(args):
+    asyncio.run(run_soap(args))
+
+
+# --- queue: secret jobs across webhook workers sharing one queue file ---
+async def run_queue(args, workdir: str):
+    from soap_queue import LOST_SECRET_RESULT, SoapJobQueue
+
+    path = os.path.join(workdir, "soap_queue.sqlite3")
+    ran_by: dict[int, list[str]] = {}
+    results: dict[int, str] = {}
+
+    def make_worker() -> SoapJobQueue:
+        async def send(job) -> str:
+            ran_by.setdefault(job.id, []).append(worker.owner)
+            if len(ran_by[job.id]) == 1:
+                raise ConnectionError("worldserver restarting")  # every job goes through a retry
+            await asyncio.sleep(args.latency)
+            return f"Account created: {job.payload['login']}"
+
+        worker = SoapJobQueue(path, send, backoff_base=0.05, poll_interval=0.01)
+
+        @worker.handler("account_create")
+        async def complete(bot, job, result):
+            results[job.id] = result
+
+        return worker
+
+    async def enqueue(worker: SoapJobQueue, prefix: str, count: int):
+        for i in range(count):
+            login = f"{prefix}{i}"
+            await worker.enqueue("account_create", f"account create {login} secret", 1, {"login": login},
+                                 idempotency_key=f"{worker.owner}:{login}", secret=True)
+
+    async def wait_done(expected: int):
+        deadline = time.monotonic() + 30
+        while len(results) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    workers = [make_worker() for _ in range(args.workers)]
+    for worker in workers:
+        worker.start(None)
+    started = time.perf_counter()
+    await asyncio.gather(*(enqueue(worker, f"w{i}-", args.jobs) for i, worker in enumerate(workers)))
+    await wait_done(args.workers * args.jobs)
+    elapsed = time.perf_counter() - started
+    lost = sum(result == LOST_SECRET_RESULT for result in results.values())
+    foreign = sum(len(set(owners)) > 1 for owners in ran_by.values())
+    print(f"{args.workers} workers, {len(results)} secret jobs done in {elapsed:.2f}s: "
+          f"{lost} lost, {foreign} run by a worker that did not enqueue them")
+
+    # a worker that stops with secret jobs still waiting: the others fail them instead of leaving them pending
+    results.clear()
+    leaving = workers.pop()
+    await enqueue(leaving, "left-", args.jobs)
+    await leaving.stop()
+    await wait_done(args.jobs)
+    orphans_lost = sum(result == LOST_SECRET_RESULT for result in results.values())
+    foreign += sum(len(set(owners)) > 1 for owners in ran_by.values())
+    print(f"stopped worker: {len(results) - orphans_lost} of {args.jobs} secret jobs finished before it stopped, "
+          f"{orphans_lost} failed by the others")
+    for worker in workers:
+        await worker.stop()
+    if lost or foreign or len(results) != args.jobs:
+        raise SystemExit("secret jobs were lost or claimed by the wrong worker")
+
+
+def bench_queue(args):
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as workdir:
+        asyncio.run(run_queue(args, workdir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    suites = parser.add_subparsers(dest="suite", required=True)
+
+    codec = suites.add_parser("codec", help="SOAP envelope/response codec micro-benchmarks")
+    codec.add_argument("--number", type=int, default=20000)
+    codec.set_defaults(func=bench_codec)
+
+    dispatch = suites.add_parser("dispatch", help="reply-keyboard button routing micro-benchmarks")
+    dispatch.add_argument("--number", type=int, default=1000)
+    dispatch.add_argument("--state-handlers", type=int, default=40, help="FSM step handlers registered besides the buttons")
+    dispatch.set_defaults(func=bench_dispatch)
+
+    # flows and stand-ins shared by the load and webhook suites
+    stand_ins = argparse.ArgumentParser(add_help=False)
+    stand_ins.add_argument("--flows", nargs="+", default=["start", "register", "services"], help=f"any of: {', '.join(LOAD_FLOWS)}")
+    stand_ins.add_argument("--users", type=int, default=500, help="runs of each flow")
+    stand_ins.add_argument("--concurrency", type=int, default=50, help="flows in progress at once")
+    stand_ins.add_argument("--accounts", type=int, default=10000, help="seeded accounts (two characters each)")
+    stand_ins.add_argument("--db-pool", type=int, default=5)
+    stand_ins.add_argument("--db-latency", type=float, default=0.001, help="seconds added to every query")
+    stand_ins.add_argument("--db-connect-latency", type=float, default=0.02, help="seconds to open a connection")
+    stand_ins.add_argument("--soap-latency", type=float, default=0.02, help="mean worldserver response time, seconds")
+    stand_ins.add_argument("--soap-jitter", type=float, default=0.01)
+    stand_ins.add_argument("--soap-error-rate", type=float, default=0.0, help="share of SOAP requests answered with HTTP 500")
+    stand_ins.add_argument("--soap-hang", action="store_true", help="worldservers accept requests and never answer")
+    stand_ins.add_argument("--soap-timeout", type=float, default=5.0)
+    stand_ins.add_argument("--breaker-threshold", type=int, default=5, help="failures that open a circuit; 0 disables")
+    stand_ins.add_argument("--realms", type=int, default=1, help="realms, each with its own fake worldserver")
+
+    load = suites.add_parser(
+        "load", parents=[stand_ins], help="drive router handlers with synthetic updates against local stand-ins"
+    )
+    load.add_argument("--warmup", action="store_true", help="run the startup checks and cache priming first")
+    load.add_argument("--log", action="store_true", help="write JSON logs to a temp file like production does")
+    load.set_defaults(func=bench_load)
+
+    webhook = suites.add_parser(
+        "webhook", parents=[stand_ins], help="POST the load flows to the webhook app with the secret header"
+    )
+    webhook.set_defaults(func=bench_webhook)
+
+    export = suites.add_parser("export", help="streamed CSV/JSON export against a seeded characters table")
+    export.add_argument("--accounts", type=int, default=100000, help="seeded accounts (two characters each)")
+    export.add_argument("--chunk-size", type=int, default=1000, help="rows fetched and written at a time")
+    export.set_defaults(func=bench_export)
+
+    soap = suites.add_parser("soap", help="one slow and many fast commands against a stub worldserver")
+    soap.add_argument("--fast", type=int, default=500, help="fast commands sent while the slow one runs")
+    soap.add_argument("--slow", type=float, default=3.0, help="seconds the slow command takes")
+    soap.add_argument("--latency", type=float, default=0.005, help="seconds a fast command takes")
+    soap.add_argument("--pool", type=int, default=10, help="keep-alive connections")
+    soap.add_argument("--concurrency", type=int, default=10, help="requests in flight at once")
+    soap.set_defaults(func=bench_soap)
+
+    queue = suites.add_parser("queue", help="secret SOAP jobs with several workers sharing the queue file")
+    queue.add_argument("--workers", type=int, default=2)
+    queue.add_argument("--jobs", type=int, default=100, help="secret jobs enqueued by each worker")
+    queue.add_argument("--latency", type=float, default=0.005, help="seconds a command takes")
+    queue.set_defaults(func=bench_queue)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import logging
+from typing import Callable
+
+from breaker import BackendUnavailable
+from db import MySQLPool
+
+BINDING_MODES = ("table", "compat", "email")
+
+CREATE_BINDING_TABLE = (
+    "CREATE TABLE IF NOT EXISTS telegram_binding ("
+    "telegram_id BIGINT UNSIGNED NOT NULL PRIMARY KEY, "
+    "account_id INT UNSIGNED NOT NULL, "
+    "bound_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+    "UNIQUE KEY telegram_binding_account (account_id))"
+)
+
+
+class TelegramBinding:
+    """Where the telegram_id of an account lives.
+
+    "table"  – the indexed telegram_binding table (run migrate_bindings.py first);
+    "compat" – read the table and fall back to account.email, write both;
+    "email"  – the legacy account.email column only.
+    """
+
+    def __init__(self, mode: str = "compat"):
+        if mode not in BINDING_MODES:
+            raise ValueError(f"unknown telegram binding mode {mode!r}, expected one of {BINDING_MODES}")
+        self.mode = mode
+
+    def account_id(self, telegram_id: int) -> tuple[str, tuple]:
+        """SQL expression for the account id bound to telegram_id, with its parameters."""
+        table = "(SELECT account_id FROM telegram_binding WHERE telegram_id = %s)"
+        email = "(SELECT id FROM account WHERE email = %s LIMIT 1)"
+        if self.mode == "table":
+            return table, (telegram_id,)
+        if self.mode == "email":
+            return email, (str(telegram_id),)
+        return f"COALESCE({table}, {email})", (telegram_id, str(telegram_id))
+
+    def bind_statements(self, bindings: list[tuple[str, int]]) -> list[tuple[str, tuple]]:
+        """Statements binding each (username, telegram_id) pair; one statement per storage.
+
+        In "compat" account.email is written first: it is what lookups fall back to, so the
+        binding holds even if the table write fails.
+        """
+        cases = " ".join("WHEN %s THEN %s" for _ in bindings)
+        placeholders = ", ".join("%s" for _ in bindings)
+        usernames = tuple(username for username, _ in bindings)
+        statements = []
+        if self.mode in ("compat", "email"):
+            statements.append((
+                f"UPDATE account SET email = CASE username {cases} END WHERE username IN ({placeholders})",
+                tuple(value for username, telegram_id in bindings for value in (username, str(telegram_id))) + usernames,
+            ))
+        if self.mode in ("table", "compat"):
+            # REPLACE drops an older binding of either the telegram id or the account
+            statements.append((
+                f"REPLACE INTO telegram_binding (telegram_id, account_id) "
+                f"SELECT CASE username {cases} END, id FROM account WHERE username IN ({placeholders})",
+                tuple(value for username, telegram_id in bindings for value in (username, telegram_id)) + usernames,
+            ))
+        return statements
+
+    def recipients_query(self) -> str:
+        """Keyset query of (account_id, telegram_id) pairs after an account id."""
+        if self.mode == "table":
+            return (
+                "SELECT account_id, telegram_id FROM telegram_binding "
+                "WHERE account_id > %s ORDER BY account_id LIMIT %s"
+            )
+        return "SELECT id, email FROM account WHERE id > %s AND email <> '' ORDER BY id LIMIT %s"
+
+    def recent_accounts_query(self) -> str:
+        """(telegram_id, account id, username, gm level) of the most recently logged-in bound accounts.
+
+        "compat" reads only the table: its rows win over account.email in lookups, so they
+        are the only pairs known to be current.
+        """
+        if self.mode == "email":
+            telegram_id, source = "a.email", "account a"
+            where = "WHERE a.email <> '' "
+        else:
+            telegram_id, source = "b.telegram_id", "telegram_binding b JOIN account a ON a.id = b.account_id"
+            where = ""
+        return (
+            f"SELECT {telegram_id}, a.id, a.username, MAX(aa.gmlevel) FROM {source} "
+            f"LEFT JOIN account_access aa ON aa.id = a.id {where}"
+            f"GROUP BY {telegram_id}, a.id, a.username ORDER BY a.last_login DESC LIMIT %s"
+        )
+
+    def export_accounts_query(self) -> str:
+        """Every bound account with its telegram id and gm level, in id order, for the admin export."""
+        if self.mode == "email":
+            telegram_id, source, where = "a.email", "account a", "WHERE a.email <> '' "
+        else:
+            telegram_id, source, where = "b.telegram_id", "telegram_binding b JOIN account a ON a.id = b.account_id", ""
+        return (
+            f"SELECT a.id, a.username, {telegram_id} AS telegram_id, "
+            "COALESCE((SELECT MAX(gmlevel) FROM account_access aa WHERE aa.id = a.id), 0) AS gmlevel, "
+            f"a.joindate, a.last_login, a.online, a.expansion FROM {source} {where}ORDER BY a.id"
+        )
+
+
+async def prepare_binding_table(binding: TelegramBinding, pool: MySQLPool) -> str:
+    """Check the telegram_binding table the mode needs; returns a short status for the startup log.
+
+    "table" requires migrate_bindings.py to have run. "compat" is the default, so it must
+    also work on a database the migration has not touched: the table is created empty
+    (lookups then fall back to account.email), and if the bot may not create it, the
+    binding switches to "email" mode.
+    """
+    if binding.mode == "email":
+        return "bindings in account.email"
+    try:
+        await pool.fetchone("SELECT 1 FROM telegram_binding LIMIT 1")
+        return "telegram_binding table present"
+    except BackendUnavailable:
+        raise
+    except Exception as e:
+        if binding.mode == "table":
+            raise RuntimeError(f"TELEGRAM_BINDING=table needs the telegram_binding table, run migrate_bindings.py ({e})") from e
+    try:
+        await pool.execute(CREATE_BINDING_TABLE)
+    except BackendUnavailable:
+        raise
+    except Exception as e:
+        logging.warning(f"Telegram binding: cannot create telegram_binding ({e}), falling back to email mode")
+        binding.mode = "email"
+        return "telegram_binding missing, bindings in account.email"
+    logging.info("Telegram binding: created an empty telegram_binding table, run migrate_bindings.py to backfill it")
+    return "telegram_binding table created"
+
+
+async def backfill_bindings(
+    pool: MySQLPool,
+    chunk_size: int = 10000,
+    on_progress: Callable[[int, int, int], None] | None = None,
+) -> int:
+    """Create telegram_binding and copy numeric account.email values into it, in id ranges.
+
+    Existing bindings win over email values, so the backfill can be re-run at any time.
+    Returns the number of inserted bindings.
+    """
+    await pool.execute(CREATE_BINDING_TABLE)
+    max_id = (await pool.fetchone("SELECT COALESCE(MAX(id), 0) FROM account"))[0]
+    inserted = 0
+    for start in range(0, max_id, chunk_size):
+        inserted += await pool.execute(
+            "INSERT IGNORE INTO telegram_binding (telegram_id, account_id) "
+            "SELECT CAST(email AS UNSIGNED), id FROM account "
+            "WHERE id > %s AND id <= %s AND email REGEXP '^[0-9]{1,20}$' ORDER BY id",
+            (start, start + chunk_size),
+        )
+        if on_progress is not None:
+            on_progress(min(start + chunk_size, max_id), max_id, inserted)
+    logging.info(f"Telegram binding backfill: {inserted} bindings inserted")
+    return inserted
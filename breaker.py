@@ -0,0 +1,99 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+
+class BackendUnavailable(Exception):
+    """The backend is down: its circuit is open, or the call failed to reach it."""
+
+    def __init__(self, breaker: "CircuitBreaker"):
+        super().__init__(f"{breaker.name} is unavailable")
+        self.breaker = breaker
+
+
+class CircuitBreaker:
+    """Stops calling a backend after `failure_threshold` consecutive failures (0 never does).
+
+    closed    – calls go through, failures are counted;
+    open      – calls fail at once with BackendUnavailable for `reset_timeout` seconds;
+    half_open – up to `probes` calls go through; a success closes the circuit, a failure
+                opens it again.
+    Only outages count as failures (no connection, timeouts); a backend that answers with
+    an error is up.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0, probes: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the next probe is let through; 0 unless the circuit is open."""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def before_call(self):
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._probes_in_flight >= self.probes):
+            self.rejected += 1
+            raise BackendUnavailable(self)
+        if state == self.HALF_OPEN:
+            self._probes_in_flight += 1
+
+    def on_success(self):
+        if self._state != self.CLOSED:
+            logging.info(f"Circuit {self.name}: closed, backend is back")
+        self._state = self.CLOSED
+        self.failures = 0
+        self._probes_in_flight = 0
+
+    def on_failure(self):
+        self.failures += 1
+        tripped = 0 < self.failure_threshold <= self.failures
+        if self._state == self.HALF_OPEN or (self._state == self.CLOSED and tripped):
+            logging.warning(f"Circuit {self.name}: open for {self.reset_timeout:g}s after {self.failures} failures")
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probes_in_flight = 0
+            self.opened += 1
+
+    def on_cancel(self):
+        """The call ended without a verdict (cancelled); frees its half-open probe slot."""
+        if self._state == self.HALF_OPEN and self._probes_in_flight:
+            self._probes_in_flight -= 1
+
+    @contextmanager
+    def guard(self, is_outage: Callable[[Exception], bool] = lambda e: True):
+        """Run the body as one call, recording its outcome; exceptions are re-raised unchanged."""
+        self.before_call()
+        try:
+            yield
+        except Exception as e:
+            if is_outage(e):
+                self.on_failure()
+            else:
+                self.on_success()
+            raise
+        except BaseException:
+            self.on_cancel()
+            raise
+        self.on_success()
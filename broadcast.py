@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import re
+import sqlite3
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from cache import MISSING, TTLCache
+from sqlite_worker import SQLiteWorker
+
+SEND_TIME_RE = re.compile(r"^(?:(\d{1,2})\.(\d{1,2})\.(\d{4})\s+)?(\d{1,2}):(\d{2})$")
+
+
+@dataclass
+class Broadcast:
+    id: int
+    text: str
+    send_at: float
+    status: str  # scheduled, running, done, cancelled
+    cursor: int
+    sent: int
+    failed: int
+    blocked: int
+    created_by: int
+
+
+def parse_send_time(text: str, now: datetime | None = None) -> float | None:
+    """"сейчас", "ЧЧ:ММ" (today, or tomorrow if already past) or "ДД.ММ.ГГГГ ЧЧ:ММ" in server time."""
+    text = text.strip().lower()
+    now = now or datetime.now()
+    if text in ("сейчас", "-"):
+        return now.timestamp()
+    match = SEND_TIME_RE.match(text)
+    if not match:
+        return None
+    day, month, year, hour, minute = match.groups()
+    try:
+        if year:
+            moment = datetime(int(year), int(month), int(day), int(hour), int(minute))
+        else:
+            moment = now.replace(hour=int(hour), minute=int(minute), second=0, microsecond=0)
+            if moment < now:
+                moment += timedelta(days=1)
+    except ValueError:
+        return None
+    return moment.timestamp()
+
+
+class ChatRateLimiter:
+    """Paces Bot API sends: `rate` messages per second overall and one per `per_chat_interval` per chat.
+
+    Telegram allows about 30 messages per second to private chats; keeping the broadcast
+    rate below that leaves room for the replies of regular handlers, which do not go
+    through this limiter. A 429 pauses every sender for the requested retry_after.
+    """
+
+    def __init__(self, rate: float = 25.0, per_chat_interval: float = 1.0):
+        self.interval = 1.0 / rate
+        self.per_chat_interval = per_chat_interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._last_sent = TTLCache(maxsize=100000, ttl=per_chat_interval)
+
+    async def wait(self, chat_id: int):
+        last = self._last_sent.get(chat_id)
+        chat_ready = 0.0 if last is MISSING else last + self.per_chat_interval
+        while True:
+            now = time.monotonic()
+            slot = max(now, chat_ready, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # a pause() that arrived while this caller slept moves it behind the pause
+            if time.monotonic() >= self._paused_until:
+                break
+        self._last_sent.set(chat_id, slot)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class BroadcastService(SQLiteWorker):
+    """Scheduled announcements to every bound telegram user, stored in a local SQLite file.
+
+    `fetch_recipients(after_id, limit)` returns (account_id, chat_id or None) rows ordered by
+    account id; the last delivered account id is saved after every slice of sends, so a
+    restarted bot resumes where it stopped. A broadcast is leased while it runs, so only
+    one bot process delivers it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fetch_recipients: Callable[[int, int], Awaitable[list[tuple[int, int | None]]]],
+        limiter: ChatRateLimiter,
+        chunk_size: int = 500,
+        concurrency: int = 10,
+        lease: float = 60.0,
+        poll_interval: float = 5.0,
+        on_finished: Callable[[Bot, Broadcast], Awaitable[None]] | None = None,
+    ):
+        super().__init__(path, "broadcast")
+        self.fetch_recipients = fetch_recipients
+        self.limiter = limiter
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.on_finished = on_finished
+        self._wakeup = asyncio.Event()
+
+    def _setup(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "text TEXT NOT NULL, "
+            "send_at REAL NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'scheduled', "
+            "cursor INTEGER NOT NULL DEFAULT 0, "
+            "sent INTEGER NOT NULL DEFAULT 0, "
+            "failed INTEGER NOT NULL DEFAULT 0, "
+            "blocked INTEGER NOT NULL DEFAULT 0, "
+            "created_by INTEGER NOT NULL, "
+            "lease_until REAL NOT NULL DEFAULT 0, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def _insert(self, text: str, send_at: float, created_by: int) -> int:
+        cursor = self._connect().execute(
+            "INSERT INTO broadcasts (text, send_at, created_by, updated_at) VALUES (?, ?, ?, ?)",
+            (text, send_at, created_by, time.time()),
+        )
+        return cursor.lastrowid
+
+    async def create(self, text: str, send_at: float, created_by: int) -> int:
+        broadcast_id = await self._run_sql(self._insert, text, send_at, created_by)
+        self._wakeup.set()
+        return broadcast_id
+
+    def _cancel(self, broadcast_id: int) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE broadcasts SET status = 'cancelled', updated_at = ? "
+            "WHERE id = ? AND status IN ('scheduled', 'running')",
+            (time.time(), broadcast_id),
+        )
+        return cursor.rowcount == 1
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        return await self._run_sql(self._cancel, broadcast_id)
+
+    def _recent(self, limit: int) -> list[Broadcast]:
+        rows = self._connect().execute(
+            "SELECT id, text, send_at, status, cursor, sent, failed, blocked, created_by "
+            "FROM broadcasts ORDER BY id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [Broadcast(*row) for row in rows]
+
+    async def recent(self, limit: int = 5) -> list[Broadcast]:
+        return await self._run_sql(self._recent, limit)
+
+    def _claim(self) -> Broadcast | None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, text, send_at, status, cursor, sent, failed, blocked, created_by FROM broadcasts "
+                "WHERE send_at <= ? AND (status = 'scheduled' OR (status = 'running' AND lease_until <= ?)) "
+                "ORDER BY send_at LIMIT 1",
+                (now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE broadcasts SET status = 'running', lease_until = ?, updated_at = ? WHERE id = ?",
+                    (now + self.lease, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        broadcast = Broadcast(*row)
+        broadcast.status = "running"
+        return broadcast
+
+    def _save(self, broadcast: Broadcast) -> bool:
+        """Store progress and renew the lease; False if the broadcast was cancelled meanwhile."""
+        now = time.time()
+        cursor = self._connect().execute(
+            "UPDATE broadcasts SET status = ?, cursor = ?, sent = ?, failed = ?, blocked = ?, "
+            "lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (broadcast.status, broadcast.cursor, broadcast.sent, broadcast.failed, broadcast.blocked,
+             now + self.lease, now, broadcast.id),
+        )
+        return cursor.rowcount == 1
+
+    def _renew(self, broadcast_id: int):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE broadcasts SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (now + self.lease, now, broadcast_id),
+        )
+
+    async def _keep_lease(self, broadcast_id: int):
+        """Renews the lease while a slice is being sent; a flood-control pause can outlast it."""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._run_sql(self._renew, broadcast_id)
+            except Exception as e:
+                logging.error(f"Broadcast {broadcast_id}: failed to renew the lease: {e}")
+
+    async def _send(self, bot: Bot, chat_id: int, text: str) -> str:
+        """Flood control is waited out however long it lasts; only real errors give up on a chat."""
+        errors = 0
+        while True:
+            await self.limiter.wait(chat_id)
+            try:
+                await bot.send_message(chat_id, text)
+                return "sent"
+            except TelegramRetryAfter as e:
+                logging.warning(f"Broadcast: flood control, retry after {e.retry_after}s")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                errors += 1
+                if errors >= 3:
+                    logging.warning(f"Broadcast: failed to send to {chat_id} after {errors} attempts: {e}")
+                    return "failed"
+            except TelegramAPIError as e:
+                logging.warning(f"Broadcast: failed to send to {chat_id}: {e}")
+                return "failed"
+
+    async def _deliver(self, bot: Bot, broadcast: Broadcast):
+        renewer = asyncio.create_task(self._keep_lease(broadcast.id))
+        try:
+            await self._deliver_slices(bot, broadcast)
+        finally:
+            renewer.cancel()
+
+    async def _deliver_slices(self, bot: Bot, broadcast: Broadcast):
+        slice_size = self.concurrency * 5
+        while True:
+            rows = await self.fetch_recipients(broadcast.cursor, self.chunk_size)
+            if not rows:
+                break
+            for start in range(0, len(rows), slice_size):
+                chunk = rows[start:start + slice_size]
+                chats = list(dict.fromkeys(chat_id for _, chat_id in chunk if chat_id is not None))
+                semaphore = asyncio.Semaphore(self.concurrency)
+
+                async def send(chat_id: int) -> str:
+                    async with semaphore:
+                        return await self._send(bot, chat_id, broadcast.text)
+
+                for outcome in await asyncio.gather(*(send(chat_id) for chat_id in chats)):
+                    setattr(broadcast, outcome, getattr(broadcast, outcome) + 1)
+                broadcast.cursor = chunk[-1][0]
+                if not await self._run_sql(self._save, broadcast):
+                    logging.info(f"Broadcast {broadcast.id} cancelled at account {broadcast.cursor}")
+                    return
+        broadcast.status = "done"
+        await self._run_sql(self._save, broadcast)
+        logging.info(
+            f"Broadcast {broadcast.id} done: sent {broadcast.sent}, "
+            f"blocked {broadcast.blocked}, failed {broadcast.failed}"
+        )
+        if self.on_finished is not None:
+            try:
+                await self.on_finished(bot, broadcast)
+            except Exception as e:
+                logging.error(f"Broadcast {broadcast.id}: failed to report stats: {e}")
+
+    async def _run(self, bot: Bot):
+        while True:
+            self._wakeup.clear()
+            try:
+                broadcast = await self._run_sql(self._claim)
+                if broadcast is not None:
+                    await self._deliver(bot, broadcast)
+                    continue
+            except Exception as e:
+                logging.error(f"Broadcast error: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,118 @@
+import asyncio
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable
+
+# AzerothCore accepts at most 12 item stacks per mail (MAX_MAIL_ITEMS)
+MAX_ITEMS_PER_MAIL = 12
+
+LEVEL_SELECTOR_RE = re.compile(r"^\s*(?:level|ур)\s*>=\s*(\d+)\s*$", re.IGNORECASE)
+ITEM_RE = re.compile(r"^\d+(?::\d+)?$")
+
+
+@dataclass
+class BulkJob:
+    kind: str  # "items" or "money"
+    subject: str
+    text: str
+    payload: str
+    recipients: list[str]
+    done: list[str] = field(default_factory=list)
+    # mails the worldserver answered with an error; they are done too and never sent again
+    errors: dict[str, str] = field(default_factory=dict)
+    interrupted: bool = False
+    stop_error: str = ""
+    realm: str | None = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BulkJob":
+        return cls(**data)
+
+    def commands(self) -> list[tuple[str, str]]:
+        """All (key, command) pairs of the job; keys identify each mail for resuming."""
+        subject = self.subject.replace('"', '\\"')
+        text = self.text.replace('"', '\\"')
+        result = []
+        for name in self.recipients:
+            if self.kind == "money":
+                result.append((name, f'send money {name} "{subject}" "{text}" {self.payload}'))
+                continue
+            for index, chunk in enumerate(chunk_items(self.payload)):
+                result.append((f"{name}#{index}", f'send items {name} "{subject}" "{text}" {chunk}'))
+        return result
+
+    def pending(self) -> list[tuple[str, str]]:
+        done = set(self.done)
+        return [(key, command) for key, command in self.commands() if key not in done]
+
+    @property
+    def total(self) -> int:
+        return len(self.commands())
+
+
+def parse_level_selector(text: str) -> int | None:
+    match = LEVEL_SELECTOR_RE.match(text)
+    return int(match.group(1)) if match else None
+
+
+def parse_recipients(text: str) -> list[str]:
+    names = [name for name in re.split(r"[\s,;]+", text) if name]
+    return list(dict.fromkeys(names))
+
+
+def parse_items(text: str) -> list[str] | None:
+    items = text.split()
+    if not items or not all(ITEM_RE.match(item) for item in items):
+        return None
+    return items
+
+
+def chunk_items(items: str, size: int = MAX_ITEMS_PER_MAIL) -> list[str]:
+    tokens = items.split()
+    return [" ".join(tokens[i:i + size]) for i in range(0, len(tokens), size)]
+
+
+async def run_bulk_job(
+    job: BulkJob,
+    send: Callable[[str], Awaitable[str]],
+    save: Callable[[BulkJob], Awaitable[None]],
+    on_progress: Callable[[BulkJob], Awaitable[None]],
+    concurrency: int = 5,
+) -> BulkJob:
+    """Send all pending mails of the job with at most `concurrency` in flight.
+
+    Like the SOAP queue, `send` must raise only when the command surely did not reach the
+    worldserver (connection refused, circuit open); that stops the job, and running it
+    again sends the rest. Any returned result finishes the mail: an error ("❌ ...", e.g.
+    a misspelled name or a timeout whose outcome is unknown) is kept in job.errors, and
+    the mail is not sent again, so a resumed job never delivers twice.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    save_lock = asyncio.Lock()
+    job.interrupted = False
+    job.stop_error = ""
+
+    async def send_one(key: str, command: str):
+        async with semaphore:
+            if job.interrupted:
+                return
+            try:
+                result = await send(command)
+            except Exception as e:
+                job.interrupted = True
+                job.stop_error = job.stop_error or f"❌ {e}"
+                return
+        if result.startswith("❌"):
+            job.errors[key] = result
+        job.done.append(key)
+        async with save_lock:
+            await save(job)
+        await on_progress(job)
+
+    await asyncio.gather(*(send_one(key, command) for key, command in job.pending()))
+    async with save_lock:
+        await save(job)
+    return job
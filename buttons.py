@@ -0,0 +1,66 @@
+from typing import Any, Callable
+
+from aiogram import Router
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.filters import Filter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import KeyboardButton, Message, ReplyKeyboardMarkup
+
+
+def reply_keyboard(rows: list[list[str]]) -> ReplyKeyboardMarkup:
+    """Build a reply keyboard once; markups are never mutated, so one instance serves every message."""
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=text) for text in row] for row in rows],
+        resize_keyboard=True,
+    )
+
+
+class _ButtonFilter(Filter):
+    def __init__(self, actions: dict[str, HandlerObject]):
+        self.actions = actions
+
+    async def __call__(self, message: Message) -> bool | dict[str, Any]:
+        action = self.actions.get(message.text.strip()) if message.text else None
+        if action is None:
+            return False
+        # replaces data["handler"], so middlewares see the button's own name and flags
+        return {"handler": action}
+
+
+async def _dispatch(message: Message, handler: HandlerObject, **data):
+    return await handler.call(message, handler=handler, **data)
+
+
+class ButtonMenu:
+    """Reply-keyboard buttons resolved with one dict lookup: text -> handler or target state.
+
+    aiogram checks the filters of registered handlers one after another, so a handler per
+    button costs a filter call per button on every message. A menu registers a single
+    handler instead; its filter finds the button's HandlerObject, whose callback, flags
+    (throttling `backends`) and name (metrics, logs) are used exactly as if it had been
+    registered on the router itself.
+    """
+
+    def __init__(self):
+        self.actions: dict[str, HandlerObject] = {}
+
+    def button(self, text: str, flags: dict[str, Any] | None = None):
+        def decorator(callback: Callable) -> Callable:
+            self.actions[text] = HandlerObject(callback=callback, flags=dict(flags or {}))
+            return callback
+        return decorator
+
+    def prompt(self, text: str, answer: str, target: State, flags: dict[str, Any] | None = None):
+        """Button that only asks a question and moves to the state handling the answer."""
+        async def handler(msg: Message, state: FSMContext):
+            await msg.answer(answer)
+            await state.set_state(target)
+        handler.__name__ = f"prompt_{target.group.__name__}"
+        self.button(text, flags)(handler)
+
+    def register(self, router: Router, *filters):
+        router.message.register(_dispatch, *filters, _ButtonFilter(self.actions))
+
+    def __contains__(self, text: str) -> bool:
+        return text in self.actions
@@ -0,0 +1,22 @@
+"""Database settings shared by the bot and the standalone scripts (migrate_bindings.py).
+
+Importing this module loads .env, so it is imported before anything reads the environment.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "acore"),
+    "password": os.getenv("DB_PASSWORD", "acore"),
+    "database": os.getenv("DB_DATABASE", "acore_auth")
+}
+DB_CHARACTERS_DATABASE = os.getenv("DB_CHARACTERS_DATABASE", "acore_characters")
+DB_CROSS_DATABASE_JOIN = os.getenv("DB_CROSS_DATABASE_JOIN", "true").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30"))
+# table | compat | email; see migrate_bindings.py
+TELEGRAM_BINDING = os.getenv("TELEGRAM_BINDING", "compat")
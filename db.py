@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from breaker import BackendUnavailable, CircuitBreaker
+
+
+def _connector():
+    # imported on first use, in a pool thread, so it overlaps with the rest of startup
+    import mysql.connector
+    return mysql.connector
+
+
+def is_outage(error: Exception) -> bool:
+    """No connection or a lost one, as opposed to an error in the query."""
+    errors = _connector().errors
+    return isinstance(error, (errors.InterfaceError, errors.OperationalError))
+
+
+class MySQLPool:
+    """Pool of MySQL connections for one database; queries run in a dedicated thread pool."""
+
+    def __init__(
+        self,
+        config: dict,
+        size: int = 5,
+        health_check_interval: float = 30.0,
+        name: str = "db",
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.config = {**config, "autocommit": True}
+        self.breaker = breaker
+        self.size = size
+        self.health_check_interval = health_check_interval
+        self.name = name
+        self.in_use = 0
+        self.pending = 0
+        self.errors = 0
+        self._idle: deque[tuple[object, float]] = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"mysql-{name}")
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            conn = None
+            with self._lock:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                self.in_use += 1
+
+            if conn is not None and time.monotonic() - last_used > self.health_check_interval:
+                try:
+                    conn.ping(reconnect=True, attempts=1, delay=0)
+                except Exception as e:
+                    logging.warning(f"MySQL pool {self.name}: dropping dead connection: {e}")
+                    self._close_quietly(conn)
+                    conn = None
+
+            if conn is None:
+                conn = _connector().connect(**self.config)
+            return conn
+        except Exception:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+            raise
+
+    def _release(self, conn, broken: bool = False, failed: bool = False):
+        with self._lock:
+            self.in_use -= 1
+            if failed:
+                self.errors += 1
+            if not broken:
+                self._idle.append((conn, time.monotonic()))
+        if broken:
+            self._close_quietly(conn)
+        self._slots.release()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _call(self, func, *args):
+        conn = self._acquire()
+        try:
+            cursor = conn.cursor()
+            try:
+                result = func(cursor, *args)
+            finally:
+                cursor.close()
+        except Exception as e:
+            broken = isinstance(e, _connector().errors.InterfaceError) or not conn.is_connected()
+            self._release(conn, broken=broken, failed=True)
+            raise
+        self._release(conn)
+        return result
+
+    async def _submit(self, func, *args):
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        try:
+            return await loop.run_in_executor(self._executor, self._call, func, *args)
+        finally:
+            self.pending -= 1
+
+    async def run(self, func, *args):
+        """Run func(cursor, *args) on a pooled connection outside the event loop.
+
+        With a breaker, outages are raised as BackendUnavailable, and so is every call while
+        the circuit is open.
+        """
+        if self.breaker is None:
+            return await self._submit(func, *args)
+        try:
+            with self.breaker.guard(is_outage):
+                return await self._submit(func, *args)
+        except Exception as e:
+            if is_outage(e):
+                raise BackendUnavailable(self.breaker) from e
+            raise
+
+    def _open(self):
+        conn = _connector().connect(**self.config)
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    async def warm(self, connections: int) -> int:
+        """Open up to `connections` connections in parallel ahead of traffic; returns how many were opened.
+
+        Raises the first error if none could be opened.
+        """
+        with self._lock:
+            missing = min(connections, self.size) - len(self._idle) - self.in_use
+        if missing <= 0:
+            return 0
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self._open) for _ in range(missing)),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if len(errors) == len(results):
+            raise errors[0]
+        return len(results) - len(errors)
+
+    def connect(self):
+        """A new connection outside the pool, for long reads that must not hold a pool slot."""
+        return _connector().connect(**self.config)
+
+    async def fetchone(self, query: str, params: tuple = ()):
+        def _fetchone(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchone()
+        return await self.run(_fetchone)
+
+    async def fetchall(self, query: str, params: tuple = ()) -> list:
+        def _fetchall(cursor):
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        return await self.run(_fetchall)
+
+    async def execute(self, query: str, params: tuple = ()) -> int:
+        def _execute(cursor):
+            cursor.execute(query, params)
+            return cursor.rowcount
+        return await self.run(_execute)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._close_quietly(conn)
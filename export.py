@@ -0,0 +1,127 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable
+
+CHARACTERS_EXPORT_QUERY = (
+    "SELECT guid, account, name, race, class, gender, level, money, totaltime, online, logout_time "
+    "FROM characters WHERE level >= %s ORDER BY guid"
+)
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+@dataclass
+class Export:
+    name: str  # file name prefix, e.g. "accounts" or "characters-2"
+    format: str  # "csv" or "json"
+    query: str
+    params: tuple = ()
+    rows: int = 0
+    path: str | None = None
+    size: int = 0
+
+
+class _CsvWriter:
+    def __init__(self, file, columns: list[str]):
+        self.writer = csv.writer(file)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list[tuple]):
+        self.writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+class _JsonWriter:
+    """One JSON array with an object per line, written as the rows arrive."""
+
+    def __init__(self, file, columns: list[str]):
+        self.file = file
+        self.columns = columns
+        self.separator = "\n"
+        # json.dumps with options builds a new encoder on every call
+        self.encode = json.JSONEncoder(ensure_ascii=False, default=str).encode
+        file.write("[")
+
+    def write(self, rows: list[tuple]):
+        self.file.write(self.separator)
+        self.file.write(",\n".join(self.encode(dict(zip(self.columns, row))) for row in rows))
+        self.separator = ",\n"
+
+    def close(self):
+        self.file.write("\n]\n")
+
+
+WRITERS = {"csv": _CsvWriter, "json": _JsonWriter}
+
+
+class ExportService:
+    """Admin reports streamed from MySQL into gzip-compressed CSV or JSON files.
+
+    An export runs in its own thread on its own connection (`connect()`), so it holds no
+    slot of the bot's pools while it reads a whole table. The query runs on an unbuffered
+    cursor: MySQL streams the result and rows are written `chunk_size` at a time, so memory
+    use does not grow with the table. Exports run one at a time, later ones wait in line;
+    `on_progress` is called every `progress_interval` seconds while one runs.
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 1000, progress_interval: float = 3.0, compresslevel: int = 6):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.compresslevel = compresslevel
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+        self._closing = False
+
+    def _write(self, export: Export, connect: Callable[[], object]) -> Export:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{export.name}-{datetime.now():%Y%m%d-%H%M%S}.{export.format}.gz")
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(export.query, export.params)
+            columns = [column[0] for column in cursor.description]
+            with gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=self.compresslevel) as file:
+                writer = WRITERS[export.format](file, columns)
+                while rows := cursor.fetchmany(self.chunk_size):
+                    if self._closing:
+                        raise ExportCancelled(f"export {export.name} cancelled on shutdown")
+                    writer.write(rows)
+                    export.rows += len(rows)
+                writer.close()
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        finally:
+            conn.close()
+        export.path, export.size = path, os.path.getsize(path)
+        return export
+
+    async def run(
+        self,
+        export: Export,
+        connect: Callable[[], object],
+        on_progress: Callable[[Export], Awaitable[None]],
+    ) -> Export:
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._write, export, connect)
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=self.progress_interval)
+            if done:
+                return future.result()
+            await on_progress(export)
+
+    def close(self):
+        """Stop a running export at its next chunk; queued ones never start."""
+        self._closing = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,103 @@
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from aiogram import BaseMiddleware
+
+telegram_id_var: ContextVar[int | None] = ContextVar("telegram_id", default=None)
+handler_var: ContextVar[str | None] = ContextVar("handler", default=None)
+
+CONTEXT_FIELDS = ("telegram_id", "handler", "soap_verb", "duration_ms")
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current telegram_id and handler name onto every record."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "telegram_id", None) is None:
+            record.telegram_id = telegram_id_var.get()
+        if getattr(record, "handler", None) is None:
+            record.handler = handler_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, max_message_length: int = 4000):
+        super().__init__()
+        self.max_message_length = max_message_length
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if len(message) > self.max_message_length:
+            message = message[:self.max_message_length] + f"… (+{len(message) - self.max_message_length} chars)"
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": message,
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging(
+    path: str = "bot.log",
+    level: int = logging.INFO,
+    rotation: str = "size",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    when: str = "midnight",
+    max_message_length: int = 4000,
+) -> logging.handlers.QueueListener:
+    """Route the root logger through a queue; a listener thread formats and writes the file."""
+    if rotation == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    file_handler.setFormatter(JsonFormatter(max_message_length))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class LoggingContextMiddleware(BaseMiddleware):
+    """Sets telegram_id/handler context for log records and logs each handled update with its duration."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else None
+        telegram_id_token = telegram_id_var.set(user.id if user else None)
+        handler_token = handler_var.set(name)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            logging.info(
+                "handled update",
+                extra={"duration_ms": round((time.perf_counter() - start) * 1000, 2)},
+            )
+            telegram_id_var.reset(telegram_id_token)
+            handler_var.reset(handler_token)
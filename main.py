@@ -1,45 +1,270 @@
 import logging
 import asyncio
-import requests
-import xml.etree.ElementTree as ET
-import re
-import mysql.connector
 from datetime import datetime
 from html import escape
 import os
-from dotenv import load_dotenv
+import functools
+from urllib.parse import urlparse
+import time
+from dataclasses import replace
+import multiprocessing
+from typing import NamedTuple
+
+import aiohttp
 
 from aiogram import Bot, Dispatcher, Router, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, ExceptionTypeFilter, StateFilter
 from aiogram.enums import ParseMode
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    CallbackQuery,
+    ErrorEvent,
+    FSInputFile,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    Message,
+)
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.utils.token import TokenValidationError, validate_token
+
+from audit import AuditLog, parse_audit_filters
+from bindings import TelegramBinding, prepare_binding_table
+from breaker import BackendUnavailable, CircuitBreaker
+from buttons import ButtonMenu, reply_keyboard
+from broadcast import Broadcast, BroadcastService, ChatRateLimiter, parse_send_time
+from bulk import BulkJob, parse_items, parse_level_selector, parse_recipients, run_bulk_job
+from cache import MISSING, TTLCache
+# loads .env; the database settings live there so scripts can use them without the bot
+from config import (
+    DB_CHARACTERS_DATABASE,
+    DB_CONFIG,
+    DB_CROSS_DATABASE_JOIN,
+    DB_HEALTH_CHECK_INTERVAL,
+    DB_POOL_SIZE,
+    TELEGRAM_BINDING,
+)
+from db import MySQLPool
+from export import CHARACTERS_EXPORT_QUERY, Export, ExportService
+from logs import LoggingContextMiddleware, setup_logging
+from metrics import HandlerMetricsMiddleware, Registry, start_metrics_server, track
+from online import OnlineFilters, fetch_online_page, format_online_page, parse_online_filters
+from realms import Realm, RealmConfig, fan_out, load_realm_configs
+from registration import Availability, RegistrationService
+import soap_codec
+from soap import SoapClient
+from singleflight import SingleFlight
+from soap_queue import SoapJob, SoapJobQueue
+from startup import Readiness
+from status import ServerStatusPoller
+from storage import create_storage
+from throttling import ThrottlingMiddleware
+from webhook import run_webhook
 
 # === КОНФИГ ===
-load_dotenv()
-
 TOKEN = os.getenv("TOKEN")
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
 SOAP_URL = os.getenv("SOAP_URL")
 SOAP_USER = os.getenv("SOAP_USER")
 SOAP_PASS = os.getenv("SOAP_PASS")
-
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "user": os.getenv("DB_USER", "acore"),
-    "password": os.getenv("DB_PASSWORD", "acore"),
-    "database": os.getenv("DB_DATABASE", "acore_auth")
+SOAP_POOL_SIZE = int(os.getenv("SOAP_POOL_SIZE", "10"))
+SOAP_CONCURRENCY = int(os.getenv("SOAP_CONCURRENCY", "10"))
+SOAP_TIMEOUT = float(os.getenv("SOAP_TIMEOUT", "5"))
+# read-only commands whose concurrent identical calls may share one request
+SOAP_COALESCE_COMMANDS = {
+    command.strip().lower() for command in os.getenv("SOAP_COALESCE_COMMANDS", "server info").split(",") if command.strip()
 }
+LOG_PATH = os.getenv("LOG_PATH", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_MAX_MESSAGE_LENGTH = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "4000"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+SOAP_QUEUE_PATH = os.getenv("SOAP_QUEUE_PATH", "soap_queue.sqlite3")
+SOAP_QUEUE_CONCURRENCY = int(os.getenv("SOAP_QUEUE_CONCURRENCY", "5"))
+SOAP_QUEUE_MAX_ATTEMPTS = int(os.getenv("SOAP_QUEUE_MAX_ATTEMPTS", "10"))
+SOAP_QUEUE_BACKOFF_BASE = float(os.getenv("SOAP_QUEUE_BACKOFF_BASE", "2"))
+SOAP_QUEUE_BACKOFF_MAX = float(os.getenv("SOAP_QUEUE_BACKOFF_MAX", "300"))
+STATUS_POLL_INTERVAL = float(os.getenv("STATUS_POLL_INTERVAL", "15"))
+STATUS_MAX_AGE = float(os.getenv("STATUS_MAX_AGE", str(STATUS_POLL_INTERVAL * 3)))
+
+# REALMS=1,2 plus REALM_<id>_NAME/SOAP_URL/CHARACTERS_DATABASE/...; without it the settings above are the only realm
+REALM_CONFIGS = load_realm_configs(os.environ, RealmConfig(
+    id="1",
+    name=os.getenv("REALM_NAME", "WoWSeRVeR"),
+    soap_url=SOAP_URL,
+    soap_user=SOAP_USER,
+    soap_password=SOAP_PASS,
+    db_config=DB_CONFIG,
+    characters_database=DB_CHARACTERS_DATABASE,
+))
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "fsm.sqlite3")
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL")
+
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "1"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+RATE_LIMIT_SOAP_RATE = float(os.getenv("RATE_LIMIT_SOAP_RATE", "20"))
+RATE_LIMIT_SOAP_BURST = float(os.getenv("RATE_LIMIT_SOAP_BURST", "40"))
+RATE_LIMIT_MYSQL_RATE = float(os.getenv("RATE_LIMIT_MYSQL_RATE", "100"))
+RATE_LIMIT_MYSQL_BURST = float(os.getenv("RATE_LIMIT_MYSQL_BURST", "200"))
+
+ONLINE_PAGE_SIZE = int(os.getenv("ONLINE_PAGE_SIZE", "20"))
+ONLINE_PAGE_CACHE_SIZE = int(os.getenv("ONLINE_PAGE_CACHE_SIZE", "500"))
+
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "5"))
+BULK_PROGRESS_INTERVAL = float(os.getenv("BULK_PROGRESS_INTERVAL", "3"))
+
+BROADCAST_PATH = os.getenv("BROADCAST_PATH", "broadcasts.sqlite3")
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "10"))
+
+AUDIT_PATH = os.getenv("AUDIT_PATH", "audit.sqlite3")
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "100"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1"))
+AUDIT_MAX_BUFFER = int(os.getenv("AUDIT_MAX_BUFFER", "10000"))
+AUDIT_PAGE_SIZE = int(os.getenv("AUDIT_PAGE_SIZE", "20"))
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_PROGRESS_INTERVAL = float(os.getenv("EXPORT_PROGRESS_INTERVAL", "3"))
+# Bot API upload limit for documents
+EXPORT_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "10000"))
+ACCOUNT_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "60"))
+
+REGISTRATION_RESERVATION_TTL = float(os.getenv("REGISTRATION_RESERVATION_TTL", "300"))
+REGISTRATION_BATCH_SIZE = int(os.getenv("REGISTRATION_BATCH_SIZE", "50"))
+REGISTRATION_BATCH_WINDOW = float(os.getenv("REGISTRATION_BATCH_WINDOW", "0.05"))
+
+STARTUP_CHECK_TIMEOUT = float(os.getenv("STARTUP_CHECK_TIMEOUT", "10"))
+STARTUP_WARM_CONNECTIONS = int(os.getenv("STARTUP_WARM_CONNECTIONS", "2"))
+STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "30"))
+ACCOUNT_CACHE_PRIME = int(os.getenv("ACCOUNT_CACHE_PRIME", "1000"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+BREAKER_PROBES = int(os.getenv("BREAKER_PROBES", "1"))
 
 # === ЛОГИ ===
-logging.basicConfig(
-    level=logging.INFO,
-    filename="bot.log",
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    encoding="utf-8"
+def start_logging(worker_index: int = 0):
+    path = LOG_PATH
+    if WEBHOOK_WORKERS > 1 and RUN_MODE == "webhook":
+        root, ext = os.path.splitext(LOG_PATH)
+        path = f"{root}.{worker_index}{ext}"
+    return setup_logging(
+        path,
+        level=logging.getLevelName(LOG_LEVEL),
+        rotation=LOG_ROTATION,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
+        when=LOG_ROTATE_WHEN,
+        max_message_length=LOG_MAX_MESSAGE_LENGTH,
+    )
+
+# === МЕТРИКИ ===
+metrics = Registry()
+handler_latency = metrics.histogram("bot_handler_duration_seconds", "Handler latency", ("handler",))
+handler_in_flight = metrics.gauge("bot_handler_in_flight", "Handlers currently running", ("handler",))
+handler_errors = metrics.counter("bot_handler_errors_total", "Unhandled handler exceptions", ("handler",))
+soap_latency = metrics.histogram("bot_soap_command_duration_seconds", "SOAP command latency", ("verb", "realm"))
+soap_in_flight = metrics.gauge("bot_soap_command_in_flight", "SOAP commands in flight", ("verb", "realm"))
+soap_errors = metrics.counter("bot_soap_command_errors_total", "SOAP commands that returned an error", ("verb", "realm"))
+mysql_latency = metrics.histogram("bot_mysql_helper_duration_seconds", "MySQL helper latency", ("helper",))
+mysql_in_flight = metrics.gauge("bot_mysql_helper_in_flight", "MySQL helpers in flight", ("helper",))
+metrics.callback(
+    "bot_soap_pool", "SOAP client concurrency: in use, waiting and limit", "gauge",
+    lambda: [
+        ({"realm": realm.id, "state": state}, value)
+        for realm in REALMS
+        for state, value in (
+            ("in_flight", realm.soap.in_flight),
+            ("waiting", realm.soap.pending),
+            ("limit", realm.soap.max_concurrency),
+        )
+    ],
+)
+metrics.callback(
+    "bot_mysql_pool_connections", "MySQL pool connections: in use, waiting queries and size", "gauge",
+    lambda: [
+        ({"pool": pool.name, "state": state}, value)
+        for pool in (auth_db, *(realm.characters_db for realm in REALMS))
+        for state, value in (("in_use", pool.in_use), ("waiting", pool.pending), ("size", pool.size))
+    ],
+)
+metrics.callback(
+    "bot_mysql_errors_total", "Failed MySQL queries", "counter",
+    lambda: [({"pool": pool.name}, pool.errors) for pool in (auth_db, *(realm.characters_db for realm in REALMS))],
+)
+metrics.callback(
+    "bot_account_cache_requests_total", "Account cache lookups", "counter",
+    lambda: [({"result": "hit"}, account_cache.hits), ({"result": "miss"}, account_cache.misses)],
+)
+metrics.callback(
+    "bot_coalesced_requests_total", "Backend calls made and calls saved by joining an identical in-flight call", "counter",
+    lambda: [
+        ({"call": name, "result": result}, count)
+        for result, counter in (("made", single_flight.calls), ("shared", single_flight.shared))
+        for name, count in counter.items()
+    ],
+)
+metrics.callback(
+    "bot_circuit_state", "Circuit breaker state per backend: 1 for the current state", "gauge",
+    lambda: [
+        ({"backend": breaker.name, "state": state}, int(breaker.state == state))
+        for breaker in breakers
+        for state in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)
+    ],
+)
+metrics.callback(
+    "bot_circuit_rejected_total", "Calls failed fast because the backend's circuit was open", "counter",
+    lambda: [({"backend": breaker.name}, breaker.rejected) for breaker in breakers],
 )
+metrics.callback(
+    "bot_circuit_opened_total", "Times a backend's circuit opened", "counter",
+    lambda: [({"backend": breaker.name}, breaker.opened) for breaker in breakers],
+)
+metrics.callback(
+    "bot_ready", "1 once every startup check passed, 0 while running degraded", "gauge",
+    lambda: [({}, int(readiness.ready))],
+)
+metrics.callback(
+    "bot_startup_check", "Result of the last run of each startup check: 1 passed, 0 failed", "gauge",
+    lambda: [({"check": result.name}, int(result.ok)) for result in readiness.results.values()],
+)
+metrics.callback(
+    "bot_audit_records", "Admin audit records: buffered in memory, written to disk, dropped on a full buffer", "gauge",
+    lambda: [
+        ({"state": "buffered"}, audit.buffered),
+        ({"state": "written"}, audit.written),
+        ({"state": "dropped"}, audit.dropped),
+    ],
+)
+metrics.callback(
+    "bot_throttled_total", "Requests rejected by rate limiting", "counter",
+    lambda: [({"reason": reason}, count) for reason, count in throttling.throttled.items()],
+)
+
+def instrument_mysql(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with track(mysql_latency, mysql_in_flight, helper=func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
 
 # === FSM ===
 class RegState(StatesGroup):
@@ -53,9 +278,11 @@ class AdminCommandState(StatesGroup):
     command = State()
 
 class AdminPanelState(StatesGroup):
+    realm = State()
     choice = State()
 
 class ServiceState(StatesGroup):
+    realm = State()
     character_name = State()
     service_type = State()
 
@@ -88,197 +315,552 @@ class RestartServerState(StatesGroup):
     delay = State()
     exit_code = State()
 
+class OnlineBrowserState(StatesGroup):
+    filters = State()
+
+class OnlinePage(CallbackData, prefix="online"):
+    page: int
+
+class BulkSendState(StatesGroup):
+    kind = State()
+    recipients = State()
+    subject = State()
+    text = State()
+    payload = State()
+
+class BroadcastState(StatesGroup):
+    text = State()
+    send_at = State()
+
+class AuditLogState(StatesGroup):
+    filters = State()
+
+class ExportState(StatesGroup):
+    kind = State()
+    min_level = State()
+    format = State()
+
 # === SOAP ===
-def send_soap_command(command: str) -> str:
-    headers = {'Content-Type': 'text/xml'}
-    payload = f"""<?xml version="1.0" encoding="utf-8"?>
-    <soap:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-                   xmlns:xsd="http://www.w3.org/2001/XMLSchema"
-                   xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
-      <soap:Body>
-        <executeCommand xmlns="urn:AC">
-          <command>{command}</command>
-        </executeCommand>
-      </soap:Body>
-    </soap:Envelope>"""
+single_flight = SingleFlight()
+# one breaker per SOAP endpoint and MySQL pool, named like the startup checks
+breakers: list[CircuitBreaker] = []
+
+def make_breaker(name: str) -> CircuitBreaker:
+    breaker = CircuitBreaker(name, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT, BREAKER_PROBES)
+    breakers.append(breaker)
+    return breaker
+
+def soap_command_verb(command: str) -> str:
+    return " ".join(command.split()[:2]).lower()
+
+async def call_soap_command(command: str, realm: Realm | None = None) -> str:
+    realm = realm or DEFAULT_REALM
+    if " ".join(command.split()).lower() in SOAP_COALESCE_COMMANDS:
+        return await single_flight.do("soap", (realm.id, command), lambda: execute_soap_command(command, realm))
+    return await execute_soap_command(command, realm)
+
+async def execute_soap_command(command: str, realm: Realm) -> str:
+    verb = soap_command_verb(command)
+    start = time.perf_counter()
+    # raises BackendUnavailable at once while the worldserver's circuit is open
+    with realm.soap_breaker.guard(), track(soap_latency, soap_in_flight, verb=verb, realm=realm.id):
+        try:
+            result = await realm.soap.call(command)
+        except Exception as e:
+            soap_errors.inc(verb=verb, realm=realm.id)
+            logging.warning(
+                f"SOAP {verb} on realm {realm.id} failed: {e}",
+                extra={"soap_verb": verb, "duration_ms": round((time.perf_counter() - start) * 1000, 2)},
+            )
+            raise
+    if result.startswith("❌"):
+        soap_errors.inc(verb=verb, realm=realm.id)
+    logging.info(
+        f"SOAP {verb} on realm {realm.id}: {result}",
+        extra={"soap_verb": verb, "duration_ms": round((time.perf_counter() - start) * 1000, 2)},
+    )
+    return result
 
+SOAP_UNAVAILABLE = "❌ Игровой сервер недоступен. Попробуйте через несколько минут."
+
+async def send_soap_command(command: str, realm: Realm | None = None) -> str:
+    realm = realm or DEFAULT_REALM
     try:
-        response = requests.post(
-            SOAP_URL,
-            auth=(SOAP_USER, SOAP_PASS),
-            data=payload,
-            headers=headers,
-            timeout=5
-        )
+        return await call_soap_command(command, realm)
+    except BackendUnavailable:
+        return SOAP_UNAVAILABLE
+    except Exception as e:
+        return realm.soap.format_error(e)
 
-        if not response.ok:
-            return f"❌ Ошибка сервера: {response.status_code} — {response.reason}"
+async def send_queued_soap_command(job: SoapJob) -> str:
+    realm = get_realm(job.payload.get("realm"))
+    if realm is None:
+        return f"❌ Игровой мир {job.payload['realm']} больше не настроен."
+    # only a refused connection or an open circuit proves the command never ran; anything else is final
+    try:
+        return await call_soap_command(job.command, realm)
+    except (aiohttp.ClientConnectorError, BackendUnavailable):
+        raise
+    except Exception as e:
+        return realm.soap.format_error(e)
+
+soap_queue = SoapJobQueue(
+    SOAP_QUEUE_PATH,
+    send_queued_soap_command,
+    concurrency=SOAP_QUEUE_CONCURRENCY,
+    max_attempts=SOAP_QUEUE_MAX_ATTEMPTS,
+    backoff_base=SOAP_QUEUE_BACKOFF_BASE,
+    backoff_max=SOAP_QUEUE_BACKOFF_MAX,
+)
 
-        root = ET.fromstring(response.content)
-        result_element = root.find('.//result')
-        if result_element is None:
-            return f"❌ Ошибка: <result> не найден."
-        return result_element.text.strip() if result_element.text else ""
+async def enqueue_soap_command(
+    msg: Message,
+    kind: str,
+    command: str,
+    payload: dict | None = None,
+    realm: Realm | None = None,
+    secret: bool = False,
+):
+    if realm is not None:
+        payload = {**(payload or {}), "realm": realm.id}
+    created = await soap_queue.enqueue(
+        kind,
+        command,
+        msg.chat.id,
+        payload,
+        idempotency_key=f"{kind}:{msg.chat.id}:{msg.message_id}",
+        secret=secret,
+    )
+    if created:
+        await msg.answer("⏳ Команда поставлена в очередь. Результат придёт отдельным сообщением.")
+    else:
+        await msg.answer("⏳ Эта команда уже в очереди.")
 
-    except Exception as e:
-        return f"❌ SOAP ошибка: {e}"
+audit = AuditLog(
+    AUDIT_PATH,
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_INTERVAL,
+    max_buffer=AUDIT_MAX_BUFFER,
+)
+
+async def send_admin_command(
+    msg: Message, realm: Realm, action: str, command: str, target: str | None = None
+) -> str:
+    """send_soap_command for admin actions: the call is recorded in the audit log."""
+    started = time.monotonic()
+    result = await send_soap_command(command, realm)
+    audit.record(msg.from_user.id, action, command, result, time.monotonic() - started, target=target, realm=realm.id)
+    return result
+
+async def enqueue_admin_command(msg: Message, state: FSMContext, action: str, command: str, target: str):
+    payload = {"actor_id": msg.from_user.id, "action": action, "target": target}
+    await enqueue_soap_command(msg, "admin", command, payload, realm=await get_state_realm(state))
+
+@soap_queue.handler("service")
+async def complete_service(bot: Bot, job: SoapJob, result: str):
+    char_name = job.payload["character_name"]
+    if "does not exist" in result.lower():
+        await bot.send_message(job.chat_id, "❌ Персонаж не найден.")
+    elif "500" in result.lower() or result.startswith(("❌", "⚠️")):
+        await bot.send_message(job.chat_id, "❌ Внутренняя ошибка сервера. Попробуйте позже.")
+    else:
+        await bot.send_message(job.chat_id, f"✅ Услуга применена к <b>{char_name}</b>.")
+
+# seconds between further attempts to bind an account whose first binding batch failed
+BIND_RETRY_DELAYS = (10, 60, 300)
+bind_tasks: dict[int, asyncio.Task] = {}
+
+async def retry_binding(bot: Bot, login: str, telegram_id: int, chat_id: int):
+    for delay in BIND_RETRY_DELAYS:
+        await asyncio.sleep(delay)
+        if await registration.bind(login, telegram_id):
+            logging.info(f"Registration: bound {login} to {telegram_id} on retry")
+            await bot.send_message(chat_id, f"✅ Аккаунт <b>{escape(login)}</b> привязан к Telegram.")
+            return
+    logging.error(f"Registration: gave up binding {login} to {telegram_id}")
+    audit.record(telegram_id, "registration_bind", f"bind {login}", "❌ gave up after retries", 0.0, target=login)
+    await bot.send_message(
+        chat_id,
+        f"❌ Не удалось привязать аккаунт <b>{escape(login)}</b> к Telegram. Обратитесь к администратору.",
+    )
+
+@soap_queue.handler("account_create")
+async def complete_account_create(bot: Bot, job: SoapJob, result: str):
+    login, telegram_id = job.payload["login"], job.payload["telegram_id"]
+    created_login = soap_codec.parse_account_create(result)
+    if created_login and not await registration.bind(login, telegram_id):
+        # the account exists on the server, only the telegram link is missing
+        logging.error(f"Registration: account {login} created but not bound to {telegram_id}")
+        audit.record(telegram_id, "registration_bind", f"bind {login}", "❌ binding batch failed", 0.0, target=login)
+        task = asyncio.create_task(retry_binding(bot, login, telegram_id, job.chat_id))
+        bind_tasks[telegram_id] = task
+        task.add_done_callback(lambda done: bind_tasks.pop(telegram_id) if bind_tasks.get(telegram_id) is done else None)
+        result = (
+            f"⚠️ Аккаунт создан: {created_login}, но не привязан к Telegram. "
+            "Бот повторит привязку в ближайшие минуты и сообщит результат."
+        )
+    elif created_login:
+        result = f"✅ Аккаунт создан: {created_login}"
+    registration.release(login)
+    await bot.send_message(job.chat_id, escape(result))
+
+@soap_queue.handler("admin")
+async def complete_admin_command(bot: Bot, job: SoapJob, result: str):
+    audit.record(
+        job.payload.get("actor_id", job.chat_id),
+        job.payload.get("action", "command"),
+        job.command or "",
+        result,
+        job.duration,
+        target=job.payload.get("target"),
+        realm=job.payload.get("realm"),
+    )
+    await bot.send_message(job.chat_id, f"<pre>{escape(result)}</pre>")
 
 # === PARSE INFO ===
-def parse_server_info(result: str) -> str:
-    players = re.search(r"Connected players:\s*(\d+)", result)
-    characters = re.search(r"Characters in world:\s*(\d+)", result)
-    uptime = re.search(r"Server uptime:\s*(.+?)\r", result)
+def parse_server_counters(result: str) -> dict:
+    return soap_codec.parse_server_info(result)
+
+def format_server_info(counters: dict) -> str:
+    players, characters, uptime = counters["players"], counters["characters"], counters["uptime"]
 
-    players_text = f"👥 Онлайн игроков: {players.group(1)}" if players else "❓ Игроки: ?"
-    chars_text = f"🌍 Персонажей в мире: {characters.group(1)}" if characters else "❓ Персонажи: ?"
-    uptime_text = f"⏱ Аптайм: {uptime.group(1)}" if uptime else "❓ Аптайм: ?"
+    players_text = f"👥 Онлайн игроков: {players}" if players else "❓ Игроки: ?"
+    chars_text = f"🌍 Персонажей в мире: {characters}" if characters else "❓ Персонажи: ?"
+    uptime_text = f"⏱ Аптайм: {uptime}" if uptime else "❓ Аптайм: ?"
 
     return f"{players_text}\n{chars_text}\n{uptime_text}"
 
+def parse_server_info(result: str) -> str:
+    return format_server_info(parse_server_counters(result))
+
 # === MYSQL ===
-def is_account_exists(username: str) -> bool:
+class AccountInfo(NamedTuple):
+    id: int
+    username: str
+    gmlevel: int
+
+account_cache = TTLCache(maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL)
+telegram_binding = TelegramBinding(TELEGRAM_BINDING)
+
+auth_db = MySQLPool(
+    DB_CONFIG,
+    size=DB_POOL_SIZE,
+    health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+    name="auth",
+    breaker=make_breaker("mysql:auth"),
+)
+
+@instrument_mysql
+async def fetch_broadcast_recipients(after_account_id: int, limit: int) -> list[tuple[int, int | None]]:
+    rows = await auth_db.fetchall(telegram_binding.recipients_query(), (after_account_id, limit))
+    return [(row[0], int(row[1]) if str(row[1]).isdigit() else None) for row in rows]
+
+async def report_broadcast(bot: Bot, broadcast: Broadcast):
+    await bot.send_message(broadcast.created_by, f"📣 Объявление #{broadcast.id} разослано.\n{format_broadcast_stats(broadcast)}")
+
+def format_broadcast_stats(broadcast: Broadcast) -> str:
+    return (
+        f"✅ Доставлено: {broadcast.sent}\n"
+        f"🚫 Заблокировали бота: {broadcast.blocked}\n"
+        f"⚠️ Ошибок: {broadcast.failed}"
+    )
+
+broadcasts = BroadcastService(
+    BROADCAST_PATH,
+    fetch_broadcast_recipients,
+    ChatRateLimiter(rate=BROADCAST_RATE),
+    chunk_size=BROADCAST_CHUNK_SIZE,
+    concurrency=BROADCAST_CONCURRENCY,
+    on_finished=report_broadcast,
+)
+
+# === РЕАЛМЫ ===
+def build_realm(config: RealmConfig) -> Realm:
+    characters_pool = "characters" if len(REALM_CONFIGS) == 1 else f"characters:{config.id}"
+    realm = Realm(
+        id=config.id,
+        name=config.name,
+        soap=SoapClient(
+            config.soap_url,
+            config.soap_user,
+            config.soap_password,
+            pool_size=SOAP_POOL_SIZE,
+            max_concurrency=SOAP_CONCURRENCY,
+            timeout=SOAP_TIMEOUT,
+        ),
+        characters_db=MySQLPool(
+            {**config.db_config, "database": config.characters_database},
+            size=DB_POOL_SIZE,
+            health_check_interval=DB_HEALTH_CHECK_INTERVAL,
+            name=characters_pool,
+            breaker=make_breaker(f"mysql:{characters_pool}"),
+        ),
+        characters_database=config.characters_database,
+        shares_auth_server=DB_CROSS_DATABASE_JOIN and config.db_config["host"] == DB_CONFIG["host"],
+        soap_breaker=make_breaker(f"soap:{config.id}"),
+    )
+    realm.status = ServerStatusPoller(
+        lambda: send_soap_command("server info", realm),
+        parse_server_counters,
+        interval=STATUS_POLL_INTERVAL,
+    )
+    return realm
+
+REALMS = [build_realm(config) for config in REALM_CONFIGS]
+REALMS_BY_ID = {realm.id: realm for realm in REALMS}
+DEFAULT_REALM = REALMS[0]
+
+def get_realm(realm_id: str | None) -> Realm | None:
+    """Realm stored in FSM data or a job payload; None means the default realm, unknown ids give None."""
+    if realm_id is None:
+        return DEFAULT_REALM
+    return REALMS_BY_ID.get(realm_id)
+
+def find_realm_by_name(name: str) -> Realm | None:
+    return next((realm for realm in REALMS if realm.name == name.strip()), None)
+
+REALM_KEYBOARD = reply_keyboard([[realm.name] for realm in REALMS])
+
+async def get_state_realm(state: FSMContext) -> Realm:
+    data = await state.get_data()
+    return get_realm(data.get("realm")) or DEFAULT_REALM
+
+async def answer_per_realm(msg: Message, fetch):
+    """Answer with fetch(realm) for every realm; sections are added to one message as realms respond."""
+    if len(REALMS) == 1:
+        await msg.answer(await fetch(DEFAULT_REALM))
+        return
+    sections = {}
+    sent = None
+    async for realm, text in fan_out(REALMS, fetch):
+        sections[realm.id] = f"<b>🌍 {escape(realm.name)}</b>\n{text}"
+        body = "\n\n".join(sections[r.id] for r in REALMS if r.id in sections)
+        if sent is None:
+            sent = await msg.answer(body)
+            continue
+        try:
+            await sent.edit_text(body)
+        except TelegramBadRequest as e:
+            logging.warning(f"Realm fan-out update failed: {e}")
+
+def invalidate_account(username: str, telegram_id: int):
+    # a lookup already in flight read the old row: new callers must not join it
+    get_account_by_telegram_id.forget(telegram_id)
+    account_cache.invalidate(telegram_id)
+    account_cache.invalidate_if(
+        lambda _, account: account is not None and account.username.lower() == username.lower()
+    )
+
+registration = RegistrationService(
+    auth_db,
+    telegram_binding,
+    reservation_ttl=REGISTRATION_RESERVATION_TTL,
+    batch_size=REGISTRATION_BATCH_SIZE,
+    batch_window=REGISTRATION_BATCH_WINDOW,
+    on_bound=invalidate_account,
+)
+
+@instrument_mysql
+async def check_login_availability(login: str, telegram_id: int) -> Availability | None:
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM account WHERE username = %s", (username,))
-        exists = cursor.fetchone() is not None
-        conn.close()
-        return exists
+        return await registration.check(login, telegram_id)
     except Exception as e:
         logging.error(f"MySQL check error: {e}")
-        return False
+        return None
 
-def set_telegram_email(username: str, telegram_id: int):
+@single_flight.wrap
+@instrument_mysql
+async def get_account_by_telegram_id(telegram_id: int) -> AccountInfo | None:
+    account = account_cache.get(telegram_id)
+    if account is not MISSING:
+        return account
+    generation = account_cache.generation
+    account_id, params = telegram_binding.account_id(telegram_id)
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE account SET email = %s WHERE username = %s",
-            (str(telegram_id), username)
+        row = await auth_db.fetchone(
+            "SELECT a.id, a.username, MAX(aa.gmlevel) FROM account a "
+            "LEFT JOIN account_access aa ON aa.id = a.id "
+            f"WHERE a.id = {account_id} GROUP BY a.id, a.username",
+            params
         )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        logging.error(f"MySQL update error: {e}")
-
-def get_username_by_telegram_id(telegram_id: int) -> str | None:
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT username FROM account WHERE email = %s", (str(telegram_id),))
-        row = cursor.fetchone()
-        conn.close()
-        return row[0] if row else None
+    except BackendUnavailable:
+        raise
     except Exception as e:
         logging.error(f"MySQL lookup error: {e}")
         return None
+    account = AccountInfo(row[0], row[1], row[2] or 0) if row else None
+    account_cache.set(telegram_id, account, generation)
+    return account
 
-def get_characters_by_telegram_id(telegram_id: int) -> list[tuple[str, int]]:
-    try:
-        conn_auth = mysql.connector.connect(**DB_CONFIG)
-        cursor_auth = conn_auth.cursor()
-        cursor_auth.execute("SELECT id FROM account WHERE email = %s", (str(telegram_id),))
-        row = cursor_auth.fetchone()
-        conn_auth.close()
-
-        if not row:
-            return []
-
-        account_id = row[0]
-        char_config = DB_CONFIG.copy()
-        char_config["database"] = "acore_characters"
-        conn_chars = mysql.connector.connect(**char_config)
-        cursor_chars = conn_chars.cursor()
-        cursor_chars.execute(
-            "SELECT name, level FROM characters WHERE account = %s",
-            (account_id,)
-        )
-        chars = [(row[0], row[1]) for row in cursor_chars.fetchall()]
-        conn_chars.close()
+async def get_username_by_telegram_id(telegram_id: int) -> str | None:
+    account = await get_account_by_telegram_id(telegram_id)
+    return account.username if account else None
 
-        return chars
+@single_flight.wrap
+@instrument_mysql
+async def get_characters_by_telegram_id(telegram_id: int, realm: Realm) -> list[tuple[str, int]]:
+    try:
+        if realm.shares_auth_server:
+            account_id, params = telegram_binding.account_id(telegram_id)
+            rows = await auth_db.fetchall(
+                f"SELECT c.name, c.level FROM `{realm.characters_database}`.characters c "
+                f"WHERE c.account = {account_id}",
+                params
+            )
+        else:
+            account = await get_account_by_telegram_id(telegram_id)
+            if not account:
+                return []
+            rows = await realm.characters_db.fetchall(
+                "SELECT name, level FROM characters WHERE account = %s",
+                (account.id,)
+            )
+        return [(row[0], row[1]) for row in rows]
+    except BackendUnavailable:
+        raise
     except Exception as e:
         logging.error(f"Ошибка при получении персонажей: {e}")
         return []
 
-def is_character_owned_by_user(char_name: str, telegram_id: int) -> bool:
+@single_flight.wrap
+@instrument_mysql
+async def is_character_owned_by_user(char_name: str, telegram_id: int, realm: Realm) -> bool:
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM account WHERE email = %s", (str(telegram_id),))
-        row = cursor.fetchone()
-        conn.close()
-
-        if not row:
+        if realm.shares_auth_server:
+            account_id, params = telegram_binding.account_id(telegram_id)
+            row = await auth_db.fetchone(
+                f"SELECT 1 FROM `{realm.characters_database}`.characters c "
+                f"WHERE c.account = {account_id} AND c.name = %s LIMIT 1",
+                (*params, char_name)
+            )
+            return row is not None
+
+        account = await get_account_by_telegram_id(telegram_id)
+        if not account:
             return False
-
-        account_id = row[0]
-        char_config = DB_CONFIG.copy()
-        char_config["database"] = "acore_characters"
-        conn_chars = mysql.connector.connect(**char_config)
-        cursor_chars = conn_chars.cursor()
-        cursor_chars.execute("SELECT COUNT(*) FROM characters WHERE name = %s AND account = %s", (char_name, account_id))
-        result = cursor_chars.fetchone()
-        conn_chars.close()
-
+        result = await realm.characters_db.fetchone(
+            "SELECT COUNT(*) FROM characters WHERE name = %s AND account = %s",
+            (char_name, account.id)
+        )
         return result[0] > 0
+    except BackendUnavailable:
+        raise
     except Exception as e:
         logging.error(f"Ошибка при проверке владельца персонажа: {e}")
         return False
 
-def has_gm_access(telegram_id: int, level: int = 3) -> bool:
+async def is_character_owned_cached(char_name: str, telegram_id: int, state: FSMContext) -> bool:
+    data = await state.get_data()
+    characters = data.get("characters")
+    if characters is not None:
+        return char_name in characters
+    return await is_character_owned_by_user(char_name, telegram_id, get_realm(data.get("realm")) or DEFAULT_REALM)
+
+async def has_gm_access(telegram_id: int, level: int = 3) -> bool:
     """Check if user has GM access level >= level in account_access table."""
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM account WHERE email = %s", (str(telegram_id),))
-        row = cursor.fetchone()
-        if not row:
-            conn.close()
-            return False
-        account_id = row[0]
-        cursor.execute("SELECT gmlevel FROM account_access WHERE id = %s", (account_id,))
-        gm_row = cursor.fetchone()
-        conn.close()
-        return bool(gm_row and gm_row[0] >= level)
-    except Exception as e:
-        logging.error(f"MySQL GM level check error: {e}")
-        return False
+    account = await get_account_by_telegram_id(telegram_id)
+    return bool(account and account.gmlevel >= level)
 
 # === ХЕНДЛЕРЫ ===
 router = Router()
-
-@router.message(F.text == "🛎 Услуги")
+handler_metrics = HandlerMetricsMiddleware(handler_latency, handler_in_flight, handler_errors)
+for observer in (router.message, router.callback_query):
+    observer.middleware(LoggingContextMiddleware())
+    observer.middleware(handler_metrics)
+throttling = ThrottlingMiddleware(
+    user_rate=RATE_LIMIT_USER_RATE,
+    user_burst=RATE_LIMIT_USER_BURST,
+    backend_limits={
+        "soap": (RATE_LIMIT_SOAP_RATE, RATE_LIMIT_SOAP_BURST),
+        "mysql": (RATE_LIMIT_MYSQL_RATE, RATE_LIMIT_MYSQL_BURST),
+    },
+)
+router.message.middleware(throttling)
+router.callback_query.middleware(throttling)
+bulk_tasks: dict[int, asyncio.Task] = {}
+export_tasks: dict[int, asyncio.Task] = {}
+exports = ExportService(EXPORT_DIR, chunk_size=EXPORT_CHUNK_SIZE, progress_interval=EXPORT_PROGRESS_INTERVAL)
+
+@router.errors(ExceptionTypeFilter(BackendUnavailable))
+async def handle_backend_unavailable(event: ErrorEvent):
+    """A MySQL helper found the database down: say so instead of "not registered"."""
+    logging.warning(f"Update {event.update.update_id} failed: {event.exception}")
+    text = "❌ База данных сервера недоступна. Попробуйте через несколько минут."
+    if event.update.message:
+        await event.update.message.answer(text)
+    elif event.update.callback_query:
+        await event.update.callback_query.answer(text, show_alert=True)
+online_pages = TTLCache(maxsize=ONLINE_PAGE_CACHE_SIZE, ttl=STATUS_MAX_AGE)
+online_pages_version = None
+
+# reply keyboards are built once; buttons are dispatched by main_menu/admin_menu
+GUEST_KEYBOARD = reply_keyboard([["📥 Регистрация"]])
+PLAYER_KEYBOARD = reply_keyboard([["🔐 Смена пароля"], ["👥 Онлайн игроки"], ["📜 Мои персонажи"], ["🛎 Услуги"]])
+GM_KEYBOARD = reply_keyboard([["🔐 Смена пароля"], ["👥 Онлайн игроки"], ["📜 Мои персонажи"], ["🛎 Услуги", "🛠️ Админ панель"]])
+SERVICE_KEYBOARD = reply_keyboard([["🔁 Смена пола", "🔄 Смена фракции"], ["🧑‍🎨 Смена внешности", "📍 Телепортация"]])
+ADMIN_KEYBOARD = reply_keyboard([
+    ["✉️ Отправить письмо", "💰 Отправить золото"],
+    ["🎁 Отправить предмет", "⛔ Забанить"],
+    ["👢 Кикнуть с сервера", "🔓 Разбанить"],
+    ["🔄 Рестарт сервера", "🌐 Игроки онлайн"],
+    ["📦 Массовая отправка", "▶️ Продолжить рассылку"],
+    ["📣 Объявление", "📊 Объявления"],
+    ["📜 Журнал действий", "📤 Выгрузка"],
+    ["⌨️ Выполнить команду"],
+])
+BULK_KIND_KEYBOARD = reply_keyboard([["🎁 Предметы", "💰 Золото"]])
+EXPORT_KIND_KEYBOARD = reply_keyboard([["👤 Аккаунты", "🧙 Персонажи"]])
+EXPORT_FORMAT_KEYBOARD = reply_keyboard([["CSV", "JSON"]])
+
+# main menu buttons are checked before any state handler, so they work from every step.
+# States are wrapped in StateFilter: aiogram runs synchronous filters (a bare State, F.text)
+# in the thread pool, one executor hop per registered handler and message.
+main_menu = ButtonMenu()
+main_menu.register(router)
+admin_menu = ButtonMenu()
+
+@main_menu.button("🛎 Услуги", flags={"backends": ("mysql",)})
 async def handle_services(msg: Message, state: FSMContext):
-    chars = get_characters_by_telegram_id(msg.from_user.id)
+    if len(REALMS) > 1:
+        await msg.answer("Выберите игровой мир:", reply_markup=REALM_KEYBOARD)
+        await state.set_state(ServiceState.realm)
+        return
+    await show_service_characters(msg, state, DEFAULT_REALM)
+
+@router.message(StateFilter(ServiceState.realm), flags={"backends": ("mysql",)})
+async def process_service_realm(msg: Message, state: FSMContext):
+    realm = find_realm_by_name(msg.text)
+    if realm is None:
+        await msg.answer("❌ Неизвестный игровой мир.")
+        await state.clear()
+        return
+    await show_service_characters(msg, state, realm)
+
+async def show_service_characters(msg: Message, state: FSMContext, realm: Realm):
+    chars = await get_characters_by_telegram_id(msg.from_user.id, realm)
     if not chars:
         await msg.answer("❌ У вас нет персонажей или вы не зарегистрированы.")
+        await state.clear()
         return
 
-    buttons = [[KeyboardButton(text=name)] for name, _ in chars]
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    await state.update_data(realm=realm.id, characters=[name for name, _ in chars])
+    kb = reply_keyboard([[name] for name, _ in chars])
     await msg.answer("Выберите персонажа:", reply_markup=kb)
     await state.set_state(ServiceState.character_name)
 
-@router.message(ServiceState.character_name)
+@router.message(StateFilter(ServiceState.character_name), flags={"backends": ("mysql",)})
 async def handle_service_menu(msg: Message, state: FSMContext):
     char_name = msg.text.strip()
-    if not is_character_owned_by_user(char_name, msg.from_user.id):
+    if not await is_character_owned_cached(char_name, msg.from_user.id, state):
         await msg.answer("❌ Этот персонаж не принадлежит вашему аккаунту.")
         await state.clear()
         return
 
     await state.update_data(character_name=char_name)
-
-    buttons = [
-        [KeyboardButton(text="🔁 Смена пола"), KeyboardButton(text="🔄 Смена фракции")],
-        [KeyboardButton(text="🧑‍🎨 Смена внешности"), KeyboardButton(text="📍 Телепортация")]
-    ]
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    await msg.answer("Выберите услугу:", reply_markup=kb)
+    await msg.answer("Выберите услугу:", reply_markup=SERVICE_KEYBOARD)
     await state.set_state(ServiceState.service_type)
 
-@router.message(ServiceState.service_type)
+@router.message(StateFilter(ServiceState.service_type), flags={"backends": ("soap",)})
 async def handle_apply_service(msg: Message, state: FSMContext):
     data = await state.get_data()
     char_name = data.get("character_name")
@@ -295,7 +877,7 @@ async def handle_apply_service(msg: Message, state: FSMContext):
         await state.clear()
         return
 
-    if not char_name or not is_character_owned_by_user(char_name, msg.from_user.id):
+    if not char_name or not await is_character_owned_cached(char_name, msg.from_user.id, state):
         await msg.answer("❌ Этот персонаж не принадлежит вашему аккаунту.")
         await state.clear()
         return
@@ -311,177 +893,222 @@ async def handle_apply_service(msg: Message, state: FSMContext):
         f"teleport name {char_name} $home" if service == "teleport" else f"{command} {char_name}"
     )
 
-    result = send_soap_command(full_command)
-
-    if "does not exist" in result.lower():
-        await msg.answer("❌ Персонаж не найден.")
-    elif "500" in result.lower():
-        await msg.answer("❌ Внутренняя ошибка сервера. Попробуйте позже.")
-    else:
-       await msg.answer(f"✅ Услуга применена к <b>{char_name}</b>.")
-
+    await enqueue_soap_command(
+        msg, "service", full_command, {"character_name": char_name}, realm=get_realm(data.get("realm")) or DEFAULT_REALM
+    )
     await state.clear()
 
-@router.message(Command("start"))
+@router.message(Command("start"), flags={"backends": ("mysql",)})
 async def cmd_start(msg: Message):
     telegram_id = msg.from_user.id
-    username = get_username_by_telegram_id(telegram_id)
+    username = await get_username_by_telegram_id(telegram_id)
 
     if not username:
-        buttons = [[KeyboardButton(text="📥 Регистрация")]]
+        reply_kb = GUEST_KEYBOARD
         greeting = (
             "Добро Пожаловать в регистрационный бот игры World Of Warcraft на сервере WoWSeRVeR!"
         )
     else:
-        buttons = [
-            [KeyboardButton(text="🔐 Смена пароля")],
-            [KeyboardButton(text="👥 Онлайн игроки")],
-            [KeyboardButton(text="📜 Мои персонажи")],
-            [KeyboardButton(text="🛎 Услуги")]
-        ]
-        if has_gm_access(telegram_id, 3):
-            buttons[-1].append(KeyboardButton(text="🛠️ Админ панель"))
+        reply_kb = GM_KEYBOARD if await has_gm_access(telegram_id, 3) else PLAYER_KEYBOARD
         greeting = f"Добро Пожаловать снова {username}!"
 
-    reply_kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
     await msg.answer(greeting, reply_markup=reply_kb)
 
-@router.message(F.text == "📜 Мои персонажи")
+@main_menu.button("📜 Мои персонажи", flags={"backends": ("mysql",)})
 async def handle_my_chars(msg: Message):
-    chars = get_characters_by_telegram_id(msg.from_user.id)
-    if not chars:
-        await msg.answer("❌ У вас нет персонажей или вы не зарегистрированы.")
-    else:
+    async def fetch(realm: Realm) -> str:
+        try:
+            chars = await get_characters_by_telegram_id(msg.from_user.id, realm)
+        except BackendUnavailable:
+            return "❌ База персонажей недоступна."
+        if not chars:
+            return "❌ У вас нет персонажей или вы не зарегистрированы."
         lines = [f"• {name} (ур. {lvl})" for name, lvl in chars]
-        await msg.answer("👤 Ваши персонажи:\n" + "\n".join(lines))
+        return "👤 Ваши персонажи:\n" + "\n".join(lines)
+
+    await answer_per_realm(msg, fetch)
 
-@router.message(F.text == "👥 Онлайн игроки")
+@main_menu.button("👥 Онлайн игроки", flags={"backends": ("soap",)})
 async def handle_online_players(msg: Message):
-    result = send_soap_command("server info")
-    parsed = parse_server_info(result)
-    await msg.answer(parsed)
+    async def fetch(realm: Realm) -> str:
+        snapshot = realm.status.get_fresh(STATUS_MAX_AGE)
+        if snapshot is None:
+            result = await send_soap_command("server info", realm)
+            return parse_server_info(result)
+        parsed = format_server_info(snapshot.counters)
+        return f"{parsed}\n🕒 Обновлено {int(snapshot.age)} с назад"
 
-@router.message(F.text == "📥 Регистрация")
+    await answer_per_realm(msg, fetch)
+
+@main_menu.button("📥 Регистрация")
 async def handle_register(msg: Message, state: FSMContext):
     await msg.answer("Введите логин:")
     await state.set_state(RegState.login)
 
-@router.message(RegState.login)
+@router.message(StateFilter(RegState.login), flags={"backends": ("mysql",)})
 async def process_register_login(msg: Message, state: FSMContext):
     login = msg.text.strip()
-    telegram_id = msg.from_user.id
-    existing_login = get_username_by_telegram_id(telegram_id)
+    availability = await check_login_availability(login, msg.from_user.id)
 
-    if existing_login:
-        await msg.answer(f"🔐 Вы уже зарегистрированы под логином <b>{existing_login}</b>.")
+    if availability is None:
+        await msg.answer("❌ Ошибка базы данных. Попробуйте позже.")
+        await state.clear()
+        return
+    if availability.existing_login:
+        await msg.answer(f"🔐 Вы уже зарегистрированы под логином <b>{escape(availability.existing_login)}</b>.")
         await state.clear()
         return
-    if is_account_exists(login):
+    if not availability.available:
         await msg.answer("❌ Логин уже занят. Введите другой логин:")
         return
     await state.update_data(login=login)
     await msg.answer("Введите пароль:")
     await state.set_state(RegState.password)
 
-@router.message(RegState.password)
+@router.message(StateFilter(RegState.password), flags={"backends": ("mysql", "soap")})
 async def process_register_password(msg: Message, state: FSMContext):
     password = msg.text.strip()
     data = await state.get_data()
     login = data.get("login")
     telegram_id = msg.from_user.id
-    existing_login = get_username_by_telegram_id(telegram_id)
 
-    if existing_login:
-        await msg.answer(f"🔐 Вы уже зарегистрированы под логином <b>{existing_login}</b>.")
-        await state.clear()
-    elif is_account_exists(login):
-        await msg.answer("❌ Логин уже занят.")
-        await state.clear()
-    else:
-        result = send_soap_command(f"account create {login} {password}")
-        set_telegram_email(login, telegram_id)
-        match = re.search(r"Account created: (\S+)", result)
-        if match:
-            result = f"Аккаунт создан: {match.group(1)}"
-        await msg.answer(f"✅ {escape(result)}")
-        await state.clear()
+    # the login step reserved the name; only re-check if the reservation expired
+    if not registration.is_reserved(login, telegram_id):
+        availability = await check_login_availability(login, telegram_id)
+        if availability is None:
+            await msg.answer("❌ Ошибка базы данных. Попробуйте позже.")
+            await state.clear()
+            return
+        if availability.existing_login:
+            await msg.answer(f"🔐 Вы уже зарегистрированы под логином <b>{escape(availability.existing_login)}</b>.")
+            await state.clear()
+            return
+        if not availability.available:
+            await msg.answer("❌ Логин уже занят.")
+            await state.clear()
+            return
+
+    await enqueue_soap_command(
+        msg,
+        "account_create",
+        f"account create {login} {password}",
+        {"login": login, "telegram_id": telegram_id},
+        secret=True,  # the password stays in memory, never in the queue file
+    )
+    await state.clear()
 
-@router.message(F.text == "🔐 Смена пароля")
+@main_menu.button("🔐 Смена пароля", flags={"backends": ("mysql",)})
 async def handle_change_pass(msg: Message, state: FSMContext):
-    username = get_username_by_telegram_id(msg.from_user.id)
+    username = await get_username_by_telegram_id(msg.from_user.id)
     if not username:
         await msg.answer("❌ Сначала зарегистрируйтесь.")
         return
     await msg.answer("Введите новый пароль:")
     await state.set_state(PasswordChangeState.new_password)
 
-@router.message(PasswordChangeState.new_password)
+@router.message(StateFilter(PasswordChangeState.new_password), flags={"backends": ("mysql", "soap")})
 async def process_change_pass(msg: Message, state: FSMContext):
-    username = get_username_by_telegram_id(msg.from_user.id)
+    username = await get_username_by_telegram_id(msg.from_user.id)
     password = msg.text.strip()
-    result = send_soap_command(f"account set password {username} {password} {password}")
+    result = await send_soap_command(f"account set password {username} {password} {password}")
     if "The password was changed" in result:
         result = "✅ Пароль успешно изменён."
     await msg.answer(result)
     await state.clear()
 
-@router.message(F.text == "🛠️ Админ панель")
+@main_menu.button("🛠️ Админ панель", flags={"backends": ("mysql",)})
 async def handle_admin(msg: Message, state: FSMContext):
-    if not has_gm_access(msg.from_user.id, 3):
+    if not await has_gm_access(msg.from_user.id, 3):
         await msg.answer("❌ У вас нет прав.")
         return
-    buttons = [
-        [KeyboardButton(text="✉️ Отправить письмо"), KeyboardButton(text="💰 Отправить золото")],
-        [KeyboardButton(text="🎁 Отправить предмет"), KeyboardButton(text="⛔ Забанить")],
-        [KeyboardButton(text="👢 Кикнуть с сервера"), KeyboardButton(text="🔓 Разбанить")],
-        [KeyboardButton(text="🔄 Рестарт сервера")],
-        [KeyboardButton(text="⌨️ Выполнить команду")]
-    ]
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    await msg.answer("Выберите действие:", reply_markup=kb)
+    if len(REALMS) > 1:
+        await msg.answer("Выберите игровой мир:", reply_markup=REALM_KEYBOARD)
+        await state.set_state(AdminPanelState.realm)
+        return
+    await show_admin_panel(msg, state, DEFAULT_REALM)
+
+@router.message(StateFilter(AdminPanelState.realm))
+async def process_admin_realm(msg: Message, state: FSMContext):
+    realm = find_realm_by_name(msg.text)
+    if realm is None:
+        await msg.answer("❌ Неизвестный игровой мир.")
+        await state.clear()
+        return
+    await show_admin_panel(msg, state, realm)
+
+def format_backend_health() -> str:
+    lines = ["<b>Состояние серверов:</b>"]
+    for breaker in breakers:
+        state = breaker.state
+        if state == CircuitBreaker.OPEN:
+            lines.append(f"🔴 {breaker.name} — недоступен, проверка через {breaker.retry_in:.0f} с")
+        elif state == CircuitBreaker.HALF_OPEN:
+            lines.append(f"🟡 {breaker.name} — проверяется")
+        elif breaker.failures:
+            lines.append(f"🟠 {breaker.name} — ошибок подряд: {breaker.failures}")
+        else:
+            lines.append(f"🟢 {breaker.name}")
+    return "\n".join(lines)
+
+async def show_admin_panel(msg: Message, state: FSMContext, realm: Realm):
+    await state.update_data(realm=realm.id)
+    await msg.answer(f"{format_backend_health()}\n\nВыберите действие:", reply_markup=ADMIN_KEYBOARD)
     await state.set_state(AdminPanelState.choice)
 
-@router.message(AdminPanelState.choice)
+admin_menu.prompt("⌨️ Выполнить команду", "Введите SOAP команду:", AdminCommandState.command)
+admin_menu.prompt("✉️ Отправить письмо", "Введите имя персонажа:", SendMailState.character_name)
+admin_menu.prompt("💰 Отправить золото", "Введите имя персонажа:", SendMoneyState.character_name)
+admin_menu.prompt("🎁 Отправить предмет", "Введите имя персонажа:", SendItemsState.character_name)
+admin_menu.prompt("⛔ Забанить", "Введите имя персонажа:", BanState.character_name)
+admin_menu.prompt("🔓 Разбанить", "Введите имя персонажа:", UnbanState.character_name)
+admin_menu.prompt("🔄 Рестарт сервера", "Введите задержку в секундах:", RestartServerState.delay)
+admin_menu.prompt(
+    "🌐 Игроки онлайн",
+    "Введите фильтры или «-» для всех игроков.\n"
+    "Пример: <code>имя=Ar ур=70-80 класс=маг зона=3703</code>",
+    OnlineBrowserState.filters,
+)
+admin_menu.prompt(
+    "📜 Журнал действий",
+    "Введите фильтры или «-» для последних действий.\n"
+    "Пример: <code>админ=123456789 перс=Arthas с=01.05.2024 по=31.05.2024</code>",
+    AuditLogState.filters,
+)
+admin_menu.prompt("📣 Объявление", "Введите текст объявления для всех зарегистрированных игроков:", BroadcastState.text)
+admin_menu.register(router, StateFilter(AdminPanelState.choice))
+
+@admin_menu.button("📦 Массовая отправка")
+async def handle_admin_bulk(msg: Message, state: FSMContext):
+    await msg.answer("Что отправить?", reply_markup=BULK_KIND_KEYBOARD)
+    await state.set_state(BulkSendState.kind)
+
+@admin_menu.button("📤 Выгрузка")
+async def handle_admin_export(msg: Message, state: FSMContext):
+    await msg.answer("Что выгрузить?", reply_markup=EXPORT_KIND_KEYBOARD)
+    await state.set_state(ExportState.kind)
+
+@admin_menu.button("📊 Объявления")
+async def handle_admin_broadcasts(msg: Message, state: FSMContext):
+    await show_broadcasts(msg)
+    await state.clear()
+
+@admin_menu.button("▶️ Продолжить рассылку")
+async def handle_admin_resume_bulk(msg: Message, state: FSMContext):
+    await resume_bulk_job(msg, state)
+    await state.clear()
+
+@router.message(StateFilter(AdminPanelState.choice))
 async def handle_admin_choice(msg: Message, state: FSMContext):
-    action = msg.text.strip()
-    if action == "⌨️ Выполнить команду":
-        await msg.answer("Введите SOAP команду:")
-        await state.set_state(AdminCommandState.command)
-        return
-    if action == "✉️ Отправить письмо":
-        await msg.answer("Введите имя персонажа:")
-        await state.set_state(SendMailState.character_name)
-        return
-    if action == "💰 Отправить золото":
-        await msg.answer("Введите имя персонажа:")
-        await state.set_state(SendMoneyState.character_name)
-        return
-    if action == "🎁 Отправить предмет":
-        await msg.answer("Введите имя персонажа:")
-        await state.set_state(SendItemsState.character_name)
-        return
-    if action == "⛔ Забанить":
-        await msg.answer("Введите имя персонажа:")
-        await state.set_state(BanState.character_name)
-        return
-    if action == "🔓 Разбанить":
-        await msg.answer("Введите имя персонажа:")
-        await state.set_state(UnbanState.character_name)
-        return
-    if action == "🔄 Рестарт сервера":
-        await msg.answer("Введите задержку в секундах:")
-        await state.set_state(RestartServerState.delay)
-        return
-    await msg.answer(f"Функция <b>{escape(action)}</b> пока не реализована.")
+    await msg.answer(f"Функция <b>{escape(msg.text or '')}</b> пока не реализована.")
     await state.clear()
 
-@router.message(BanState.character_name)
+@router.message(StateFilter(BanState.character_name))
 async def process_ban_character(msg: Message, state: FSMContext):
     await state.update_data(character_name=msg.text.strip())
     await msg.answer("Введите время бана в секундах:")
     await state.set_state(BanState.bantime)
 
-@router.message(BanState.bantime)
+@router.message(StateFilter(BanState.bantime))
 async def process_ban_time(msg: Message, state: FSMContext):
     bantime = msg.text.strip()
     if not bantime.isdigit():
@@ -491,64 +1118,74 @@ async def process_ban_time(msg: Message, state: FSMContext):
     await msg.answer("Введите причину бана:")
     await state.set_state(BanState.reason)
 
-@router.message(BanState.reason)
+@router.message(StateFilter(BanState.reason), flags={"backends": ("soap",)})
 async def process_ban_reason(msg: Message, state: FSMContext):
     data = await state.get_data()
     char_name = data.get("character_name")
     bantime = data.get("bantime")
     reason = msg.text.strip()
-    result = send_soap_command(f"ban character {char_name} {bantime} {reason}")
-    await msg.answer(f"<pre>{escape(result)}</pre>")
+    result = await send_admin_command(
+        msg, await get_state_realm(state), "ban", f"ban character {char_name} {bantime} {reason}", target=char_name
+    )
+    ban = soap_codec.parse_ban(result)
+    if ban:
+        duration = ban["duration"] or "навсегда"
+        await msg.answer(
+            f"⛔ <b>{escape(ban['target'])}</b> забанен: {escape(duration)}.\nПричина: {escape(ban['reason'])}"
+        )
+    else:
+        await msg.answer(f"<pre>{escape(result)}</pre>")
     await state.clear()
 
-@router.message(UnbanState.character_name)
+@router.message(StateFilter(UnbanState.character_name), flags={"backends": ("soap",)})
 async def process_unban_character(msg: Message, state: FSMContext):
     char_name = msg.text.strip()
-    result = send_soap_command(f"unban character {char_name}")
+    result = await send_admin_command(
+        msg, await get_state_realm(state), "unban", f"unban character {char_name}", target=char_name
+    )
     await msg.answer(f"<pre>{escape(result)}</pre>")
     await state.clear()
-@router.message(SendMailState.character_name)
+@router.message(StateFilter(SendMailState.character_name))
 async def process_mail_name(msg: Message, state: FSMContext):
     await state.update_data(character_name=msg.text.strip())
     await msg.answer("Введите тему письма:")
     await state.set_state(SendMailState.subject)
 
-@router.message(SendMailState.subject)
+@router.message(StateFilter(SendMailState.subject))
 async def process_mail_subject(msg: Message, state: FSMContext):
     await state.update_data(subject=msg.text.strip())
     await msg.answer("Введите текст письма:")
     await state.set_state(SendMailState.text)
 
-@router.message(SendMailState.text)
+@router.message(StateFilter(SendMailState.text), flags={"backends": ("soap",)})
 async def process_send_mail(msg: Message, state: FSMContext):
     data = await state.get_data()
     char_name = data.get("character_name")
     subject = data.get("subject", "").replace('"', '\\"')
     text = msg.text.strip().replace('"', '\\"')
     cmd = f'send mail {char_name} "{subject}" "{text}"'
-    result = send_soap_command(cmd)
-    await msg.answer(f"<pre>{escape(result)}</pre>")
+    await enqueue_admin_command(msg, state, "mail", cmd, char_name)
     await state.clear()
 
-@router.message(SendMoneyState.character_name)
+@router.message(StateFilter(SendMoneyState.character_name))
 async def process_money_name(msg: Message, state: FSMContext):
     await state.update_data(character_name=msg.text.strip())
     await msg.answer("Введите тему письма:")
     await state.set_state(SendMoneyState.subject)
 
-@router.message(SendMoneyState.subject)
+@router.message(StateFilter(SendMoneyState.subject))
 async def process_money_subject(msg: Message, state: FSMContext):
     await state.update_data(subject=msg.text.strip())
     await msg.answer("Введите текст письма:")
     await state.set_state(SendMoneyState.text)
 
-@router.message(SendMoneyState.text)
+@router.message(StateFilter(SendMoneyState.text))
 async def process_money_text(msg: Message, state: FSMContext):
     await state.update_data(text=msg.text.strip())
     await msg.answer("Введите количество золота:")
     await state.set_state(SendMoneyState.amount)
 
-@router.message(SendMoneyState.amount)
+@router.message(StateFilter(SendMoneyState.amount), flags={"backends": ("soap",)})
 async def process_send_money(msg: Message, state: FSMContext):
     if not msg.text.strip().isdigit():
         await msg.answer("Введите число золота:")
@@ -559,29 +1196,28 @@ async def process_send_money(msg: Message, state: FSMContext):
     text = data.get("text", "").replace('"', '\\"')
     amount = msg.text.strip()
     cmd = f'send money {char_name} "{subject}" "{text}" {amount}'
-    result = send_soap_command(cmd)
-    await msg.answer(f"<pre>{escape(result)}</pre>")
+    await enqueue_admin_command(msg, state, "money", cmd, char_name)
     await state.clear()
 
-@router.message(SendItemsState.character_name)
+@router.message(StateFilter(SendItemsState.character_name))
 async def process_items_name(msg: Message, state: FSMContext):
     await state.update_data(character_name=msg.text.strip())
     await msg.answer("Введите тему письма:")
     await state.set_state(SendItemsState.subject)
 
-@router.message(SendItemsState.subject)
+@router.message(StateFilter(SendItemsState.subject))
 async def process_items_subject(msg: Message, state: FSMContext):
     await state.update_data(subject=msg.text.strip())
     await msg.answer("Введите текст письма:")
     await state.set_state(SendItemsState.text)
 
-@router.message(SendItemsState.text)
+@router.message(StateFilter(SendItemsState.text))
 async def process_items_text(msg: Message, state: FSMContext):
     await state.update_data(text=msg.text.strip())
     await msg.answer("Введите предметы (id[:кол-во] через пробел):")
     await state.set_state(SendItemsState.items)
 
-@router.message(SendItemsState.items)
+@router.message(StateFilter(SendItemsState.items), flags={"backends": ("soap",)})
 async def process_send_items(msg: Message, state: FSMContext):
     data = await state.get_data()
     char_name = data.get("character_name")
@@ -589,11 +1225,10 @@ async def process_send_items(msg: Message, state: FSMContext):
     text = data.get("text", "").replace('"', '\\"')
     items = msg.text.strip()
     cmd = f'send items {char_name} "{subject}" "{text}" {items}'
-    result = send_soap_command(cmd)
-    await msg.answer(f"<pre>{escape(result)}</pre>")
+    await enqueue_admin_command(msg, state, "items", cmd, char_name)
     await state.clear()
 
-@router.message(RestartServerState.delay)
+@router.message(StateFilter(RestartServerState.delay))
 async def process_restart_delay(msg: Message, state: FSMContext):
     delay = msg.text.strip()
     if not delay.isdigit():
@@ -603,7 +1238,7 @@ async def process_restart_delay(msg: Message, state: FSMContext):
     await msg.answer("Введите код завершения (по умолчанию 0):")
     await state.set_state(RestartServerState.exit_code)
 
-@router.message(RestartServerState.exit_code)
+@router.message(StateFilter(RestartServerState.exit_code), flags={"backends": ("soap",)})
 async def process_restart_exit_code(msg: Message, state: FSMContext):
     exit_code = msg.text.strip()
     if not exit_code.isdigit():
@@ -611,28 +1246,582 @@ async def process_restart_exit_code(msg: Message, state: FSMContext):
     data = await state.get_data()
     delay = data.get("delay", "0")
     cmd = f'server restart {delay} {exit_code}'
-    result = send_soap_command(cmd)
+    result = await send_admin_command(msg, await get_state_realm(state), "restart", cmd)
     await msg.answer(f"<pre>{escape(result)}</pre>")
     await state.clear()
-@router.message(AdminCommandState.command)
+@router.message(StateFilter(BulkSendState.kind))
+async def process_bulk_kind(msg: Message, state: FSMContext):
+    kind = {"🎁 Предметы": "items", "💰 Золото": "money"}.get(msg.text.strip())
+    if not kind:
+        await msg.answer("❌ Неизвестный тип рассылки.")
+        await state.clear()
+        return
+    await state.update_data(kind=kind)
+    await msg.answer(
+        "Введите имена персонажей через пробел или запятую\n"
+        "либо выборку вида <code>level>=80</code>:"
+    )
+    await state.set_state(BulkSendState.recipients)
+
+@router.message(StateFilter(BulkSendState.recipients), flags={"backends": ("mysql",)})
+async def process_bulk_recipients(msg: Message, state: FSMContext):
+    text = msg.text.strip()
+    min_level = parse_level_selector(text)
+    if min_level is not None:
+        realm = await get_state_realm(state)
+        try:
+            rows = await realm.characters_db.fetchall(
+                "SELECT name FROM characters WHERE level >= %s ORDER BY guid", (min_level,)
+            )
+        except Exception as e:
+            logging.error(f"MySQL bulk selector error: {e}")
+            await msg.answer("❌ Не удалось получить список персонажей.")
+            await state.clear()
+            return
+        recipients = [row[0] for row in rows]
+    else:
+        recipients = parse_recipients(text)
+
+    if not recipients:
+        await msg.answer("❌ Получатели не найдены. Введите имена или выборку:")
+        return
+    await state.update_data(recipients=recipients)
+    await msg.answer(f"Получателей: {len(recipients)}. Введите тему письма:")
+    await state.set_state(BulkSendState.subject)
+
+@router.message(StateFilter(BulkSendState.subject))
+async def process_bulk_subject(msg: Message, state: FSMContext):
+    await state.update_data(subject=msg.text.strip())
+    await msg.answer("Введите текст письма:")
+    await state.set_state(BulkSendState.text)
+
+@router.message(StateFilter(BulkSendState.text))
+async def process_bulk_text(msg: Message, state: FSMContext):
+    data = await state.update_data(text=msg.text.strip())
+    if data["kind"] == "money":
+        await msg.answer("Введите количество золота:")
+    else:
+        await msg.answer("Введите предметы (id[:кол-во] через пробел):")
+    await state.set_state(BulkSendState.payload)
+
+@router.message(StateFilter(BulkSendState.payload), flags={"backends": ("soap",)})
+async def process_bulk_payload(msg: Message, state: FSMContext):
+    data = await state.get_data()
+    payload = msg.text.strip()
+    if data["kind"] == "money" and not payload.isdigit():
+        await msg.answer("Введите число золота:")
+        return
+    if data["kind"] == "items" and parse_items(payload) is None:
+        await msg.answer("Введите предметы в формате id[:кол-во] через пробел:")
+        return
+
+    job = BulkJob(
+        kind=data["kind"],
+        subject=data.get("subject", ""),
+        text=data.get("text", ""),
+        payload=payload,
+        recipients=data["recipients"],
+        realm=data.get("realm"),
+    )
+    await state.clear()
+    await start_bulk_job(msg, state, job)
+
+def get_destiny_context(state: FSMContext, destiny: str) -> FSMContext:
+    return FSMContext(storage=state.storage, key=replace(state.key, destiny=destiny))
+
+def format_bulk_progress(job: BulkJob) -> str:
+    text = f"📦 Рассылка: отправлено {len(job.done)} из {job.total} писем"
+    if job.errors:
+        text += f"\n⚠️ Не доставлено: {len(job.errors)}"
+    return text
+
+async def resume_bulk_job(msg: Message, state: FSMContext):
+    data = await get_destiny_context(state, "bulk").get_data()
+    job = BulkJob.from_dict(data["job"]) if data.get("job") else None
+    if not job or not job.pending():
+        await msg.answer("Нет незавершённой рассылки.")
+        return
+    await start_bulk_job(msg, state, job)
+
+async def start_bulk_job(msg: Message, state: FSMContext, job: BulkJob):
+    admin_id = msg.from_user.id
+    running = bulk_tasks.get(admin_id)
+    if running and not running.done():
+        await msg.answer("⏳ Рассылка уже выполняется.")
+        return
+    realm = get_realm(job.realm)
+    if realm is None:
+        await msg.answer(f"❌ Игровой мир {escape(job.realm)} больше не настроен.")
+        return
+
+    bulk_ctx = get_destiny_context(state, "bulk")
+    progress = await msg.answer(format_bulk_progress(job))
+    last_edit = time.monotonic()
+
+    async def save(job: BulkJob):
+        await bulk_ctx.set_data({"job": job.to_dict()})
+
+    async def on_progress(job: BulkJob):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < BULK_PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await progress.edit_text(format_bulk_progress(job))
+        except Exception as e:
+            logging.warning(f"Bulk progress update failed: {e}")
+
+    async def send(command: str) -> str:
+        target = command.split(maxsplit=3)[2]  # send money|items <name> ...
+        started = time.monotonic()
+        # same rule as send_queued_soap_command: only a refused connection or an open circuit
+        # proves the mail was not sent; anything else is final and must not be resent
+        try:
+            result = await call_soap_command(command, realm)
+        except (aiohttp.ClientConnectorError, BackendUnavailable) as e:
+            audit.record(admin_id, f"bulk_{job.kind}", command, f"❌ {e}", time.monotonic() - started, target, realm.id)
+            raise
+        except Exception as e:
+            result = realm.soap.format_error(e)
+        audit.record(admin_id, f"bulk_{job.kind}", command, result, time.monotonic() - started, target, realm.id)
+        return result
+
+    async def run():
+        try:
+            await run_bulk_job(job, send, save, on_progress, concurrency=BULK_CONCURRENCY)
+            await progress.edit_text(format_bulk_progress(job))
+            if job.interrupted:
+                error = escape(job.stop_error)
+                await msg.answer(
+                    f"⚠️ Рассылка прервана: {error}\n"
+                    f"Нажмите «▶️ Продолжить рассылку» в админ панели, чтобы отправить оставшиеся письма."
+                )
+            else:
+                await bulk_ctx.clear()
+                text = "✅ Рассылка завершена."
+                if job.errors:
+                    names = dict.fromkeys(key.split("#")[0] for key in job.errors)
+                    text += f"\n⚠️ Не доставлено: {escape(', '.join(names))}"
+                await msg.answer(text)
+        except Exception as e:
+            logging.error(f"Bulk job error: {e}")
+            await msg.answer("❌ Ошибка рассылки. Нажмите «▶️ Продолжить рассылку», чтобы повторить.")
+
+    bulk_tasks[admin_id] = asyncio.create_task(run())
+
+@router.message(StateFilter(OnlineBrowserState.filters), flags={"backends": ("mysql",)})
+async def process_online_filters(msg: Message, state: FSMContext):
+    filters = parse_online_filters(msg.text)
+    if filters is None:
+        await msg.answer("❌ Не удалось разобрать фильтры. Пример: <code>имя=Ar ур=70-80 класс=маг</code>")
+        return
+    realm = await get_state_realm(state)
+    await state.clear()
+    online_ctx = get_destiny_context(state, "online")
+    await online_ctx.set_data({"realm": realm.id, "filters": filters.to_dict(), "cursors": [0]})
+    text, kb = await render_online_page(online_ctx, 0)
+    await msg.answer(text, reply_markup=kb)
+
+@router.callback_query(OnlinePage.filter(), flags={"backends": ("mysql",)})
+async def handle_online_page(callback: CallbackQuery, callback_data: OnlinePage, state: FSMContext):
+    if not await has_gm_access(callback.from_user.id, 3):
+        await callback.answer("❌ У вас нет прав.", show_alert=True)
+        return
+    if not isinstance(callback.message, Message):
+        await callback.answer("Сообщение устарело. Откройте список снова.", show_alert=True)
+        return
+    online_ctx = get_destiny_context(state, "online")
+    text, kb = await render_online_page(online_ctx, callback_data.page)
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except TelegramBadRequest:
+        pass  # page did not change
+    await callback.answer()
+
+def get_online_page_cache() -> TTLCache:
+    global online_pages_version
+    version = tuple(realm.status.snapshot.updated_at if realm.status.snapshot else None for realm in REALMS)
+    if version != online_pages_version:
+        online_pages.clear()
+        online_pages_version = version
+    return online_pages
+
+async def render_online_page(online_ctx: FSMContext, page: int) -> tuple[str, InlineKeyboardMarkup | None]:
+    data = await online_ctx.get_data()
+    if "cursors" not in data:
+        return "Список устарел. Откройте «🌐 Игроки онлайн» снова.", None
+    filters = OnlineFilters(**data["filters"])
+    cursors = data["cursors"]
+    page = max(0, min(page, len(cursors) - 1))
+    realm = get_realm(data.get("realm")) or DEFAULT_REALM
+
+    cache = get_online_page_cache()
+    cache_key = (realm.id, filters.key, cursors[page])
+    cached = cache.get(cache_key)
+    if cached is MISSING:
+        try:
+            cached = await fetch_online_page(realm.characters_db, filters, cursors[page], ONLINE_PAGE_SIZE)
+        except Exception as e:
+            logging.error(f"MySQL online players error: {e}")
+            return "❌ Не удалось получить список игроков.", None
+        cache.set(cache_key, cached)
+    rows, has_more = cached
+
+    if has_more and len(cursors) == page + 1:
+        cursors.append(rows[-1][0])
+        await online_ctx.update_data(cursors=cursors)
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="⬅️", callback_data=OnlinePage(page=page - 1).pack()))
+    if has_more:
+        buttons.append(InlineKeyboardButton(text="➡️", callback_data=OnlinePage(page=page + 1).pack()))
+    kb = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return format_online_page(rows, page), kb
+
+@router.message(StateFilter(BroadcastState.text))
+async def process_broadcast_text(msg: Message, state: FSMContext):
+    await state.update_data(text=escape(msg.text.strip()))
+    await msg.answer(
+        "Когда отправить? «сейчас», <code>ЧЧ:ММ</code> или <code>ДД.ММ.ГГГГ ЧЧ:ММ</code> (время сервера)."
+    )
+    await state.set_state(BroadcastState.send_at)
+
+@router.message(StateFilter(BroadcastState.send_at))
+async def process_broadcast_time(msg: Message, state: FSMContext):
+    send_at = parse_send_time(msg.text)
+    if send_at is None:
+        await msg.answer("❌ Не удалось разобрать время. Пример: <code>21:30</code> или <code>сейчас</code>")
+        return
+    data = await state.get_data()
+    broadcast_id = await broadcasts.create(data["text"], send_at, msg.from_user.id)
+    when = datetime.fromtimestamp(send_at).strftime("%d.%m.%Y %H:%M")
+    await msg.answer(
+        f"📣 Объявление #{broadcast_id} запланировано на {when}.\n"
+        f"Отменить: <code>/broadcast_cancel {broadcast_id}</code>"
+    )
+    await state.clear()
+
+async def show_broadcasts(msg: Message):
+    recent = await broadcasts.recent()
+    if not recent:
+        await msg.answer("Объявлений пока не было.")
+        return
+    statuses = {"scheduled": "⏳ запланировано", "running": "📤 отправляется", "done": "✅ готово", "cancelled": "❌ отменено"}
+    lines = [
+        f"<b>#{broadcast.id}</b> {statuses.get(broadcast.status, broadcast.status)}, "
+        f"{datetime.fromtimestamp(broadcast.send_at).strftime('%d.%m %H:%M')}\n{format_broadcast_stats(broadcast)}"
+        for broadcast in recent
+    ]
+    await msg.answer("\n\n".join(lines))
+
+@router.message(Command("broadcast_cancel"), flags={"backends": ("mysql",)})
+async def cmd_broadcast_cancel(msg: Message):
+    if not await has_gm_access(msg.from_user.id, 3):
+        await msg.answer("❌ У вас нет прав.")
+        return
+    args = (msg.text or "").split()
+    if len(args) != 2 or not args[1].isdigit():
+        await msg.answer("Использование: <code>/broadcast_cancel ID</code>")
+        return
+    if await broadcasts.cancel(int(args[1])):
+        await msg.answer(f"❌ Объявление #{args[1]} отменено.")
+    else:
+        await msg.answer("Объявление не найдено или уже разослано.")
+
+@router.message(StateFilter(AuditLogState.filters))
+async def process_audit_filters(msg: Message, state: FSMContext):
+    filters = parse_audit_filters(msg.text or "")
+    if filters is None:
+        await msg.answer("❌ Не удалось разобрать фильтры. Пример: <code>перс=Arthas с=01.05.2024</code>")
+        return
+    await state.clear()
+    try:
+        records = await audit.query(filters, AUDIT_PAGE_SIZE)
+    except Exception as e:
+        logging.error(f"Audit query error: {e}")
+        await msg.answer("❌ Не удалось прочитать журнал.")
+        return
+    if not records:
+        await msg.answer("Записей не найдено.")
+        return
+    lines = [
+        f"<b>{datetime.fromtimestamp(record.created_at).strftime('%d.%m %H:%M:%S')}</b> "
+        f"<code>{record.actor_id}</code> {escape(record.action)}"
+        f"{f' → {escape(record.target)}' if record.target else ''}, {record.duration * 1000:.0f} мс\n"
+        f"<code>{escape(record.command[:200])}</code>\n{escape(record.result[:200])}"
+        for record in records
+    ]
+    await msg.answer("\n\n".join(lines))
+
+@router.message(StateFilter(ExportState.kind))
+async def process_export_kind(msg: Message, state: FSMContext):
+    kind = {"👤 Аккаунты": "accounts", "🧙 Персонажи": "characters"}.get((msg.text or "").strip())
+    if not kind:
+        await msg.answer("❌ Неизвестный тип выгрузки.")
+        await state.clear()
+        return
+    await state.update_data(kind=kind)
+    if kind == "characters":
+        await msg.answer("Введите минимальный уровень персонажей или «-» для всех:")
+        await state.set_state(ExportState.min_level)
+        return
+    await msg.answer("Выберите формат файла:", reply_markup=EXPORT_FORMAT_KEYBOARD)
+    await state.set_state(ExportState.format)
+
+@router.message(StateFilter(ExportState.min_level))
+async def process_export_level(msg: Message, state: FSMContext):
+    text = (msg.text or "").strip()
+    if text != "-" and not text.isdigit():
+        await msg.answer("Введите число или «-»:")
+        return
+    await state.update_data(min_level=0 if text == "-" else int(text))
+    await msg.answer("Выберите формат файла:", reply_markup=EXPORT_FORMAT_KEYBOARD)
+    await state.set_state(ExportState.format)
+
+@router.message(StateFilter(ExportState.format))
+async def process_export_format(msg: Message, state: FSMContext):
+    export_format = (msg.text or "").strip().lower()
+    if export_format not in ("csv", "json"):
+        await msg.answer("❌ Выберите CSV или JSON.", reply_markup=EXPORT_FORMAT_KEYBOARD)
+        return
+    data = await state.get_data()
+    if data["kind"] == "accounts":
+        export = Export("accounts", export_format, telegram_binding.export_accounts_query())
+        connect = auth_db.connect
+    else:
+        realm = await get_state_realm(state)
+        name = "characters" if len(REALMS) == 1 else f"characters-{realm.id}"
+        export = Export(name, export_format, CHARACTERS_EXPORT_QUERY, (data["min_level"],))
+        connect = realm.characters_db.connect
+    await state.clear()
+    await start_export(msg, export, connect)
+
+async def start_export(msg: Message, export: Export, connect):
+    admin_id = msg.from_user.id
+    running = export_tasks.get(admin_id)
+    if running and not running.done():
+        await msg.answer("⏳ Выгрузка уже выполняется.")
+        return
+    progress = await msg.answer("📤 Выгрузка запущена…")
+    reported = 0
+
+    async def on_progress(export: Export):
+        nonlocal reported
+        if export.rows == reported:
+            return
+        reported = export.rows
+        try:
+            await progress.edit_text(f"📤 Выгрузка: {export.rows} строк…")
+        except Exception as e:
+            logging.warning(f"Export progress update failed: {e}")
+
+    async def run():
+        started = time.monotonic()
+        description = f"export {export.name} {export.format}" + "".join(f" {param}" for param in export.params)
+        try:
+            await exports.run(export, connect, on_progress)
+        except Exception as e:
+            logging.error(f"Export {export.name} error: {e}")
+            audit.record(admin_id, "export", description, f"❌ {e}", time.monotonic() - started)
+            await msg.answer("❌ Не удалось выполнить выгрузку.")
+            return
+        size_mb = export.size / 1024 / 1024
+        audit.record(admin_id, "export", description, f"{export.rows} rows, {size_mb:.1f} MB", time.monotonic() - started)
+        await progress.edit_text(f"📤 Выгрузка: {export.rows} строк, {size_mb:.1f} МБ.")
+        if export.size > EXPORT_MAX_DOCUMENT_SIZE:
+            await msg.answer(
+                f"⚠️ Файл больше 50 МБ, Telegram его не примет. Он сохранён на сервере: "
+                f"<code>{escape(export.path)}</code>"
+            )
+            return
+        try:
+            await msg.answer_document(FSInputFile(export.path), caption=f"✅ Строк: {export.rows}")
+        except Exception as e:
+            logging.error(f"Export {export.name}: failed to send file: {e}")
+            await msg.answer("❌ Не удалось отправить файл.")
+        finally:
+            os.remove(export.path)
+
+    export_tasks[admin_id] = asyncio.create_task(run())
+
+@router.message(StateFilter(AdminCommandState.command), flags={"backends": ("soap",)})
 async def execute_admin_command(msg: Message, state: FSMContext):
-    result = send_soap_command(msg.text.strip())
+    result = await send_admin_command(msg, await get_state_realm(state), "command", msg.text.strip())
     await msg.answer(f"<pre>{escape(result)}</pre>")
     await state.clear()
 
 # === ЗАПУСК ===
-async def main():
-    print("🚀 Бот запущен...")
+readiness = Readiness(STARTUP_CHECK_TIMEOUT)
+
+def validate_config() -> tuple[list[str], list[str]]:
+    """Settings the bot cannot run with, and suspicious ones, found before anything connects."""
+    errors, warnings = [], []
+    try:
+        validate_token(TOKEN or "")
+    except TokenValidationError:
+        errors.append("TOKEN is missing or is not a bot token")
+    if RUN_MODE not in ("polling", "webhook"):
+        errors.append(f"RUN_MODE={RUN_MODE!r}, expected polling or webhook")
+    if RUN_MODE == "webhook":
+        if not WEBHOOK_URL:
+            errors.append("RUN_MODE=webhook needs WEBHOOK_URL")
+        if WEBHOOK_SECRET in (None, "", "CHANGE_ME"):
+            warnings.append("WEBHOOK_SECRET is not set, anyone can post updates to the webhook")
+    if FSM_STORAGE not in ("memory", "sqlite", "redis"):
+        errors.append(f"FSM_STORAGE={FSM_STORAGE!r}, expected memory, sqlite or redis")
+    if FSM_STORAGE == "redis" and not FSM_REDIS_URL:
+        errors.append("FSM_STORAGE=redis needs FSM_REDIS_URL")
+    for config in REALM_CONFIGS:
+        url = urlparse(config.soap_url or "")
+        if url.scheme not in ("http", "https") or not url.hostname:
+            errors.append(f"realm {config.id}: SOAP URL {config.soap_url!r} is not http(s)://host:port/")
+        if not config.soap_user or not config.soap_password:
+            warnings.append(f"realm {config.id}: SOAP user or password is empty")
+    if STATUS_MAX_AGE < STATUS_POLL_INTERVAL:
+        warnings.append("STATUS_MAX_AGE < STATUS_POLL_INTERVAL, online counts will often bypass the poller")
+    if SOAP_CONCURRENCY > SOAP_POOL_SIZE:
+        warnings.append("SOAP_CONCURRENCY > SOAP_POOL_SIZE, extra requests wait for a connection")
+    return errors, warnings
+
+async def check_telegram(bot: Bot) -> str:
+    me = await bot.get_me()
+    return f"@{me.username}"
+
+async def check_auth_db() -> str:
+    opened = await auth_db.warm(STARTUP_WARM_CONNECTIONS)
+    binding = await prepare_binding_table(telegram_binding, auth_db)
+    return f"{opened} connections opened, {binding}"
+
+async def check_characters_db(realm: Realm) -> str:
+    opened = await realm.characters_db.warm(STARTUP_WARM_CONNECTIONS)
+    return f"{opened} connections opened"
+
+async def check_soap(realm: Realm) -> str:
+    """Opens keep-alive connections with `server info` and hands the result to the status poller."""
+    results = await asyncio.gather(
+        *(realm.soap.call("server info") for _ in range(min(STARTUP_WARM_CONNECTIONS, realm.soap.pool_size)))
+    )
+    if results[0].startswith("❌"):
+        raise RuntimeError(results[0])
+    counters = realm.status.update(results[0]).counters
+    return f"{counters.get('players')} players online"
+
+def add_startup_checks(bot: Bot):
+    readiness.add("telegram", lambda: check_telegram(bot))
+    readiness.add("mysql:auth", check_auth_db)
+    for realm in REALMS:
+        readiness.add(f"mysql:{realm.characters_db.name}", functools.partial(check_characters_db, realm))
+        readiness.add(f"soap:{realm.id}", functools.partial(check_soap, realm))
+
+async def prime_account_cache(limit: int) -> int:
+    """Cache the accounts of the most recently logged-in bound players; returns how many were cached."""
+    generation = account_cache.generation
+    try:
+        rows = await auth_db.fetchall(telegram_binding.recent_accounts_query(), (min(limit, ACCOUNT_CACHE_SIZE),))
+    except Exception as e:
+        logging.error(f"MySQL lookup error: {e}")
+        return 0
+    primed = 0
+    for telegram_id, account_id, username, gmlevel in rows:
+        if not str(telegram_id).isdigit():
+            continue
+        account_cache.set(int(telegram_id), AccountInfo(account_id, username, gmlevel or 0), generation)
+        primed += 1
+    logging.info(f"Account cache primed with {primed} accounts")
+    return primed
+
+async def main(worker_index: int = 0):
+    print("🚀 Бот запускается...")
+    log_listener = start_logging(worker_index)
+    errors, warnings = validate_config()
+    for warning in warnings:
+        logging.warning(f"Config: {warning}")
+    if errors:
+        for error in errors:
+            logging.critical(f"Config: {error}")
+        log_listener.stop()
+        raise SystemExit("❌ Ошибки в .env:\n" + "\n".join(errors))
+
     bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    storage = MemoryStorage()
+    storage = create_storage(FSM_STORAGE, path=FSM_STORAGE_PATH, ttl=FSM_STATE_TTL, url=FSM_REDIS_URL)
     dp = Dispatcher(storage=storage)
     dp.include_router(router)
-    
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(metrics, METRICS_HOST, METRICS_PORT + worker_index)
+
+    add_startup_checks(bot)
+    await readiness.run()
+    background = []
+    if readiness.results["mysql:auth"].ok and ACCOUNT_CACHE_PRIME:
+        background.append(asyncio.create_task(prime_account_cache(ACCOUNT_CACHE_PRIME)))
+    if readiness.ready:
+        print(f"✅ Бот готов за {readiness.ready_after:.2f} с")
+        logging.info(f"Ready after {readiness.ready_after:.2f}s")
+    else:
+        failed = [result.name for result in readiness.results.values() if not result.ok]
+        print(f"⚠️ Бот запущен в деградированном режиме, недоступно: {', '.join(failed)}")
+        logging.warning(f"Starting degraded, failed checks: {failed}")
+        background.append(asyncio.create_task(readiness.retry(STARTUP_RETRY_INTERVAL)))
+    for realm in REALMS:
+        realm.status.start()
+    soap_queue.start(bot)
+    broadcasts.start(bot)
+    audit.start()
+
     try:
-        await dp.start_polling(bot)
+        if RUN_MODE == "webhook":
+            await run_webhook(
+                dp,
+                bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                url=WEBHOOK_URL if worker_index == 0 else None,
+                secret=WEBHOOK_SECRET,
+                reuse_port=WEBHOOK_WORKERS > 1,
+            )
+        else:
+            await dp.start_polling(bot)
     finally:
+        for task in background:
+            task.cancel()
+        for realm in REALMS:
+            await realm.status.stop()
+        await soap_queue.stop()
+        await broadcasts.stop()
+        exports.close()
+        # last, so the actions of finished queue jobs are written too
+        await audit.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         await bot.session.close()
         await storage.close()
+        auth_db.close()
+        for realm in REALMS:
+            await realm.soap.close()
+            realm.characters_db.close()
+        logging.info(f"Account cache stats: {account_cache.stats()}")
+        logging.info(f"Throttling stats: {throttling.stats()}")
+        logging.info(f"Coalescing stats: {single_flight.stats()}")
+        log_listener.stop()
+
+def run_worker(worker_index: int):
+    try:
+        asyncio.run(main(worker_index))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if RUN_MODE == "webhook" and WEBHOOK_WORKERS > 1:
+        if FSM_STORAGE == "memory":
+            logging.warning("FSM_STORAGE=memory is not shared between webhook workers")
+        ctx = multiprocessing.get_context("spawn")
+        workers = [ctx.Process(target=run_worker, args=(i,)) for i in range(WEBHOOK_WORKERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    else:
+        asyncio.run(main())
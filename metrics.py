@@ -0,0 +1,175 @@
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values: dict[tuple, float] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, dict(zip(self.label_names, key)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, value: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def inc(self, value: float = 1.0, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + value
+
+    def dec(self, value: float = 1.0, **labels):
+        self.inc(-value, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            # bucket counts, then sum and count
+            series = self.series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        for key, series in self.series.items():
+            labels = dict(zip(self.label_names, key))
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket", {**labels, "le": bound}, count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, series[-1]
+            yield f"{self.name}_sum", labels, series[-2]
+            yield f"{self.name}_count", labels, series[-1]
+
+
+class CallbackMetric(Metric):
+    """Metric whose samples are read from `collect()` at scrape time."""
+
+    def __init__(self, name: str, help: str, type: str, collect: Callable[[], list[tuple[dict, float]]]):
+        super().__init__(name, help)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def _register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, type: str, collect: Callable[[], list[tuple[dict, float]]]) -> CallbackMetric:
+        return self._register(CallbackMetric(name, help, type, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def track(latency: Histogram, in_flight: Gauge, **labels):
+    in_flight.inc(**labels)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        in_flight.dec(**labels)
+        latency.observe(time.perf_counter() - start, **labels)
+
+
+async def start_metrics_server(registry: Registry, host: str, port: int) -> web.AppRunner:
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Records latency, in-flight and error counts per aiogram handler."""
+
+    def __init__(self, latency: Histogram, in_flight: Gauge, errors: Counter):
+        self.latency = latency
+        self.in_flight = in_flight
+        self.errors = errors
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        with track(self.latency, self.in_flight, handler=name):
+            try:
+                return await handler(event, data)
+            except Exception:
+                self.errors.inc(handler=name)
+                raise
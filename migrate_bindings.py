@@ -0,0 +1,37 @@
+"""Create the telegram_binding table and backfill it from account.email.
+
+Run once before switching TELEGRAM_BINDING to "table"; re-running is safe. Bindings made
+by the bot in the meantime are kept (the default "compat" mode writes both places).
+"""
+import argparse
+import asyncio
+import logging
+
+from bindings import backfill_bindings
+from config import DB_CONFIG
+from db import MySQLPool
+
+
+def report(done: int, total: int, inserted: int):
+    print(f"\raccounts {done}/{total}, bindings inserted: {inserted}", end="", flush=True)
+
+
+async def migrate(chunk_size: int):
+    pool = MySQLPool(DB_CONFIG, size=1, name="migration")
+    try:
+        inserted = await backfill_bindings(pool, chunk_size, report)
+    finally:
+        pool.close()
+    print(f"\n✅ Готово: {inserted} привязок. Теперь можно выставить TELEGRAM_BINDING=table.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-size", type=int, default=10000, help="account ids per INSERT ... SELECT")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate(args.chunk_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import re
+from html import escape
+from dataclasses import astuple, dataclass
+
+from db import MySQLPool
+
+CLASS_NAMES = {
+    1: "Воин",
+    2: "Паладин",
+    3: "Охотник",
+    4: "Разбойник",
+    5: "Жрец",
+    6: "Рыцарь смерти",
+    7: "Шаман",
+    8: "Маг",
+    9: "Чернокнижник",
+    11: "Друид",
+}
+CLASS_IDS = {name.lower(): class_id for class_id, name in CLASS_NAMES.items()}
+
+FILTER_RE = re.compile(r"(имя|ур|класс|зона)=(\S+)", re.IGNORECASE)
+LEVEL_RE = re.compile(r"^(\d+)(?:-(\d+))?$")
+
+
+@dataclass(frozen=True)
+class OnlineFilters:
+    name_prefix: str | None = None
+    min_level: int | None = None
+    max_level: int | None = None
+    class_id: int | None = None
+    zone: int | None = None
+
+    def to_dict(self) -> dict:
+        return {key: value for key, value in self.__dict__.items() if value is not None}
+
+    @property
+    def key(self) -> tuple:
+        return astuple(self)
+
+
+def parse_online_filters(text: str) -> OnlineFilters | None:
+    """Parse "имя=Ar ур=70-80 класс=маг зона=3703"; "-" means no filters, None means invalid input."""
+    text = text.strip()
+    if text in ("", "-"):
+        return OnlineFilters()
+    values = {}
+    rest = FILTER_RE.sub("", text).strip()
+    if rest:
+        return None
+    for field, value in FILTER_RE.findall(text):
+        field = field.lower()
+        if field == "имя":
+            values["name_prefix"] = value
+        elif field == "ур":
+            match = LEVEL_RE.match(value)
+            if not match:
+                return None
+            values["min_level"] = int(match.group(1))
+            values["max_level"] = int(match.group(2) or match.group(1))
+        elif field == "класс":
+            class_id = int(value) if value.isdigit() else CLASS_IDS.get(value.lower())
+            if class_id is None:
+                return None
+            values["class_id"] = class_id
+        elif field == "зона":
+            if not value.isdigit():
+                return None
+            values["zone"] = int(value)
+    return OnlineFilters(**values)
+
+
+def build_online_query(filters: OnlineFilters, after_guid: int, limit: int) -> tuple[str, tuple]:
+    # keyset pagination on the primary key; idx_online covers (online, guid)
+    conditions = ["online = 1", "guid > %s"]
+    params: list = [after_guid]
+    if filters.name_prefix:
+        escaped = filters.name_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append("name LIKE %s")
+        params.append(escaped + "%")
+    if filters.min_level is not None:
+        conditions.append("level BETWEEN %s AND %s")
+        params.extend((filters.min_level, filters.max_level))
+    if filters.class_id is not None:
+        conditions.append("class = %s")
+        params.append(filters.class_id)
+    if filters.zone is not None:
+        conditions.append("zone = %s")
+        params.append(filters.zone)
+    query = (
+        "SELECT guid, name, level, class, zone FROM characters "
+        f"WHERE {' AND '.join(conditions)} ORDER BY guid LIMIT %s"
+    )
+    params.append(limit)
+    return query, tuple(params)
+
+
+async def fetch_online_page(
+    pool: MySQLPool, filters: OnlineFilters, after_guid: int, page_size: int
+) -> tuple[list[tuple], bool]:
+    """Return one page of online characters after `after_guid` and whether another page follows."""
+    query, params = build_online_query(filters, after_guid, page_size + 1)
+
+    def _stream(cursor):
+        cursor.execute(query, params)
+        rows = []
+        for row in cursor:
+            rows.append(tuple(row))
+        return rows
+
+    rows = await pool.run(_stream)
+    return rows[:page_size], len(rows) > page_size
+
+
+def format_online_page(rows: list[tuple], page: int) -> str:
+    if not rows:
+        return "Нет игроков онлайн по этим фильтрам." if page == 0 else "Больше игроков нет."
+    lines = [
+        f"• {escape(name)} — ур. {level}, {CLASS_NAMES.get(class_id, class_id)}, зона {zone}"
+        for _, name, level, class_id, zone in rows
+    ]
+    return f"🌐 Игроки онлайн, стр. {page + 1}:\n" + "\n".join(lines)
@@ -0,0 +1,81 @@
+import asyncio
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Mapping
+
+from breaker import CircuitBreaker
+from db import MySQLPool
+from soap import SoapClient
+from status import ServerStatusPoller
+
+
+@dataclass(frozen=True)
+class RealmConfig:
+    id: str
+    name: str
+    soap_url: str
+    soap_user: str
+    soap_password: str
+    db_config: dict
+    characters_database: str
+
+
+def load_realm_configs(env: Mapping[str, str], default: RealmConfig) -> list[RealmConfig]:
+    """Read REALMS=1,2 and REALM_<id>_* settings; without REALMS the single-realm settings are used.
+
+    Every REALM_<id>_* value falls back to the single-realm setting, so realms that share
+    the MySQL server only need their own SOAP_URL and CHARACTERS_DATABASE.
+    """
+    ids = [realm_id.strip() for realm_id in env.get("REALMS", "").split(",") if realm_id.strip()]
+    if not ids:
+        return [default]
+
+    configs = []
+    for realm_id in ids:
+        prefix = f"REALM_{realm_id}_"
+        db_config = {
+            **default.db_config,
+            "host": env.get(prefix + "DB_HOST", default.db_config["host"]),
+            "user": env.get(prefix + "DB_USER", default.db_config["user"]),
+            "password": env.get(prefix + "DB_PASSWORD", default.db_config["password"]),
+        }
+        configs.append(RealmConfig(
+            id=realm_id,
+            name=env.get(prefix + "NAME", realm_id),
+            soap_url=env.get(prefix + "SOAP_URL", default.soap_url),
+            soap_user=env.get(prefix + "SOAP_USER", default.soap_user),
+            soap_password=env.get(prefix + "SOAP_PASS", default.soap_password),
+            db_config=db_config,
+            characters_database=env.get(prefix + "CHARACTERS_DATABASE", default.characters_database),
+        ))
+    return configs
+
+
+@dataclass(eq=False)
+class Realm:
+    """Runtime objects of one realm: its worldserver client and breaker, characters pool and status poller."""
+    id: str
+    name: str
+    soap: SoapClient
+    characters_db: MySQLPool
+    characters_database: str
+    # characters live on the auth MySQL server, so one query can JOIN both databases
+    shares_auth_server: bool
+    soap_breaker: CircuitBreaker
+    status: ServerStatusPoller | None = None
+
+
+async def fan_out(realms: list[Realm], func: Callable[[Realm], Awaitable]) -> AsyncIterator[tuple[Realm, object]]:
+    """Run func for every realm in parallel and yield (realm, result) in completion order.
+
+    func must handle its own errors; the remaining calls are cancelled if the consumer stops early.
+    """
+    tasks = {asyncio.ensure_future(func(realm)): realm for realm in realms}
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield tasks[task], task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import Callable, NamedTuple
+
+from bindings import TelegramBinding
+from cache import MISSING, TTLCache
+from db import MySQLPool
+
+
+class Availability(NamedTuple):
+    existing_login: str | None
+    available: bool
+
+
+class RegistrationService:
+    """Signup bookkeeping around the SOAP `account create` command.
+
+    A login that passed the availability check is reserved for the telegram user for
+    `reservation_ttl` seconds, so the password step needs no second lookup and two users
+    cannot race for the same name. After the worldserver created the accounts, their
+    telegram bindings are written in batches: one statement for up to `batch_size` accounts
+    created within `batch_window` seconds of each other.
+    """
+
+    def __init__(
+        self,
+        pool: MySQLPool,
+        binding: TelegramBinding,
+        reservation_ttl: float = 300.0,
+        batch_size: int = 50,
+        batch_window: float = 0.05,
+        on_bound: Callable[[str, int], None] | None = None,
+    ):
+        self.pool = pool
+        self.binding = binding
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.on_bound = on_bound
+        self.batches = 0
+        self._reservations = TTLCache(maxsize=100000, ttl=reservation_ttl)
+        self._pending: list[tuple[str, int, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def check(self, login: str, telegram_id: int) -> Availability:
+        """One query for both "is this user registered" and "is this login taken"; reserves the login if free."""
+        holder = self._reservations.get(login.lower())
+        if holder is not MISSING and holder != telegram_id:
+            return Availability(None, False)
+        account_id, params = self.binding.account_id(telegram_id)
+        existing_login, taken = await self.pool.fetchone(
+            f"SELECT (SELECT username FROM account WHERE id = {account_id}), "
+            "EXISTS(SELECT 1 FROM account WHERE username = %s)",
+            (*params, login),
+        )
+        if existing_login:
+            return Availability(existing_login, False)
+        if taken:
+            return Availability(None, False)
+        self._reservations.set(login.lower(), telegram_id)
+        return Availability(None, True)
+
+    def is_reserved(self, login: str, telegram_id: int) -> bool:
+        return self._reservations.get(login.lower()) == telegram_id
+
+    def release(self, login: str):
+        self._reservations.invalidate(login.lower())
+
+    async def bind(self, login: str, telegram_id: int) -> bool:
+        """Bind a freshly created account to telegram_id; resolves when its batch is written."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((login, telegram_id, future))
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self.batch_window)
+        return await future
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, lambda: asyncio.ensure_future(self._flush()))
+
+    async def _flush(self):
+        self._flush_handle = None
+        batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+        if self._pending:
+            self._schedule_flush(0)
+        if not batch:
+            return
+
+        try:
+            for query, params in self.binding.bind_statements([(login, telegram_id) for login, telegram_id, _ in batch]):
+                await self.pool.execute(query, params)
+            ok = True
+        except Exception as e:
+            logging.error(f"MySQL update error: {e}")
+            ok = False
+        self.batches += 1
+
+        for login, telegram_id, future in batch:
+            if ok and self.on_bound is not None:
+                self.on_bound(login, telegram_id)
+            if not future.done():
+                future.set_result(ok)
@@ -0,0 +1,49 @@
+import asyncio
+import functools
+from collections import Counter
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """Lets concurrent identical calls share one in-flight call and its result (or exception).
+
+    Only use it for reads: a joined caller gets the result of a call that started before
+    it asked. Nothing is cached once the call finishes.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self.shared = Counter()
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, name: str, key: Hashable, func: Callable[[], Awaitable]):
+        future = self._in_flight.get((name, key))
+        if future is None:
+            self.calls[name] += 1
+            future = asyncio.ensure_future(func())
+            self._in_flight[(name, key)] = future
+            future.add_done_callback(lambda done: self._forget_call(name, key, done))
+        else:
+            self.shared[name] += 1
+        # one caller giving up must not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def _forget_call(self, name: str, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get((name, key)) is future:
+            del self._in_flight[(name, key)]
+
+    def forget(self, name: str, key: Hashable):
+        """Later callers start a new call instead of joining the one in flight, e.g. after a write."""
+        self._in_flight.pop((name, key), None)
+
+    def wrap(self, func):
+        """Decorator coalescing calls of an async function by its arguments."""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return await self.do(func.__name__, key, lambda: func(*args, **kwargs))
+        wrapper.forget = lambda *args, **kwargs: self.forget(func.__name__, (args, tuple(sorted(kwargs.items()))))
+        return wrapper
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "shared": dict(self.shared)}
@@ -0,0 +1,92 @@
+import asyncio
+
+import aiohttp
+
+from soap_codec import SoapResponse, SoapResponseParser, build_envelope
+
+
+class SoapClient:
+    """Asynchronous SOAP client for the worldserver with a keep-alive connection pool."""
+
+    def __init__(
+        self,
+        url: str,
+        user: str,
+        password: str,
+        pool_size: int = 10,
+        max_concurrency: int = 10,
+        timeout: float = 5.0,
+    ):
+        self.url = url
+        self.auth = aiohttp.BasicAuth(user or "", password or "")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.pending = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=30)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auth=self.auth,
+                headers={'Content-Type': 'text/xml'},
+            )
+        return self._session
+
+    async def _post(self, payload: bytes, timeout: aiohttp.ClientTimeout) -> tuple[int, str, SoapResponse | None]:
+        self.pending += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.pending -= 1
+
+        self.in_flight += 1
+        try:
+            session = self._get_session()
+            async with session.post(self.url, data=payload, timeout=timeout) as response:
+                parser = SoapResponseParser()
+                async for chunk in response.content.iter_any():
+                    parser.feed(chunk)
+                parsed = parser.close()
+                # the worldserver reports a failed command as a SOAP fault with HTTP 500
+                if response.status >= 400 and parsed.fault is None:
+                    return response.status, response.reason, None
+                return response.status, response.reason, parsed
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def call(self, command: str, timeout: float | None = None) -> str:
+        """Like execute(), but connection errors and timeouts are raised instead of returned."""
+        client_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+
+        status, reason, response = await self._post(build_envelope(command), client_timeout)
+        if response is None:
+            return f"❌ Ошибка сервера: {status} — {reason}"
+        if response.error is not None:
+            return f"❌ SOAP ошибка: {response.error}"
+        if response.result is None:
+            if response.fault is not None:
+                return f"❌ Ошибка: {response.fault}"
+            return f"❌ Ошибка: <result> не найден."
+        return response.result
+
+    def format_error(self, error: Exception, timeout: float | None = None) -> str:
+        if isinstance(error, asyncio.TimeoutError):
+            return f"❌ SOAP ошибка: превышено время ожидания ({timeout or self.timeout} с)"
+        return f"❌ SOAP ошибка: {error}"
+
+    async def execute(self, command: str, timeout: float | None = None) -> str:
+        try:
+            return await self.call(command, timeout)
+        except Exception as e:
+            return self.format_error(e, timeout)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
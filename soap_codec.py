@@ -0,0 +1,131 @@
+import html
+import io
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+
+# entities the worldserver emits in <result>; anything else goes through html.unescape
+_ENTITIES = (("&#xD;", "\r"), ("&#13;", "\r"), ("&lt;", "<"), ("&gt;", ">"), ("&quot;", '"'), ("&apos;", "'"))
+
+# precompiled once; each pattern is a plain search with a literal prefix
+PATTERNS = {
+    "players": re.compile(r"Connected players:\s*(\d+)"),
+    "characters": re.compile(r"Characters in world:\s*(\d+)"),
+    "uptime": re.compile(r"Server uptime:\s*(.+?)\r"),
+    "account_created": re.compile(r"Account created: (\S+)"),
+    "ban": re.compile(r"^(?P<target>\S+) is banned (?:for (?P<duration>.+?)|permanently)\. Reason: (?P<reason>.*?)\.?$"),
+}
+
+
+def build_envelope(command: str) -> bytes:
+    # the template is one literal f-string, so building it costs no global lookups or extra concatenations
+    if "&" in command or "<" in command or ">" in command:
+        command = command.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<soap:Envelope xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns:xsd="http://www.w3.org/2001/XMLSchema" '
+        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+        f'<soap:Body><executeCommand xmlns="urn:AC"><command>{command}'
+        "</command></executeCommand></soap:Body></soap:Envelope>"
+    ).encode("utf-8")
+
+
+def _unescape(text: str) -> str:
+    if "&" not in text:
+        return text
+    for entity, char in _ENTITIES:
+        text = text.replace(entity, char)
+    if "&#" in text:
+        return html.unescape(text.replace("&amp;", "&#38;"))
+    return text.replace("&amp;", "&")
+
+
+def _extract(content: bytes, tag: bytes) -> str | None:
+    """Text of the first <tag>...</tag>; None if absent or if it holds markup (CDATA, children)."""
+    opening = b"<" + tag
+    start = content.find(opening)
+    while start != -1 and content[start + len(opening):start + len(opening) + 1] not in (b">", b" ", b"/", b"\t", b"\r", b"\n"):
+        start = content.find(opening, start + len(opening))
+    if start == -1:
+        return None
+    open_end = content.find(b">", start)
+    if open_end == -1:
+        return None
+    if content[open_end - 1:open_end] == b"/":
+        return ""
+    close = content.find(b"</" + tag + b">", open_end)
+    if close == -1:
+        return None
+    body = content[open_end + 1:close]
+    if b"<" in body:
+        return None
+    return _unescape(body.decode("utf-8"))
+
+
+@dataclass
+class SoapResponse:
+    result: str | None = None
+    fault: str | None = None
+    error: str | None = None
+
+
+class SoapResponseParser:
+    """Buffers the response body and, on close(), pulls out <result> and <faultstring>.
+
+    The common flat response is scanned directly on the bytes; anything unusual
+    (prefixed tags, CDATA, no result at all) falls back to a full XML parse.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def feed(self, data: bytes):
+        self._chunks.append(data)
+
+    def close(self) -> SoapResponse:
+        content = b"".join(self._chunks)
+        result = _extract(content, b"result")
+        if result is not None:
+            return SoapResponse(result=result.strip())
+        return _parse_xml(content)
+
+
+def _parse_xml(content: bytes) -> SoapResponse:
+    response = SoapResponse()
+    try:
+        for _, element in ET.iterparse(io.BytesIO(content), events=("end",)):
+            tag = element.tag.rpartition("}")[2]
+            if tag == "result" and response.result is None:
+                response.result = (element.text or "").strip()
+            elif tag == "faultstring" and response.fault is None:
+                response.fault = (element.text or "").strip()
+    except ET.ParseError as e:
+        response.error = str(e)
+    return response
+
+
+def decode_response(content: bytes) -> SoapResponse:
+    parser = SoapResponseParser()
+    parser.feed(content)
+    return parser.close()
+
+
+def parse_server_info(result: str) -> dict:
+    counters = {}
+    for key in ("players", "characters", "uptime"):
+        match = PATTERNS[key].search(result)
+        counters[key] = match.group(1) if match else None
+    return counters
+
+
+def parse_account_create(result: str) -> str | None:
+    """Return the created login, or None if the server did not create the account."""
+    match = PATTERNS["account_created"].search(result)
+    return match.group(1) if match else None
+
+
+def parse_ban(result: str) -> dict | None:
+    """Return target, duration (None for permanent) and reason of a successful ban."""
+    match = PATTERNS["ban"].match(result.strip())
+    return match.groupdict() if match else None
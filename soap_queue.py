@@ -0,0 +1,272 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from aiogram import Bot
+
+from sqlite_worker import SQLiteWorker
+
+UNKNOWN_RESULT = "⚠️ Результат неизвестен: бот был перезапущен во время выполнения команды."
+LOST_SECRET_RESULT = "⚠️ Команда не выполнена: бот был перезапущен. Повторите её."
+
+
+@dataclass
+class SoapJob:
+    id: int
+    kind: str
+    command: str | None  # None for a secret command, held in memory only
+    chat_id: int
+    payload: dict
+    attempts: int
+    duration: float = 0.0  # seconds the last attempt's SOAP call took
+
+
+class SoapJobQueue(SQLiteWorker):
+    """Durable queue of SOAP commands in a local SQLite file.
+
+    `send` gets the job and must raise for failures that are safe to retry (the command
+    never reached the worldserver) and return the result string otherwise. Each finished job is
+    passed to the completion handler registered for its kind, which reports the
+    result to the user.
+
+    A command holding a secret (`secret=True`, e.g. a password) is kept in memory only and
+    stored as NULL, so it never reaches the queue file or its WAL. Such a job is marked with
+    the `owner` (pid and boot id) of the process holding the command, and other processes
+    sharing the file (webhook workers) never claim it. Every process refreshes its row in
+    soap_queue_owners on each poll; once an owner has been silent for `lease` seconds or
+    stopped, its secret jobs are claimed by the others and failed instead of run.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        send: Callable[["SoapJob"], Awaitable[str]],
+        concurrency: int = 5,
+        max_attempts: int = 10,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0,
+        lease: float = 120.0,
+        poll_interval: float = 1.0,
+    ):
+        super().__init__(path, "soap-queue")
+        self.send = send
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.handlers: dict[str, Callable[[Bot, SoapJob, str], Awaitable[None]]] = {}
+        self._wakeup = asyncio.Event()
+        self._running: set[asyncio.Task] = set()
+        self._secrets: dict[int, str] = {}
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:12]}"
+        self._stopping = False
+
+    def handler(self, kind: str):
+        def decorator(func):
+            self.handlers[kind] = func
+            return func
+        return decorator
+
+    def _setup(self, conn: sqlite3.Connection):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS soap_jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "idempotency_key TEXT UNIQUE, "
+            "kind TEXT NOT NULL, "
+            "command TEXT, "
+            "chat_id INTEGER NOT NULL, "
+            "payload TEXT NOT NULL DEFAULT '{}', "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, "
+            "result TEXT, "
+            "created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL, "
+            "owner TEXT)"
+        )
+        # queue files created before secret jobs had owners
+        if "owner" not in {row[1] for row in conn.execute("PRAGMA table_info(soap_jobs)")}:
+            conn.execute("ALTER TABLE soap_jobs ADD COLUMN owner TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS soap_jobs_due ON soap_jobs (status, next_attempt_at)")
+        conn.execute("CREATE TABLE IF NOT EXISTS soap_queue_owners (owner TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+
+    def _insert(self, kind, command, chat_id, payload, key, owner) -> int | None:
+        now = time.time()
+        conn = self._connect()
+        if owner is not None:
+            # registered before the first claim too, so nobody takes the job for an orphan
+            conn.execute("INSERT OR REPLACE INTO soap_queue_owners (owner, seen_at) VALUES (?, ?)", (owner, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO soap_jobs "
+            "(idempotency_key, kind, command, chat_id, payload, next_attempt_at, created_at, updated_at, owner) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, command, chat_id, json.dumps(payload, ensure_ascii=False), now, now, now, owner),
+        )
+        return cursor.lastrowid if cursor.rowcount == 1 else None
+
+    async def enqueue(
+        self,
+        kind: str,
+        command: str,
+        chat_id: int,
+        payload: dict | None = None,
+        idempotency_key: str | None = None,
+        secret: bool = False,
+    ) -> bool:
+        """Queue a command; returns False if a job with the same idempotency key already exists."""
+        stored, owner = (None, self.owner) if secret else (command, None)
+        job_id = await self._run_sql(self._insert, kind, stored, chat_id, payload or {}, idempotency_key, owner)
+        if job_id is None:
+            return False
+        if secret:
+            self._secrets[job_id] = command
+        self._wakeup.set()
+        return True
+
+    def _claim(self, limit: int) -> tuple[list[SoapJob], list[SoapJob]]:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO soap_queue_owners (owner, seen_at) VALUES (?, ?)", (self.owner, now))
+            conn.execute("DELETE FROM soap_queue_owners WHERE seen_at <= ?", (now - self.lease,))
+            # jobs whose lease expired were interrupted mid-call; their outcome is unknown
+            stale = conn.execute(
+                "SELECT id, kind, command, chat_id, payload, attempts FROM soap_jobs "
+                "WHERE status = 'running' AND next_attempt_at <= ?",
+                (now,),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE soap_jobs SET status = 'failed', command = NULL, result = ?, updated_at = ? WHERE id = ?",
+                [(UNKNOWN_RESULT, now, row[0]) for row in stale],
+            )
+            rows = conn.execute(
+                "SELECT id, kind, command, chat_id, payload, attempts FROM soap_jobs "
+                "WHERE status = 'pending' AND next_attempt_at <= ? "
+                # a secret job only runs where its command is in memory, unless that process is gone
+                "AND (owner IS NULL OR owner = ? OR owner NOT IN (SELECT owner FROM soap_queue_owners)) "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, self.owner, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE soap_jobs SET status = 'running', attempts = attempts + 1, "
+                "next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                [(now + self.lease, now, row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        to_job = lambda row, extra=0: SoapJob(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5] + extra)
+        return [to_job(row, 1) for row in rows], [to_job(row) for row in stale]
+
+    def _finish(self, job_id: int, result: str):
+        self._connect().execute(
+            "UPDATE soap_jobs SET status = 'done', command = NULL, result = ?, updated_at = ? WHERE id = ?",
+            (result, time.time(), job_id),
+        )
+
+    def _fail(self, job_id: int, result: str):
+        self._connect().execute(
+            "UPDATE soap_jobs SET status = 'failed', command = NULL, result = ?, updated_at = ? WHERE id = ?",
+            (result, time.time(), job_id),
+        )
+
+    def _release(self):
+        self._connect().execute("DELETE FROM soap_queue_owners WHERE owner = ?", (self.owner,))
+
+    def _retry(self, job_id: int, delay: float, error: str):
+        now = time.time()
+        self._connect().execute(
+            "UPDATE soap_jobs SET status = 'pending', next_attempt_at = ?, result = ?, updated_at = ? WHERE id = ?",
+            (now + delay, error, now, job_id),
+        )
+
+    async def _notify(self, bot: Bot, job: SoapJob, result: str):
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            logging.warning(f"SOAP queue: no handler for job kind {job.kind}")
+            return
+        try:
+            await handler(bot, job, result)
+        except Exception as e:
+            logging.error(f"SOAP queue: failed to report job {job.id}: {e}")
+
+    async def _process(self, bot: Bot, job: SoapJob):
+        if job.command is None:
+            job.command = self._secrets.get(job.id)
+            if job.command is None:
+                await self._run_sql(self._fail, job.id, LOST_SECRET_RESULT)
+                await self._notify(bot, job, LOST_SECRET_RESULT)
+                return
+        started = time.monotonic()
+        try:
+            result = await self.send(job)
+        except Exception as e:
+            job.duration = time.monotonic() - started
+            error = f"❌ SOAP ошибка: {e}"
+            if job.attempts >= self.max_attempts:
+                self._secrets.pop(job.id, None)
+                await self._run_sql(self._fail, job.id, error)
+                await self._notify(bot, job, error)
+                return
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+            logging.warning(f"SOAP queue: job {job.id} attempt {job.attempts} failed, retry in {delay:.0f}s: {e}")
+            await self._run_sql(self._retry, job.id, delay, error)
+            return
+        job.duration = time.monotonic() - started
+        self._secrets.pop(job.id, None)
+        await self._run_sql(self._finish, job.id, result)
+        await self._notify(bot, job, result)
+
+    async def _run(self, bot: Bot):
+        while not self._stopping:
+            self._wakeup.clear()
+            # claimed even with no free slot: it also keeps this process's owner row fresh
+            free = max(0, self.concurrency - len(self._running))
+            try:
+                jobs, stale = await self._run_sql(self._claim, free)
+            except Exception as e:
+                logging.error(f"SOAP queue: claim failed: {e}")
+                jobs, stale = [], []
+            for job in stale:
+                self._secrets.pop(job.id, None)
+                await self._notify(bot, job, UNKNOWN_RESULT)
+            for job in jobs:
+                task = asyncio.create_task(self._process(bot, job))
+                self._running.add(task)
+                task.add_done_callback(self._on_task_done)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_task_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        self._wakeup.set()
+
+    async def stop(self):
+        # the loop is asked to exit rather than cancelled: a claim cancelled while its
+        # transaction runs in the executor would leave the claimed jobs 'running'
+        self._stopping = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        self._stopping = False
+        if self._running:
+            await asyncio.wait(self._running, timeout=self.lease)
+        try:
+            # secret jobs left behind fail in the other processes right away
+            await self._run_sql(self._release)
+        except Exception as e:
+            logging.error(f"SOAP queue: failed to release owner {self.owner}: {e}")
+        await self._close()
@@ -0,0 +1,63 @@
+import asyncio
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SQLiteWorker(ABC):
+    """Base for services that keep their state in a local SQLite file.
+
+    The file is opened once, in WAL mode, and every statement runs through `_run_sql` on
+    a single worker thread, so the event loop never waits on disk I/O and the connection
+    is never used by two threads at once. Subclasses create their tables in `_setup` and
+    implement `_run`, the background loop that `start()` launches and `stop()` cancels.
+    """
+
+    def __init__(self, path: str, thread_name: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=thread_name)
+        self._conn: sqlite3.Connection | None = None
+        self._task: asyncio.Task | None = None
+
+    def _setup(self, conn: sqlite3.Connection):
+        pass
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._setup(conn)
+            self._conn = conn
+        return self._conn
+
+    async def _run_sql(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @abstractmethod
+    async def _run(self, *args):
+        """The background loop; runs until `stop()` cancels it."""
+
+    def start(self, *args):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(*args))
+
+    async def _stop_task(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _close(self):
+        if self._conn is not None:
+            await self._run_sql(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    async def stop(self):
+        await self._stop_task()
+        await self._close()
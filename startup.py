@@ -0,0 +1,67 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+
+@dataclass
+class CheckResult:
+    name: str
+    ok: bool
+    detail: str
+    duration: float
+
+
+class Readiness:
+    """Startup checks that warm and verify the backends, run concurrently with a timeout each.
+
+    A check returns a short detail on success and raises on failure. When some checks fail
+    the bot runs degraded: `retry()` repeats only the failed ones in the background until
+    they pass, so the pools are warm again as soon as the backend comes back.
+    """
+
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+        self.checks: dict[str, Callable[[], Awaitable[str]]] = {}
+        self.results: dict[str, CheckResult] = {}
+        self.started_at: float | None = None
+        self.ready_after: float | None = None
+
+    def add(self, name: str, check: Callable[[], Awaitable[str]]):
+        self.checks[name] = check
+
+    @property
+    def ready(self) -> bool:
+        return all(result.ok for result in self.results.values())
+
+    async def _run_check(self, name: str) -> CheckResult:
+        started = time.monotonic()
+        try:
+            detail = await asyncio.wait_for(self.checks[name](), self.timeout)
+            ok = True
+        except asyncio.TimeoutError:
+            detail, ok = f"timed out after {self.timeout:g}s", False
+        except Exception as e:
+            detail, ok = str(e) or type(e).__name__, False
+        return CheckResult(name, ok, detail, time.monotonic() - started)
+
+    async def run(self, names: list[str] | None = None) -> list[CheckResult]:
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        results = await asyncio.gather(*(self._run_check(name) for name in names or self.checks))
+        for result in results:
+            self.results[result.name] = result
+            if result.ok:
+                logging.info(f"Startup check {result.name}: ok in {result.duration * 1000:.0f} ms ({result.detail})")
+            else:
+                logging.error(f"Startup check {result.name} failed in {result.duration * 1000:.0f} ms: {result.detail}")
+        if self.ready and self.ready_after is None:
+            self.ready_after = time.monotonic() - self.started_at
+        return results
+
+    async def retry(self, interval: float):
+        while not self.ready:
+            await asyncio.sleep(interval)
+            await self.run([name for name, result in self.results.items() if not result.ok])
+        logging.info(f"All startup checks passed, ready after {self.ready_after:.2f}s")
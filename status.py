@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+
+@dataclass
+class StatusSnapshot:
+    counters: dict
+    updated_at: float
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.updated_at
+
+
+class ServerStatusPoller:
+    """Polls `server info` in the background and keeps the last parsed snapshot."""
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[str]],
+        parse: Callable[[str], dict],
+        interval: float = 15.0,
+    ):
+        self.fetch = fetch
+        self.parse = parse
+        self.interval = interval
+        self.snapshot: StatusSnapshot | None = None
+        self._task: asyncio.Task | None = None
+
+    def update(self, result: str) -> StatusSnapshot:
+        """Store a `server info` result fetched elsewhere, e.g. by the startup check."""
+        self.snapshot = StatusSnapshot(self.parse(result), time.monotonic())
+        return self.snapshot
+
+    async def refresh(self) -> StatusSnapshot | None:
+        result = await self.fetch()
+        if result.startswith("❌"):
+            logging.warning(f"Server status poll failed: {result}")
+            return None
+        return self.update(result)
+
+    def get_fresh(self, max_age: float) -> StatusSnapshot | None:
+        if self.snapshot is None or self.snapshot.age > max_age:
+            return None
+        return self.snapshot
+
+    async def _run(self):
+        while True:
+            try:
+                if self.snapshot is None or self.snapshot.age >= self.interval:
+                    await self.refresh()
+            except Exception as e:
+                logging.error(f"Server status poller error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
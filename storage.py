@@ -0,0 +1,94 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in a local SQLite file (WAL mode) that several bot workers can share."""
+
+    def __init__(
+        self,
+        path: str = "fsm.sqlite3",
+        ttl: float = 86400.0,
+        cleanup_interval: float = 300.0,
+        key_builder: KeyBuilder | None = None,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._last_cleanup = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _read(self, key: str) -> tuple[Optional[str], str] | None:
+        return self._conn.execute(
+            "SELECT state, data FROM fsm WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+
+    def _write(self, key: str, column: str, value: Optional[str]):
+        now = time.time()
+        other, other_default = ("data", "'{}'") if column == "state" else ("state", "NULL")
+        # an expired row must not resurrect its stale state/data
+        self._conn.execute(
+            f"INSERT INTO fsm (key, {column}, expires_at) VALUES (?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, "
+            f"{other} = CASE WHEN expires_at <= ? THEN {other_default} ELSE {other} END, "
+            f"expires_at = excluded.expires_at",
+            (key, value, now + self.ttl, now),
+        )
+        self._conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+        if now - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = now
+            self._conn.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._write, self.key_builder.build(key, "fsm"), "state", value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await self._run(self._read, self.key_builder.build(key, "fsm"))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._write, self.key_builder.build(key, "fsm"), "data", json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await self._run(self._read, self.key_builder.build(key, "fsm"))
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+def create_storage(kind: str, path: str = "fsm.sqlite3", ttl: float = 86400.0, url: str | None = None) -> BaseStorage:
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "sqlite":
+        return SQLiteStorage(path, ttl=ttl)
+    if kind == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage  # requires the redis package
+        return RedisStorage.from_url(
+            url, key_builder=DefaultKeyBuilder(with_destiny=True), state_ttl=int(ttl), data_ttl=int(ttl)
+        )
+    raise ValueError(f"Unknown FSM storage backend: {kind}")
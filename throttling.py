@@ -0,0 +1,100 @@
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, Message, TelegramObject
+
+from cache import MISSING, TTLCache
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def available(self, amount: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return self.tokens >= amount
+
+    def consume(self, amount: float = 1.0) -> bool:
+        if not self.available(amount):
+            return False
+        self.tokens -= amount
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Token buckets per telegram_id and per backend for handlers flagged with `backends`.
+
+    Handlers declare the backends they hit with flags={"backends": ("soap", "mysql")};
+    handlers without the flag are never throttled.
+    """
+
+    def __init__(
+        self,
+        user_rate: float,
+        user_burst: float,
+        backend_limits: dict[str, tuple[float, float]],
+        message: str = "⏳ Слишком много запросов. Попробуйте через несколько секунд.",
+        notify_interval: float = 5.0,
+        max_users: int = 100000,
+    ):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.backends = {name: TokenBucket(rate, burst) for name, (rate, burst) in backend_limits.items()}
+        self.message = message
+        self.notify_interval = notify_interval
+        self.passed = 0
+        self.throttled = Counter()
+        self._users = TTLCache(maxsize=max_users, ttl=max(user_burst / user_rate, notify_interval) * 2)
+
+    def _user_bucket(self, user_id: int) -> tuple[TokenBucket, list[float]]:
+        entry = self._users.get(user_id)
+        if entry is MISSING:
+            entry = (TokenBucket(self.user_rate, self.user_burst), [0.0])
+        # re-set on every access so active users never expire mid-window
+        self._users.set(user_id, entry)
+        return entry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        backends = get_flag(data, "backends")
+        user = data.get("event_from_user")
+        if not backends or user is None:
+            return await handler(event, data)
+
+        bucket, notified_at = self._user_bucket(user.id)
+        buckets = {"user": bucket}
+        for name in backends:
+            if name in self.backends:
+                buckets[name] = self.backends[name]
+        # every bucket is checked before any is charged, so a rejected update costs no quota
+        reason = next((name for name, candidate in buckets.items() if not candidate.available()), None)
+
+        if reason is None:
+            for candidate in buckets.values():
+                candidate.tokens -= 1
+            self.passed += 1
+            return await handler(event, data)
+
+        self.throttled[reason] += 1
+        now = time.monotonic()
+        if isinstance(event, CallbackQuery):
+            await event.answer(self.message)
+        elif isinstance(event, Message) and now - notified_at[0] >= self.notify_interval:
+            notified_at[0] = now
+            await event.answer(self.message)
+        return None
+
+    def stats(self) -> dict:
+        return {"passed": self.passed, "throttled": dict(self.throttled)}
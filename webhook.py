@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "pid": os.getpid()})
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret: str | None = None) -> web.Application:
+    app = web.Application()
+    app.router.add_get("/health", handle_health)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str,
+    url: str | None = None,
+    secret: str | None = None,
+    reuse_port: bool = False,
+):
+    """Serve Telegram updates over a webhook until cancelled; sets the webhook when url is given."""
+    app = build_webhook_app(dp, bot, path, secret)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, reuse_port=reuse_port or None)
+    await site.start()
+
+    if url:
+        await bot.set_webhook(
+            url.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info(f"Webhook set to {url.rstrip('/') + path}")
+
+    logging.info(f"Webhook server listening on {host}:{port}{path} (pid {os.getpid()})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()